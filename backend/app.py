@@ -1,7 +1,10 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import re
+import json
+import queue
+import time
 import secrets
 import smtplib
 import ssl
@@ -10,11 +13,23 @@ from dotenv import load_dotenv
 from flask_cors import CORS
 import jwt
 from werkzeug.security import generate_password_hash, check_password_hash
-from models.database import get_db_connection, init_db, seed_db
+from models.database import get_db_connection, db_connection, db_pool_stats, init_db, schema_version, seed_db
+from models.device_cache import put_device, device_cache, cache_stats
+from models.device_writer import device_writer, flush_device_writes
+from models.device_events import compactor, device_history, record_events, state_change
+from models.device_listing import DeviceListQuery, devices_version, listing_etag
 from werkzeug.utils import secure_filename
-from sdn.control_plane import control
-from models.policy import list_policies, upsert_policy, delete_policy
-from utils.acl import validate_acls
+from werkzeug.http import is_resource_modified
+from sdn.control_plane import control, pipeline, reenforcer
+from models.inventory import import_devices, import_vlan_profiles, ON_CONFLICT
+from models.policy import (
+    list_policies, get_policy, upsert_policy, delete_policy, get_engine, matching_criteria, PolicySimulation
+)
+from utils.acl import validate_acl, validate_acls
+from utils.acl_analysis import analyze_acls
+from utils.acl_classifier import compile_acls, normalize_flow
+from utils.streaming import iter_json_items, iter_records, RECORD_FORMATS
+from utils.mac import MacAddress
 
 load_dotenv()
 app = Flask(__name__)
@@ -22,11 +37,21 @@ CORS(app)
 API_KEY = os.getenv('API_KEY')
 JWT_SECRET = os.getenv('JWT_SECRET', 'change_this_dev_secret')
 JWT_ALG = 'HS256'
+# Query arguments that feed policy matching; see _policy_context()
+POLICY_CONTEXT_ARGS = ('ip', 'group', 'tenant')
 UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', os.path.abspath(os.path.join(os.path.dirname(__file__), 'uploads')))
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 BACKEND_BASE_URL = os.getenv('BACKEND_BASE_URL', 'http://localhost:5000')
 
+# Apply pending schema migrations once per process; request handlers never run DDL
+try:
+    init_db()
+except Exception as e:
+    print(f"[WARN] schema migration failed: {e}")
+# Periodic roll-up/expiry of device history (DEVICE_EVENTS_COMPACT_INTERVAL_S=0 disables)
+compactor.start()
+
 def _generate_token(user_id: int, username: str) -> str:
     payload = {
         'sub': user_id,
@@ -43,7 +68,7 @@ def _verify_token(token: str):
         return None
 
 def get_db_connection_legacy():
-    # Legacy shim retained for compatibility
+    # Legacy shim retained for compatibility; prefer db_connection()
     return get_db_connection()
 
 @app.before_request
@@ -58,10 +83,14 @@ def check_api_key():
     open_prefixes = (
         '/sdn/validate/', '/validate/', '/uploads/'
     )
+    # Policy context (?ip=&group=&tenant=) decides which VLAN gets programmed,
+    # so callers supplying it must be authenticated like any other write
+    trusted_args = any(request.args.get(k) for k in POLICY_CONTEXT_ARGS)
     if (
         request.path in open_paths
         or request.method == 'OPTIONS'
-        or (request.method == 'GET' and any(request.path.startswith(p) for p in open_prefixes))
+        or (request.method == 'GET' and not trusted_args
+            and any(request.path.startswith(p) for p in open_prefixes))
     ):
         return None
     # Prefer Bearer token (sets auth.user) and then fall back to X-API-KEY
@@ -89,29 +118,27 @@ def auth_register():
     # Very basic email validation
     if '@' not in email or '.' not in email.split('@')[-1]:
         return jsonify({'error': 'invalid email'}), 400
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT id FROM users WHERE username = ?", (username,))
-        if cur.fetchone():
-            return jsonify({'error': 'username already exists'}), 409
-        # Ensure email uniqueness
-        cur.execute("SELECT id FROM users WHERE email = ?", (email,))
-        if cur.fetchone():
-            return jsonify({'error': 'email already exists'}), 409
-        pwd_hash = generate_password_hash(password)
-        cur.execute(
-            "INSERT INTO users (username, email, password_hash, created_at) VALUES (?, ?, ?, datetime('now'))",
-            (username, email, pwd_hash)
-        )
-        conn.commit()
-        user_id = cur.lastrowid
-        token = _generate_token(user_id, username)
-        return jsonify({'token': token, 'user': {'id': user_id, 'username': username, 'email': email}})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT id FROM users WHERE username = ?", (username,))
+            if cur.fetchone():
+                return jsonify({'error': 'username already exists'}), 409
+            # Ensure email uniqueness
+            cur.execute("SELECT id FROM users WHERE email = ?", (email,))
+            if cur.fetchone():
+                return jsonify({'error': 'email already exists'}), 409
+            pwd_hash = generate_password_hash(password)
+            cur.execute(
+                "INSERT INTO users (username, email, password_hash, created_at) VALUES (?, ?, ?, datetime('now'))",
+                (username, email, pwd_hash)
+            )
+            conn.commit()
+            user_id = cur.lastrowid
+            token = _generate_token(user_id, username)
+            return jsonify({'token': token, 'user': {'id': user_id, 'username': username, 'email': email}})
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
 
 def _send_email(to_email: str, subject: str, body_text: str) -> None:
     """Send an email using Gmail SMTP. Requires env GMAIL_USER and GMAIL_APP_PASSWORD."""
@@ -159,62 +186,60 @@ def auth_forgot_password():
     if not identifier:
         # Always respond generic
         return jsonify({'message': 'If an account exists, a reset link has been sent.'})
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        # Look up by email first, then username
-        cur.execute("SELECT id, username, email FROM users WHERE lower(email) = ?", (identifier,))
-        row = cur.fetchone()
-        if not row:
-            cur.execute("SELECT id, username, email FROM users WHERE lower(username) = ?", (identifier,))
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            # Look up by email first, then username
+            cur.execute("SELECT id, username, email FROM users WHERE lower(email) = ?", (identifier,))
             row = cur.fetchone()
-        if row and row['email']:
-            user_id = row['id']
-            email = row['email']
-            token = _generate_reset_token()
-            expires_at = (datetime.utcnow() + timedelta(hours=1)).isoformat() + 'Z'
-            cur.execute(
-                "INSERT INTO reset_tokens (user_id, token, expires_at, used, created_at) VALUES (?, ?, ?, 0, datetime('now'))",
-                (user_id, token, expires_at)
-            )
-            conn.commit()
-            # Build reset URL
-            base_url = os.getenv('FRONTEND_BASE_URL', 'http://localhost:3000')
-            reset_link = f"{base_url}/reset-password?token={token}"
-            dev_mode = os.getenv('EMAIL_DEV_MODE', '0') == '1'
-            if dev_mode:
-                # In dev mode, include the link in response for easier testing
-                try:
-                    print(f"[DEV] Password reset link for {email}: {reset_link}")
-                except Exception:
-                    pass
-                return jsonify({'message': 'If an account exists, a reset link has been sent.', 'dev_reset_link': reset_link})
-            else:
-                try:
-                    _send_email(
-                        to_email=email,
-                        subject='PulseNet password reset',
-                        body_text=(
-                            f"Hello {row['username']},\n\n"
-                            f"We received a request to reset your PulseNet password.\n"
-                            f"Use the link below to set a new password. This link expires in 1 hour.\n\n"
-                            f"{reset_link}\n\n"
-                            f"If you did not request this, you can safely ignore this email.\n"
-                        ),
-                    )
-                except Exception as e:
-                    # Log link and error message to server logs if email sending fails
+            if not row:
+                cur.execute("SELECT id, username, email FROM users WHERE lower(username) = ?", (identifier,))
+                row = cur.fetchone()
+            if row and row['email']:
+                user_id = row['id']
+                email = row['email']
+                token = _generate_reset_token()
+                expires_at = (datetime.utcnow() + timedelta(hours=1)).isoformat() + 'Z'
+                cur.execute(
+                    "INSERT INTO reset_tokens (user_id, token, expires_at, used, created_at) VALUES (?, ?, ?, 0, datetime('now'))",
+                    (user_id, token, expires_at)
+                )
+                conn.commit()
+                # Build reset URL
+                base_url = os.getenv('FRONTEND_BASE_URL', 'http://localhost:3000')
+                reset_link = f"{base_url}/reset-password?token={token}"
+                dev_mode = os.getenv('EMAIL_DEV_MODE', '0') == '1'
+                if dev_mode:
+                    # In dev mode, include the link in response for easier testing
                     try:
-                        print(f"[WARN] Email send failed: {e}. Password reset link for {email}: {reset_link}")
+                        print(f"[DEV] Password reset link for {email}: {reset_link}")
                     except Exception:
                         pass
-        # Always respond generic
-        return jsonify({'message': 'If an account exists, a reset link has been sent.'})
-    except Exception as e:
-        # Still keep response generic
-        return jsonify({'message': 'If an account exists, a reset link has been sent.'})
-    finally:
-        conn.close()
+                    return jsonify({'message': 'If an account exists, a reset link has been sent.', 'dev_reset_link': reset_link})
+                else:
+                    try:
+                        _send_email(
+                            to_email=email,
+                            subject='PulseNet password reset',
+                            body_text=(
+                                f"Hello {row['username']},\n\n"
+                                f"We received a request to reset your PulseNet password.\n"
+                                f"Use the link below to set a new password. This link expires in 1 hour.\n\n"
+                                f"{reset_link}\n\n"
+                                f"If you did not request this, you can safely ignore this email.\n"
+                            ),
+                        )
+                    except Exception as e:
+                        # Log link and error message to server logs if email sending fails
+                        try:
+                            print(f"[WARN] Email send failed: {e}. Password reset link for {email}: {reset_link}")
+                        except Exception:
+                            pass
+            # Always respond generic
+            return jsonify({'message': 'If an account exists, a reset link has been sent.'})
+        except Exception as e:
+            # Still keep response generic
+            return jsonify({'message': 'If an account exists, a reset link has been sent.'})
 
 @app.route('/auth/reset-password', methods=['POST'])
 def auth_reset_password():
@@ -225,30 +250,28 @@ def auth_reset_password():
         return jsonify({'error': 'invalid request'}), 400
     if not _is_strong_password(password):
         return jsonify({'error': 'weak password'}), 400
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT user_id, expires_at, used FROM reset_tokens WHERE token = ?", (token,))
-        row = cur.fetchone()
-        if not row:
-            return jsonify({'error': 'invalid token'}), 400
-        # Check expiry and used
+    with db_connection() as conn:
         try:
-            exp = datetime.fromisoformat(row['expires_at'].replace('Z', ''))
-        except Exception:
-            exp = datetime.utcnow() - timedelta(seconds=1)
-        if row['used'] or datetime.utcnow() > exp:
-            return jsonify({'error': 'token expired'}), 400
-        user_id = row['user_id']
-        pwd_hash = generate_password_hash(password)
-        cur.execute("UPDATE users SET password_hash = ? WHERE id = ?", (pwd_hash, user_id))
-        cur.execute("UPDATE reset_tokens SET used = 1 WHERE token = ?", (token,))
-        conn.commit()
-        return jsonify({'message': 'password updated'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
+            cur = conn.cursor()
+            cur.execute("SELECT user_id, expires_at, used FROM reset_tokens WHERE token = ?", (token,))
+            row = cur.fetchone()
+            if not row:
+                return jsonify({'error': 'invalid token'}), 400
+            # Check expiry and used
+            try:
+                exp = datetime.fromisoformat(row['expires_at'].replace('Z', ''))
+            except Exception:
+                exp = datetime.utcnow() - timedelta(seconds=1)
+            if row['used'] or datetime.utcnow() > exp:
+                return jsonify({'error': 'token expired'}), 400
+            user_id = row['user_id']
+            pwd_hash = generate_password_hash(password)
+            cur.execute("UPDATE users SET password_hash = ? WHERE id = ?", (pwd_hash, user_id))
+            cur.execute("UPDATE reset_tokens SET used = 1 WHERE token = ?", (token,))
+            conn.commit()
+            return jsonify({'message': 'password updated'})
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
 
 @app.route('/auth/change-password', methods=['POST'])
 def auth_change_password():
@@ -274,53 +297,51 @@ def auth_change_password():
         return jsonify({'error': 'new password is required', 'hint': "use 'newPassword' or 'password'"}), 400
     if not _is_strong_password(new_password):
         return jsonify({'error': 'weak password'}), 400
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        # Preferred path: JWT present -> use user_id from token
-        if user_id:
-            cur.execute("SELECT password_hash FROM users WHERE id = ?", (user_id,))
-            row = cur.fetchone()
-            if not row:
-                return jsonify({'error': 'user not found'}), 404
-            current_hash = row['password_hash'] if 'password_hash' in row.keys() else row[0]
-            if current_hash:
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            # Preferred path: JWT present -> use user_id from token
+            if user_id:
+                cur.execute("SELECT password_hash FROM users WHERE id = ?", (user_id,))
+                row = cur.fetchone()
+                if not row:
+                    return jsonify({'error': 'user not found'}), 404
+                current_hash = row['password_hash'] if 'password_hash' in row.keys() else row[0]
+                if current_hash:
+                    try:
+                        if not old_password or not check_password_hash(current_hash, old_password):
+                            return jsonify({'error': 'invalid current password', 'hint': "include 'currentPassword' or 'oldPassword'"}), 400
+                    except Exception:
+                        return jsonify({'error': 'password verification failed'}), 400
+                new_hash = generate_password_hash(new_password)
+                cur.execute("UPDATE users SET password_hash = ? WHERE id = ?", (new_hash, user_id))
                 try:
-                    if not old_password or not check_password_hash(current_hash, old_password):
-                        return jsonify({'error': 'invalid current password', 'hint': "include 'currentPassword' or 'oldPassword'"}), 400
+                    print(f"[INFO] Password changed via JWT for user_id={user_id}")
                 except Exception:
-                    return jsonify({'error': 'password verification failed'}), 400
-            new_hash = generate_password_hash(new_password)
-            cur.execute("UPDATE users SET password_hash = ? WHERE id = ?", (new_hash, user_id))
-            try:
-                print(f"[INFO] Password changed via JWT for user_id={user_id}")
-            except Exception:
-                pass
-        else:
-            # Fallback path: allow change with explicit username + oldPassword (for API-key based UIs)
-            username = (data.get('username') or data.get('user') or '').strip()
-            if not username:
-                return jsonify({'error': 'Unauthorized', 'hint': 'send Bearer token or include username + oldPassword'}), 401
-            cur.execute("SELECT id, password_hash FROM users WHERE username = ?", (username,))
-            row = cur.fetchone()
-            if not row:
-                return jsonify({'error': 'user not found'}), 404
-            uid = row['id'] if 'id' in row.keys() else row[0]
-            current_hash = row['password_hash'] if 'password_hash' in row.keys() else row[1]
-            if not old_password or not current_hash or not check_password_hash(current_hash, old_password):
-                return jsonify({'error': 'invalid current password'}), 400
-            new_hash = generate_password_hash(new_password)
-            cur.execute("UPDATE users SET password_hash = ? WHERE id = ?", (new_hash, uid))
-            try:
-                print(f"[INFO] Password changed via fallback for username={username} (id={uid})")
-            except Exception:
-                pass
-        conn.commit()
-        return jsonify({'message': 'password updated'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
+                    pass
+            else:
+                # Fallback path: allow change with explicit username + oldPassword (for API-key based UIs)
+                username = (data.get('username') or data.get('user') or '').strip()
+                if not username:
+                    return jsonify({'error': 'Unauthorized', 'hint': 'send Bearer token or include username + oldPassword'}), 401
+                cur.execute("SELECT id, password_hash FROM users WHERE username = ?", (username,))
+                row = cur.fetchone()
+                if not row:
+                    return jsonify({'error': 'user not found'}), 404
+                uid = row['id'] if 'id' in row.keys() else row[0]
+                current_hash = row['password_hash'] if 'password_hash' in row.keys() else row[1]
+                if not old_password or not current_hash or not check_password_hash(current_hash, old_password):
+                    return jsonify({'error': 'invalid current password'}), 400
+                new_hash = generate_password_hash(new_password)
+                cur.execute("UPDATE users SET password_hash = ? WHERE id = ?", (new_hash, uid))
+                try:
+                    print(f"[INFO] Password changed via fallback for username={username} (id={uid})")
+                except Exception:
+                    pass
+            conn.commit()
+            return jsonify({'message': 'password updated'})
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
 
 @app.route('/auth/login', methods=['POST'])
 def auth_login():
@@ -329,19 +350,17 @@ def auth_login():
     password = data.get('password') or ''
     if not username or not password:
         return jsonify({'error': 'username and password are required'}), 400
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT id, password_hash, email FROM users WHERE username = ?", (username,))
-        row = cur.fetchone()
-        if not row or not check_password_hash(row['password_hash'], password):
-            return jsonify({'error': 'invalid credentials'}), 401
-        token = _generate_token(row['id'], username)
-        return jsonify({'token': token, 'user': {'id': row['id'], 'username': username, 'email': row['email']}})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT id, password_hash, email FROM users WHERE username = ?", (username,))
+            row = cur.fetchone()
+            if not row or not check_password_hash(row['password_hash'], password):
+                return jsonify({'error': 'invalid credentials'}), 401
+            token = _generate_token(row['id'], username)
+            return jsonify({'token': token, 'user': {'id': row['id'], 'username': username, 'email': row['email']}})
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
 
 @app.route('/auth/me', methods=['GET'])
 def auth_me():
@@ -353,19 +372,14 @@ def auth_me():
     if not data:
         return jsonify({'error': 'Unauthorized'}), 401
     # Optionally hydrate email by querying DB
-    conn = get_db_connection()
     try:
-        cur = conn.cursor()
-        cur.execute("SELECT email FROM users WHERE id = ?", (data.get('sub'),))
-        row = cur.fetchone()
-        email = row['email'] if row and 'email' in row.keys() else None
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT email FROM users WHERE id = ?", (data.get('sub'),))
+            row = cur.fetchone()
+            email = row['email'] if row and 'email' in row.keys() else None
     except Exception:
         email = None
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
     return jsonify({'user': {'id': data.get('sub'), 'username': data.get('username'), 'email': email}})
 
 # --- Profile Endpoints ---
@@ -375,29 +389,27 @@ def profile_me():
     user_id = auth_user.get('sub')
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT username, email, display_name, avatar_url FROM users WHERE id = ?", (user_id,))
-        row = cur.fetchone()
-        if not row:
-            return jsonify({'error': 'user not found'}), 404
-        # Normalize avatar URL to absolute
-        raw_avatar = row['avatar_url'] if 'avatar_url' in row.keys() else None
-        if raw_avatar and raw_avatar.startswith('/'):
-            avatar_url = f"{BACKEND_BASE_URL}{raw_avatar}"
-        else:
-            avatar_url = raw_avatar
-        return jsonify({
-            'username': row['username'],
-            'email': row['email'],
-            'displayName': row['display_name'] if 'display_name' in row.keys() else None,
-            'avatarUrl': avatar_url,
-        })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT username, email, display_name, avatar_url FROM users WHERE id = ?", (user_id,))
+            row = cur.fetchone()
+            if not row:
+                return jsonify({'error': 'user not found'}), 404
+            # Normalize avatar URL to absolute
+            raw_avatar = row['avatar_url'] if 'avatar_url' in row.keys() else None
+            if raw_avatar and raw_avatar.startswith('/'):
+                avatar_url = f"{BACKEND_BASE_URL}{raw_avatar}"
+            else:
+                avatar_url = raw_avatar
+            return jsonify({
+                'username': row['username'],
+                'email': row['email'],
+                'displayName': row['display_name'] if 'display_name' in row.keys() else None,
+                'avatarUrl': avatar_url,
+            })
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
 
 @app.route('/profile/update', methods=['POST'])
 def profile_update():
@@ -407,16 +419,14 @@ def profile_update():
         return jsonify({'error': 'Unauthorized'}), 401
     data = request.json or {}
     display_name = (data.get('displayName') or '').strip()
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute("UPDATE users SET display_name = ? WHERE id = ?", (display_name, user_id))
-        conn.commit()
-        return jsonify({'message': 'profile updated'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute("UPDATE users SET display_name = ? WHERE id = ?", (display_name, user_id))
+            conn.commit()
+            return jsonify({'message': 'profile updated'})
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
 
 @app.route('/profile/avatar', methods=['POST'])
 def profile_avatar():
@@ -435,13 +445,10 @@ def profile_avatar():
     # Store relative path in DB but return absolute URL in response
     relative_path = f"/uploads/{filename}"
     avatar_url = f"{BACKEND_BASE_URL}{relative_path}"
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         cur.execute("UPDATE users SET avatar_url = ? WHERE id = ?", (relative_path, user_id))
         conn.commit()
-    finally:
-        conn.close()
     return jsonify({'avatarUrl': avatar_url})
 
 @app.route('/uploads/<path:filename>', methods=['GET'])
@@ -450,28 +457,47 @@ def serve_upload(filename):
 
 @app.route('/devices', methods=['GET'])
 def get_devices():
-    conn = get_db_connection()
+    """List devices; see DeviceListQuery for filters, sort and pagination.
+
+    Without ``limit``/``cursor`` the matching devices are streamed as a bare
+    JSON array (the original response shape); with them a page
+    ``{"items", "nextCursor", "limit"}`` is returned. Either way the ETag and
+    Last-Modified come from the devices change counter, so an unchanged
+    poll is answered 304 without touching the table.
+    """
     try:
-        cur = conn.cursor()
-        cur.execute("SELECT mac, username, authorized, vlan FROM devices")
-        rows = [dict(r) for r in cur.fetchall()]
-        # Filter out invalid/blank MAC rows to avoid ghost entries in the UI
-        valid = []
-        mac_hyphen_re = re.compile(r"^[0-9A-F]{2}(-[0-9A-F]{2}){5}$")
-        mac_colon_re = re.compile(r"^[0-9A-F]{2}(:[0-9A-F]{2}){5}$")
-        for r in rows:
-            mac_val = (r.get('mac') or '').strip().upper()
-            if mac_val and (mac_hyphen_re.match(mac_val) or mac_colon_re.match(mac_val)):
-                valid.append(r)
-        rows = valid
-        # normalize authorized int to bool for JSON
-        for r in rows:
-            r['authorized'] = bool(r.get('authorized', 0))
-        return jsonify(rows)
+        query = DeviceListQuery(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Queued admission writes must be visible to a table read
+    flush_device_writes()
+    try:
+        with db_connection() as conn:
+            version, updated_at = devices_version(conn)
+            etag = listing_etag(version, request.args)
+            last_modified = datetime.fromtimestamp(updated_at, timezone.utc)
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                resp = Response(status=304)
+            elif query.paginated:
+                resp = jsonify(query.page(conn))
+            else:
+                resp = None
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
+    if resp is None:
+        def generate():
+            # Written row by row: a large fleet is never materialized as one list
+            with db_connection() as conn:
+                yield '['
+                for i, device in enumerate(query.iter_devices(conn)):
+                    yield (',' if i else '') + json.dumps(device)
+                yield ']'
+
+        resp = Response(stream_with_context(generate()), mimetype='application/json')
+    resp.set_etag(etag)
+    resp.last_modified = last_modified
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
 
 @app.route('/api/intents', methods=['POST'])
 def api_intents():
@@ -482,51 +508,115 @@ def api_intents():
     tenant = data.get('tenant') or 'default'
     if not src or not dst:
         return jsonify({'error': 'src and dst are required'}), 400
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        # Ensure intents table exists
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS intents (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              src TEXT NOT NULL,
-              dst TEXT NOT NULL,
-              constraints TEXT,
-              tenant TEXT,
-              status TEXT,
-              created_at TEXT
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                "INSERT INTO intents (src, dst, constraints, tenant, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (src, dst, str(constraints), tenant, 'ACCEPTED', datetime.utcnow().isoformat() + 'Z')
             )
-            """
-        )
-        cur.execute(
-            "INSERT INTO intents (src, dst, constraints, tenant, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-            (src, dst, str(constraints), tenant, 'ACCEPTED', datetime.utcnow().isoformat() + 'Z')
-        )
-        conn.commit()
-        intent_id = cur.lastrowid
-        # Minimal compiledFlows count; in a real system this would be produced by the compiler
-        compiled_flows = 1
-        return jsonify({'id': intent_id, 'status': 'ACCEPTED', 'compiledFlows': compiled_flows})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
+            conn.commit()
+            intent_id = cur.lastrowid
+            # Minimal compiledFlows count; in a real system this would be produced by the compiler
+            compiled_flows = 1
+            return jsonify({'id': intent_id, 'status': 'ACCEPTED', 'compiledFlows': compiled_flows})
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+def _policy_context():
+    """Request attributes policies may match on: ?ip=&group=a,b&tenant=
+
+    Only honoured on authenticated requests; check_api_key lets the open
+    GET validate routes through only when none of these are given.
+    """
+    context = {}
+    if request.args.get('ip'):
+        context['ip'] = request.args['ip']
+    if request.args.get('group'):
+        context['group'] = [g.strip() for g in request.args['group'].split(',') if g.strip()]
+    if request.args.get('tenant'):
+        context['tenant'] = request.args['tenant']
+    return context or None
+
 @app.route('/validate/<mac>', methods=['GET'])
 def validate_mac(mac):
     # Route validation via SDN control plane
-    result = control.validate_and_program(mac)
+    result = control.validate_and_program(mac, context=_policy_context())
     return jsonify(result)
 
 @app.route('/sdn/validate/<mac>', methods=['GET'])
 def sdn_validate(mac):
-    result = control.validate_and_program(mac)
+    result = control.validate_and_program(mac, context=_policy_context())
     return jsonify(result)
 
+@app.route('/sdn/validate/batch', methods=['POST'])
+def sdn_validate_batch():
+    data = request.json
+    # Accept either a bare array of MACs or {"macs": [...]}
+    macs = data.get('macs') if isinstance(data, dict) else data
+    if not isinstance(macs, list):
+        return jsonify({'error': 'macs must be an array'}), 400
+    results = control.validate_and_program_many(macs)
+    return jsonify({'results': results})
+
+@app.route('/sdn/admit/<mac>', methods=['POST'])
+def sdn_admit(mac):
+    # Asynchronous admission: answer with the decision, program the data plane in the background
+    try:
+        job = pipeline.submit(mac)
+    except queue.Full:
+        return jsonify({'error': 'admission pipeline is saturated'}), 503
+    if job.status == 'failed':
+        return jsonify(job.to_dict()), 400
+    return jsonify(job.to_dict()), 202
+
+@app.route('/sdn/jobs/<job_id>', methods=['GET'])
+def sdn_job_status(job_id):
+    # Optional ?wait=<seconds> long-polls until programming finishes
+    try:
+        wait = min(float(request.args.get('wait', 0)), 30.0)
+    except ValueError:
+        return jsonify({'error': 'wait must be a number'}), 400
+    job = pipeline.wait(job_id, wait)
+    if job is None:
+        return jsonify({'error': 'job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/sdn/pipeline/stats', methods=['GET'])
+def sdn_pipeline_stats():
+    return jsonify(pipeline.stats())
+
+@app.route('/sdn/cache/stats', methods=['GET'])
+def sdn_cache_stats():
+    return jsonify(dict(cache_stats(), **control.stats()))
+
+@app.route('/sdn/db/stats', methods=['GET'])
+def sdn_db_stats():
+    with db_connection() as conn:
+        version = schema_version(conn)
+    return jsonify(dict(db_pool_stats(), schemaVersion=version, history=compactor.stats()))
+
+@app.route('/sdn/southbound/stats', methods=['GET'])
+def sdn_southbound_stats():
+    from sdn.southbound import driver, nbi
+    stats = getattr(driver, 'stats', None)
+    return jsonify({
+        'driver': type(driver).__name__,
+        'stats': stats() if stats else {},
+        'executor': nbi.executor_stats(),
+    })
+
+@app.route('/sdn/southbound/reconcile', methods=['POST'])
+def sdn_southbound_reconcile():
+    from sdn.southbound import driver
+    reconcile = getattr(driver, 'reconcile', None)
+    if reconcile is None:
+        return jsonify({'error': 'driver does not support reconcile'}), 400
+    return jsonify(reconcile())
+
 @app.route('/sdn/enforce/<mac>', methods=['POST'])
 def sdn_enforce(mac):
-    # Re-apply policy/programming for the given MAC (idempotent)
-    result = control.validate_and_program(mac)
+    # Re-apply policy/programming for the given MAC even if nothing changed
+    result = control.validate_and_program(mac, force=True, context=_policy_context())
     return jsonify(result)
 
 @app.route('/sdn/policies', methods=['GET'])
@@ -543,81 +633,223 @@ def sdn_upsert_policy():
         return jsonify({'error': 'name and vlan are required'}), 400
     try:
         vlan = int(vlan)
+        priority = int(data.get('priority') or 0)
     except Exception:
-        return jsonify({'error': 'vlan must be integer'}), 400
-    return jsonify(upsert_policy(name, vlan, criteria))
+        return jsonify({'error': 'vlan and priority must be integers'}), 400
+    previous = get_policy(name)
+    try:
+        policy = upsert_policy(name, vlan, criteria, priority)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Devices matched by either the old or the new version may change VLAN
+    affected = matching_criteria(policy) + (matching_criteria(previous) if previous else [])
+    task = reenforcer.submit(name, 'update' if previous else 'create', affected)
+    return jsonify(dict(policy, reenforcement=task.to_dict()))
+
+@app.route('/sdn/policies/engine', methods=['GET'])
+def sdn_policy_engine_stats():
+    return jsonify(get_engine().stats())
+
+@app.route('/sdn/policies/simulate', methods=['POST'])
+def sdn_simulate_policies():
+    """What-if: stream per-device VLAN/authorization diffs for proposed policy changes.
+
+    Body: {"changes": [{"op": "upsert"|"delete", "name", "vlan", "criteria", "priority"}]}.
+    Answers NDJSON (one line per changed device, then {"summary": ...});
+    ?summary=1 returns only the summary as JSON.
+    """
+    data = request.json or {}
+    changes = data.get('changes') if isinstance(data, dict) else data
+    try:
+        simulation = PolicySimulation(changes)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if request.args.get('summary') in ('1', 'true'):
+        for _ in simulation.iter_diffs():
+            pass
+        return jsonify(simulation.summary)
+
+    def generate():
+        for diff in simulation.iter_diffs():
+            yield json.dumps(diff) + '\n'
+        yield json.dumps({'summary': simulation.summary}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 @app.route('/sdn/policies/<name>', methods=['DELETE'])
 def sdn_delete_policy(name):
+    previous = get_policy(name)
     deleted = delete_policy(name)
-    return jsonify({'deleted': deleted})
+    if not (deleted and previous):
+        return jsonify({'deleted': deleted})
+    task = reenforcer.submit(name, 'delete', matching_criteria(previous))
+    return jsonify({'deleted': deleted, 'reenforcement': task.to_dict()})
+
+@app.route('/sdn/reenforcement', methods=['GET'])
+def sdn_reenforcement_tasks():
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), 1000))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    return jsonify({'tasks': reenforcer.list_tasks(limit), 'stats': reenforcer.stats()})
+
+@app.route('/sdn/reenforcement/<task_id>', methods=['GET'])
+def sdn_reenforcement_task(task_id):
+    task = reenforcer.get_task(task_id)
+    if task is None:
+        return jsonify({'error': 'task not found'}), 404
+    return jsonify(task.to_dict())
 
 # --- ACL validation and apply ---
+ACL_STREAM_CHUNK = int(os.getenv('ACL_STREAM_CHUNK', '1000'))
+
+def _acl_stream_requested():
+    return request.args.get('stream') in ('1', 'true') or request.mimetype == 'application/x-ndjson'
+
+def _stream_acls(apply_range=None):
+    """Validate a JSON array / NDJSON ACL body as it arrives, answering in NDJSON.
+
+    Each issue is written out as soon as its rule is parsed. With
+    ``apply_range`` valid rules are handed to the driver every
+    ACL_STREAM_CHUNK rules, so neither side holds the whole ACL. ACLs are
+    first-match, so dropping a bad rule could open what it was meant to
+    block: after the first issue nothing more is sent to the driver and the
+    old tail is not truncated. The summary then has ``ok`` false,
+    ``partial`` true if earlier chunks were already applied, and
+    ``applied`` counts the leading rules replaced; validation carries on to
+    report every issue.
+    """
+    body = request.stream
+
+    def generate():
+        total = valid = issues = 0
+        position = 0
+        pending = []
+        counts = {'added': 0, 'removed': 0, 'moved': 0, 'unchanged': 0, 'operations': 0}
+        ok = True
+
+        def flush(truncate):
+            nonlocal position, pending, ok
+            result = apply_range(position, pending, truncate)
+            ok = ok and bool(result.get('ok'))
+            for key in counts:
+                counts[key] += result.get(key) or 0
+            position += len(pending)
+            pending = []
+            return json.dumps({'applied': position, 'operations': result.get('operations')}) + '\n'
+
+        for index, item, error in iter_json_items(body):
+            total += 1
+            rule, issue = (None, f"ACL[{index}]: {error}") if error else validate_acl(index, item)
+            if issue:
+                issues += 1
+                pending = []
+                yield json.dumps({'index': index, 'issue': issue}) + '\n'
+                continue
+            valid += 1
+            if apply_range is not None and not issues:
+                pending.append(rule)
+                if len(pending) >= ACL_STREAM_CHUNK:
+                    yield flush(False)
+        summary = {'ok': issues == 0, 'total': total, 'valid': valid, 'issues': issues}
+        if apply_range is not None:
+            if not issues:
+                yield flush(True)
+            summary.update(counts, ok=ok and issues == 0, applied=position, partial=bool(issues and position))
+        yield json.dumps({'summary': summary}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/sdn/validate/acls', methods=['POST'])
 def sdn_validate_acls():
+    if _acl_stream_requested():
+        return _stream_acls()
     items = request.json or []
     result = validate_acls(items)
     # Do not return normalized rules to the UI unless needed; include for visibility
-    return jsonify({ 'ok': result.get('ok'), 'issues': result.get('issues'), 'rules': result.get('rules') })
+    payload = { 'ok': result.get('ok'), 'issues': result.get('issues'), 'rules': result.get('rules') }
+    optimize = request.args.get('optimize') in ('1', 'true')
+    if result.get('ok') and (optimize or request.args.get('analyze') in ('1', 'true')):
+        payload['analysis'] = analyze_acls(result.get('rules') or [], optimize=optimize)
+        if optimize:
+            payload['optimized'] = payload['analysis'].pop('optimized')
+    return jsonify(payload)
 
 @app.route('/sdn/apply/acls', methods=['POST'])
 def sdn_apply_acls():
+    if _acl_stream_requested():
+        from sdn.southbound import nbi
+        return _stream_acls(nbi.update_acl_range)
     items = request.json or []
     result = validate_acls(items)
     if not result.get('ok'):
         return jsonify({ 'ok': False, 'issues': result.get('issues') }), 400
-    # Clear then apply
-    try:
-        from sdn.southbound import nbi
-        nbi.quarantine_mac  # touch to ensure import
-    except Exception:
-        pass
+    # Apply only the difference against what the driver has installed
     from sdn.southbound import nbi
-    nbi._driver and getattr(nbi._driver, 'clear_acls', lambda: True)()
-    applied = nbi._driver and getattr(nbi._driver, 'apply_acls', lambda _rules: True)(result.get('rules') or [])
-    return jsonify({ 'ok': bool(applied), 'applied': len(result.get('rules') or []) })
+    rules = result.get('rules') or []
+    delta = nbi.update_acls(rules)
+    return jsonify({ 'ok': bool(delta.get('ok')), 'applied': len(rules), **{k: v for k, v in delta.items() if k != 'ok'} })
+
+@app.route('/sdn/acl/evaluate', methods=['POST'])
+def sdn_acl_evaluate():
+    """Run a batch of (proto, src, dst, port) flows through a compiled ACL; first match wins."""
+    data = request.json or {}
+    compiled = compile_acls(data.get('acls') or [])
+    if not compiled.get('ok'):
+        return jsonify({ 'ok': False, 'issues': compiled.get('issues') }), 400
+    flows = []
+    for i, flow in enumerate(data.get('flows') or []):
+        try:
+            flows.append(normalize_flow(flow))
+        except (TypeError, ValueError) as e:
+            return jsonify({ 'ok': False, 'issues': [f"flows[{i}]: {e}"] }), 400
+    rules = compiled['rules']
+    started = time.perf_counter()
+    verdicts = compiled['classifier'].classify_many(flows)
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    summary = {'permit': 0, 'deny': 0, 'implicitDeny': 0}
+    results = []
+    for v in verdicts:
+        if v < 0:
+            summary['implicitDeny'] += 1
+            results.append({'action': 'deny', 'rule': None})
+        else:
+            action = rules[v]['action']
+            summary[action] += 1
+            results.append({'action': action, 'rule': v})
+    return jsonify({ 'ok': True, 'issues': compiled.get('issues'), 'results': results, 'summary': summary, 'elapsedMs': elapsed_ms })
 
 # --- Maintenance: purge invalid device rows (blank/invalid MAC values) ---
+MAC_KEY_MAX = (1 << 48) - 1
+# devices.mac_key rendered as hyphen-upper text, in SQL
+_MAC_TEXT_SQL = "printf('%02X-%02X-%02X-%02X-%02X-%02X', " + ", ".join(
+    f"(mac_key >> {shift}) & 255" for shift in (40, 32, 24, 16, 8, 0)
+) + ")"
+
 @app.route('/devices/purge-invalid', methods=['POST'])
 def purge_invalid_devices():
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        # Delete rows where mac is NULL/empty or not matching common MAC formats
-        cur.execute(
-            "DELETE FROM devices WHERE mac IS NULL OR TRIM(mac) = ''"
-        )
-        # Best-effort: also remove obviously malformed lengths
-        cur.execute(
-            "DELETE FROM devices WHERE LENGTH(REPLACE(REPLACE(REPLACE(mac,'-',''),':',''),'.','')) NOT IN (12)"
-        )
-        # Normalize remaining colon-upper MACs to hyphen-upper; deduplicate conflicts preferring hyphen form
-        cur.execute("SELECT mac, username, authorized, vlan FROM devices")
-        rows = cur.fetchall() or []
-        seen = {}
-        for r in rows:
-            raw = (r['mac'] or '').strip().upper()
-            compact = raw.replace('-', '').replace(':', '').replace('.', '')
-            if len(compact) != 12:
-                continue
-            hyphen = '-'.join([compact[i:i+2] for i in range(0,12,2)])
-            if raw != hyphen:
-                # move to hyphen form if not already existing
-                if hyphen in seen:
-                    # conflict: delete current row
-                    cur.execute("DELETE FROM devices WHERE mac = ?", (raw,))
-                else:
-                    # update to canonical form
-                    cur.execute("UPDATE devices SET mac = ? WHERE mac = ?", (hyphen, raw))
-                    seen[hyphen] = True
-            else:
-                seen[hyphen] = True
-        conn.commit()
-        return jsonify({'message': 'Invalid device rows purged'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
+    # Queued admission writes must be visible to a full-table read
+    flush_device_writes()
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            # mac_key is parsed on every write; drop anything outside 48 bits
+            cur.execute(
+                "DELETE FROM devices WHERE mac_key IS NULL OR mac_key < 0 OR mac_key > ?", (MAC_KEY_MAX,)
+            )
+            removed = cur.rowcount
+            # Re-derive the display text from the key where it drifted
+            cur.execute(
+                "UPDATE devices SET mac = {0} WHERE mac IS NOT {0}".format(_MAC_TEXT_SQL)
+            )
+            normalized = cur.rowcount
+            conn.commit()
+            # Rows were renamed/removed in bulk; drop cached entries wholesale
+            device_cache.clear()
+            control.forget_programmed()
+            return jsonify({'message': 'Invalid device rows purged', 'removed': removed, 'normalized': normalized})
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
 
 @app.route('/logs', methods=['GET'])
 def get_logs():
@@ -677,63 +909,63 @@ def api_alerts():
 @app.route('/api/topology', methods=['GET'])
 def api_topology():
     # Basic static spine-leaf with DB devices as leaves
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT mac FROM devices")
-        device_rows = cur.fetchall() or []
-        devices = [{'id': r['mac'], 'name': r['mac'], 'role': 'leaf'} for r in device_rows]
-        # Add one spine node
-        spine_id = 'SPINE-1'
-        devices.append({'id': spine_id, 'name': 'Spine-1', 'role': 'spine'})
-        links = [{'src': d['id'], 'dst': spine_id, 'utilization': 0} for d in devices if d['role'] == 'leaf']
-        payload = {
-            'devices': devices,
-            'links': links,
-            'updatedAt': datetime.utcnow().isoformat() + 'Z'
-        }
-        return jsonify(payload)
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
+    flush_device_writes()
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT mac FROM devices")
+            device_rows = cur.fetchall() or []
+            devices = [{'id': r['mac'], 'name': r['mac'], 'role': 'leaf'} for r in device_rows]
+            # Add one spine node
+            spine_id = 'SPINE-1'
+            devices.append({'id': spine_id, 'name': 'Spine-1', 'role': 'spine'})
+            links = [{'src': d['id'], 'dst': spine_id, 'utilization': 0} for d in devices if d['role'] == 'leaf']
+            payload = {
+                'devices': devices,
+                'links': links,
+                'updatedAt': datetime.utcnow().isoformat() + 'Z'
+            }
+            return jsonify(payload)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/flows', methods=['GET'])
 def api_flows():
     device_id = request.args.get('deviceId')
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        if device_id:
-            cur.execute("SELECT mac, authorized, vlan FROM devices WHERE mac = ?", (device_id,))
-        else:
-            cur.execute("SELECT mac, authorized, vlan FROM devices")
-        rows = cur.fetchall() or []
-        flows = []
-        for idx, r in enumerate(rows, start=1):
-            mac = (r['mac'] or '').replace('-', ':').lower()
-            if r['authorized'] and r['vlan'] is not None:
-                flows.append({
-                    'id': f'f{idx}',
-                    'deviceId': r['mac'],
-                    'match': f"ether,dl_src={mac}",
-                    'action': f"ALLOW:VLAN={r['vlan']}",
-                    'priority': 100
-                })
+    flush_device_writes()
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            if device_id:
+                key = MacAddress.parse(device_id)
+                cur.execute("SELECT mac_key, mac, authorized, vlan FROM devices WHERE mac_key = ?",
+                            (int(key) if key is not None else -1,))
             else:
-                flows.append({
-                    'id': f'f{idx}',
-                    'deviceId': r['mac'],
-                    'match': f"ether,dl_src={mac}",
-                    'action': "DROP",
-                    'priority': 90
-                })
-        return jsonify(flows)
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
+                cur.execute("SELECT mac_key, mac, authorized, vlan FROM devices")
+            rows = cur.fetchall() or []
+            flows = []
+            for idx, r in enumerate(rows, start=1):
+                mac = MacAddress(r['mac_key']).colon_lower
+                if r['authorized'] and r['vlan'] is not None:
+                    flows.append({
+                        'id': f'f{idx}',
+                        'deviceId': r['mac'],
+                        'match': f"ether,dl_src={mac}",
+                        'action': f"ALLOW:VLAN={r['vlan']}",
+                        'priority': 100
+                    })
+                else:
+                    flows.append({
+                        'id': f'f{idx}',
+                        'deviceId': r['mac'],
+                        'match': f"ether,dl_src={mac}",
+                        'action': "DROP",
+                        'priority': 90
+                    })
+            return jsonify(flows)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
 
 @app.route('/devices', methods=['POST'])
 def add_device():
@@ -745,66 +977,138 @@ def add_device():
         vlan_int = int(vlan)
     except Exception:
         return jsonify({'error': 'vlan must be integer'}), 400
-    # Normalize MAC into DB canonical hyphen-upper format; also accept colon/period/dash or bare formats
-    try:
-        raw = (mac or '').strip()
-        raw = raw.replace('.', '').replace(':', '').replace('-', '')
-        if len(raw) != 12:
-            return jsonify({'error': 'invalid MAC'}), 400
-        mac_norm = '-'.join([raw[i:i+2] for i in range(0, 12, 2)]).upper()
-    except Exception:
+    # Accepts colon/period/dash or bare formats; stored under its integer key
+    address = MacAddress.parse(mac)
+    if address is None:
         return jsonify({'error': 'invalid MAC'}), 400
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        # Prevent duplicates across different MAC text formats by pre-checking
-        mac_colon = mac_norm.replace('-', ':')
-        cur.execute("SELECT 1 FROM devices WHERE mac IN (?, ?)", (mac_norm, mac_colon))
-        if cur.fetchone():
-            return jsonify({'error': 'MAC address already exists'}), 409
-        # authorized defaults to 1 on create
-        cur.execute(
-            "INSERT INTO devices (mac, username, authorized, vlan) VALUES (?, ?, ?, ?)",
-            (mac_norm, username, 1, vlan_int),
-        )
-        conn.commit()
-        return jsonify({'message': 'Device added successfully'})
-    except Exception as e:
-        # Detect unique constraint violation
-        if 'UNIQUE' in str(e).upper() or 'unique constraint' in str(e).lower():
-            return jsonify({'error': 'MAC address already exists'}), 409
-        return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
+    mac_norm = address.hyphen_upper
+    # A device admitted by policy may still be queued for insert
+    flush_device_writes()
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            # authorized defaults to 1 on create; a duplicate MAC violates the mac_key primary key
+            cur.execute(
+                "INSERT INTO devices (mac_key, mac, username, authorized, vlan) VALUES (?, ?, ?, ?, ?)",
+                (int(address), mac_norm, username, 1, vlan_int),
+            )
+            record_events(conn, [state_change(address, None, {'authorized': True, 'vlan': vlan_int}, 'api')])
+            conn.commit()
+            put_device(mac_norm, {'mac': mac_norm, 'username': username, 'authorized': True, 'vlan': vlan_int})
+            return jsonify({'message': 'Device added successfully'})
+        except Exception as e:
+            # Detect unique constraint violation
+            if 'UNIQUE' in str(e).upper() or 'unique constraint' in str(e).lower():
+                return jsonify({'error': 'MAC address already exists'}), 409
+            return jsonify({'error': str(e)}), 500
 
 @app.route('/devices/<mac>', methods=['DELETE'])
 def delete_device(mac):
-    # Normalize user-supplied MAC to DB canonical format and try both forms
     try:
-        raw = (mac or '').strip()
-        raw_compact = raw.replace('.', '').replace(':', '').replace('-', '')
-        if len(raw_compact) == 12 and all(c in '0123456789abcdefABCDEF' for c in raw_compact):
-            mac_hyphen = '-'.join([raw_compact[i:i+2] for i in range(0, 12, 2)]).upper()
-            mac_colon = mac_hyphen.replace('-', ':')
-            candidates = (mac_hyphen, mac_colon)
-        else:
-            # Fallback: also try raw as-is
-            candidates = (raw,)
-        conn = get_db_connection()
-        cur = conn.cursor()
-        # Attempt delete against common stored variants
-        cur.execute("DELETE FROM devices WHERE mac IN ({})".format(','.join('?' for _ in candidates)), tuple(candidates))
-        conn.commit()
-        if cur.rowcount and cur.rowcount > 0:
+        address = MacAddress.parse(mac)
+        if address is None:
+            return jsonify({'error': 'MAC not found'}), 404
+        # Queued state for this MAC must not re-create the row after the delete
+        _queued, previous = device_writer.get(address.hyphen_upper)
+        unsaved = device_writer.discard([address.hyphen_upper])
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT authorized, vlan FROM devices WHERE mac_key = ?", (int(address),))
+            row = cur.fetchone()
+            if row is not None:
+                previous = dict(row)
+            cur.execute("DELETE FROM devices WHERE mac_key = ?", (int(address),))
+            deleted = (cur.rowcount or 0) + unsaved
+            if deleted and previous is not None:
+                record_events(conn, [state_change(address, previous, None, 'api')])
+            conn.commit()
+        # Remember the device as unknown so re-validations skip the DB
+        put_device(address.hyphen_upper, None)
+        control.forget_programmed([address.colon_lower])
+        if deleted and deleted > 0:
             return jsonify({'message': 'Device deleted successfully'})
         return jsonify({'error': 'MAC not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
+
+
+
+# --- Device history ---
+def _history_time(value):
+    """Unix seconds or ISO-8601 (a trailing Z is accepted); None when absent."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"invalid time: {value}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+@app.route('/devices/<mac>/history', methods=['GET'])
+def get_device_history(mac):
+    """State changes of one device, newest first: ?since=&until=&limit=&cursor=.
+
+    Compacted days come back as per-day summaries under ``days``.
+    """
+    address = MacAddress.parse(mac)
+    if address is None:
+        return jsonify({'error': 'invalid MAC'}), 400
+    try:
+        since = _history_time(request.args.get('since'))
+        until = _history_time(request.args.get('until'))
+        limit = int(request.args.get('limit', 100))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not 1 <= limit <= 1000:
+        return jsonify({'error': 'limit must be between 1 and 1000'}), 400
+    # Events of recent admissions may still be queued
+    flush_device_writes()
+    try:
+        with db_connection() as conn:
+            history = device_history(conn, address, since, until, limit, request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(history)
+
+@app.route('/devices/history/compact', methods=['POST'])
+def compact_device_history():
+    try:
+        return jsonify(compactor.compact())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# --- Bulk inventory import ---
+def _bulk_import(importer):
+    """Stream the request body into ``importer``; the body is never held in memory.
+
+    ?format=json|ndjson|csv|mapping (text/csv bodies default to csv),
+    ?onConflict=skip|update. Bad rows are reported, not fatal.
+    """
+    fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'json')
+    on_conflict = request.args.get('onConflict', 'skip')
+    if fmt not in RECORD_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(RECORD_FORMATS)}"}), 400
+    if on_conflict not in ON_CONFLICT:
+        return jsonify({'error': f"onConflict must be one of {', '.join(ON_CONFLICT)}"}), 400
+    try:
+        report = importer(iter_records(request.stream, fmt), on_conflict=on_conflict)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify(report)
+
+@app.route('/devices/bulk', methods=['POST'])
+def bulk_import_devices():
+    return _bulk_import(import_devices)
+
+@app.route('/vlan-profiles/bulk', methods=['POST'])
+def bulk_import_vlan_profiles():
+    return _bulk_import(import_vlan_profiles)
 
 if __name__ == '__main__':
     # Initialize SQLite and seed data
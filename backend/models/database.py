@@ -1,137 +1,609 @@
 import os
 import json
 import sqlite3
-from typing import Optional
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from utils.mac import MacAddress
 
 DB_FILENAME = 'devices.db'
 
+# Connection tuning; see _configure()
+DB_POOL_SIZE = int(os.getenv('NAC_DB_POOL_SIZE', '16'))
+DB_BUSY_TIMEOUT_MS = int(os.getenv('NAC_DB_BUSY_TIMEOUT_MS', '5000'))
+DB_CACHE_KB = int(os.getenv('NAC_DB_CACHE_KB', '16384'))
+DB_MMAP_MB = int(os.getenv('NAC_DB_MMAP_MB', '256'))
+
 def _db_path() -> str:
-    # Database lives in backend/ next to app.py
+    # Database lives in backend/ next to app.py; NAC_DB_PATH overrides (e.g. for benchmarks)
+    if os.getenv('NAC_DB_PATH'):
+        return os.path.abspath(os.getenv('NAC_DB_PATH'))
     here = os.path.dirname(__file__)
     return os.path.abspath(os.path.join(here, '..', DB_FILENAME))
 
+def _configure(conn: sqlite3.Connection) -> None:
+    # WAL lets readers run alongside the single writer; with synchronous=NORMAL
+    # a commit only syncs at checkpoints, which WAL keeps crash-safe.
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{DB_CACHE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_MB * 1024 * 1024}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+
 def get_db_connection() -> sqlite3.Connection:
-    """Create a SQLite connection with row factory for dict-like access."""
-    conn = sqlite3.connect(_db_path(), check_same_thread=False)
+    """Open a new, unpooled SQLite connection with row factory for dict-like access.
+
+    Application code should borrow connections through db_connection().
+    """
+    conn = sqlite3.connect(_db_path(), timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    _configure(conn)
     return conn
 
-def init_db() -> None:
-    """Create tables if they do not exist."""
-    conn = get_db_connection()
+class _ConnectionPool:
+    """Idle connections to one database file, reused across requests and threads.
+
+    A connection is only ever used by one borrower at a time. The pool does
+    not cap concurrency: when no idle connection is left a new one is
+    opened, and connections beyond ``size`` are closed on release.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self._idle: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop()
+            self.opened += 1
+        return get_db_connection()
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        try:
+            if conn.in_transaction:
+                # Same outcome as closing without commit
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'idle': len(self._idle), 'size': self.size, 'opened': self.opened, 'reused': self.reused}
+
+_pools: Dict[str, _ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def _pool() -> _ConnectionPool:
+    path = _db_path()
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(path, _ConnectionPool(DB_POOL_SIZE))
+    return pool
+
+@contextmanager
+def db_connection() -> Iterator[sqlite3.Connection]:
+    """Borrow a pooled connection for the duration of a with block.
+
+    Work must be committed explicitly; anything left uncommitted is rolled
+    back when the connection goes back to the pool.
+    """
+    pool = _pool()
+    conn = pool.acquire()
     try:
-        cur = conn.cursor()
-        # Devices table: store MAC in hyphen-upper canonical form, authorized as INTEGER 0/1
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS devices (
-                mac TEXT PRIMARY KEY,
-                username TEXT,
-                authorized INTEGER,
-                vlan INTEGER
+        yield conn
+    finally:
+        pool.release(conn)
+
+def db_pool_stats() -> Dict:
+    return _pool().stats()
+
+def close_db_connections() -> None:
+    """Close idle pooled connections, e.g. before forking or replacing the file."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close()
+
+_VERSION_BUMP_SQL = "UPDATE table_versions SET version = version + 1, updated_at = strftime('%s', 'now') WHERE name = ?"
+
+def bump_table_version(conn: sqlite3.Connection, name: str) -> None:
+    """Advance a table's change counter by hand, e.g. after writing with its triggers dropped."""
+    conn.execute(_VERSION_BUMP_SQL, (name,))
+
+def restore_deferred_schema(conn: sqlite3.Connection, table: Optional[str] = None) -> List[str]:
+    """Recreate indexes and triggers an import dropped (see models.inventory); returns their names.
+
+    Runs in the caller's transaction. Tables whose triggers come back get a
+    version bump for the rows written while they were gone.
+    """
+    sql = "SELECT tbl, type, name, sql FROM deferred_schema"
+    rows = conn.execute(sql + " WHERE tbl = ?" if table else sql, (table,) if table else ()).fetchall()
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('index', 'trigger')")}
+    for tbl, kind, name, definition in rows:
+        if name not in existing:
+            conn.execute(definition)
+        conn.execute("DELETE FROM deferred_schema WHERE name = ?", (name,))
+    for tbl in {r[0] for r in rows if r[1] == 'trigger'}:
+        bump_table_version(conn, tbl)
+    return [r[2] for r in rows]
+
+def criteria_rows(criteria) -> list:
+    """(kind, value, value_json) rows for a criteria dict or its JSON text."""
+    if isinstance(criteria, str):
+        try:
+            criteria = json.loads(criteria) if criteria else {}
+        except ValueError:
+            criteria = {}
+    if not isinstance(criteria, dict):
+        return []
+    return [
+        (str(kind), value if isinstance(value, str) else None, json.dumps(value))
+        for kind, value in criteria.items()
+    ]
+
+def _migrate_devices_to_mac_key(cur: sqlite3.Cursor, stranded: bool = False) -> None:
+    """Runtime migration: rebuild a text-keyed devices table on mac_key.
+
+    Rows are re-keyed through MacAddress; unparseable MACs are dropped and,
+    where hyphen and colon spellings of one MAC coexist, the hyphen row wins.
+    The rename, copy and drop run under one savepoint, inside the caller's
+    transaction if there is one, so a failure leaves the old table intact.
+    With ``stranded`` the rename already happened in an earlier, interrupted
+    run: the rows left in devices_text_keyed are merged into devices, keeping
+    any row written there since.
+    """
+    cur.execute("SAVEPOINT devices_mac_key")
+    try:
+        if not stranded:
+            cur.execute("ALTER TABLE devices RENAME TO devices_text_keyed")
+            cur.execute(
+                """
+                CREATE TABLE devices (
+                    mac_key INTEGER PRIMARY KEY,
+                    mac TEXT NOT NULL,
+                    username TEXT,
+                    authorized INTEGER,
+                    vlan INTEGER
+                )
+                """
             )
-            """
+        _copy_text_keyed_devices(cur)
+        cur.execute("DROP TABLE devices_text_keyed")
+        cur.execute("RELEASE devices_mac_key")
+    except Exception:
+        cur.execute("ROLLBACK TO devices_mac_key")
+        cur.execute("RELEASE devices_mac_key")
+        raise
+
+def _copy_text_keyed_devices(cur: sqlite3.Cursor) -> None:
+    cur.execute("SELECT mac, username, authorized, vlan FROM devices_text_keyed")
+    rows: Dict[int, tuple] = {}
+    dropped = 0
+    for r in cur.fetchall():
+        mac = MacAddress.parse((r['mac'] or '').strip())
+        if mac is None:
+            dropped += 1
+            continue
+        if int(mac) in rows:
+            dropped += 1
+            if r['mac'].strip() != mac.hyphen_upper:
+                continue
+        rows[int(mac)] = (int(mac), mac.hyphen_upper, r['username'], r['authorized'], r['vlan'])
+    cur.executemany(
+        "INSERT OR IGNORE INTO devices (mac_key, mac, username, authorized, vlan) VALUES (?, ?, ?, ?, ?)",
+        rows.values(),
+    )
+    print(f"[INFO] devices migrated to mac_key: {len(rows)} rows kept, {dropped} invalid or duplicate dropped")
+
+# --- Schema migrations ---
+#
+# Each migration runs once per database, in version order, and is recorded
+# in schema_version. Append new migrations; never edit or renumber one that
+# has shipped. Migrations up to 9 predate the registry, so they tolerate
+# databases where some of their tables or columns already exist.
+
+def _columns(cur: sqlite3.Cursor, table: str) -> List[str]:
+    cur.execute(f"PRAGMA table_info({table})")
+    return [row[1] for row in cur.fetchall()]
+
+def _m001_devices(cur: sqlite3.Cursor) -> None:
+    # Devices table keyed by the 48-bit MAC as an integer (the rowid, so no
+    # separate key index); mac keeps the hyphen-upper text for display.
+    # authorized is INTEGER 0/1.
+    device_columns = _columns(cur, 'devices')
+    if device_columns and 'mac_key' not in device_columns:
+        _migrate_devices_to_mac_key(cur)
+    elif _columns(cur, 'devices_text_keyed'):
+        # An earlier mac_key migration was interrupted after the rename
+        _migrate_devices_to_mac_key(cur, stranded=True)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS devices (
+            mac_key INTEGER PRIMARY KEY,
+            mac TEXT NOT NULL,
+            username TEXT,
+            authorized INTEGER,
+            vlan INTEGER
         )
-        # VLAN profiles table
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS vlan_profiles (
-                username TEXT PRIMARY KEY,
-                vlan INTEGER
-            )
-            """
+        """
+    )
+    # Lets policy changes find a user's devices without a full scan
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_devices_username ON devices(username)")
+
+def _m002_vlan_profiles(cur: sqlite3.Cursor) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS vlan_profiles (
+            username TEXT PRIMARY KEY,
+            vlan INTEGER
         )
-        # Users table for authentication
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                email TEXT,
-                password_hash TEXT NOT NULL,
-                created_at TEXT
-            )
-            """
+        """
+    )
+
+def _m003_users(cur: sqlite3.Cursor) -> None:
+    # Users table for authentication
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT,
+            password_hash TEXT NOT NULL,
+            created_at TEXT
         )
-        # Runtime migration: ensure email, display_name, avatar_url columns exist and indexes as needed
-        cur.execute("PRAGMA table_info(users)")
-        columns = [row[1] for row in cur.fetchall()]
-        if 'email' not in columns:
-            # Add email column; uniqueness will be enforced via an index below
-            cur.execute("ALTER TABLE users ADD COLUMN email TEXT")
-        if 'display_name' not in columns:
-            cur.execute("ALTER TABLE users ADD COLUMN display_name TEXT")
-        if 'avatar_url' not in columns:
-            cur.execute("ALTER TABLE users ADD COLUMN avatar_url TEXT")
-        # Create a unique index on email to prevent duplicates (allows NULLs for legacy rows)
-        cur.execute(
-            "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email_unique ON users(email)"
+        """
+    )
+    # Older tables lack the profile columns
+    columns = _columns(cur, 'users')
+    if 'email' not in columns:
+        # Add email column; uniqueness will be enforced via an index below
+        cur.execute("ALTER TABLE users ADD COLUMN email TEXT")
+    if 'display_name' not in columns:
+        cur.execute("ALTER TABLE users ADD COLUMN display_name TEXT")
+    if 'avatar_url' not in columns:
+        cur.execute("ALTER TABLE users ADD COLUMN avatar_url TEXT")
+    # Create a unique index on email to prevent duplicates (allows NULLs for legacy rows)
+    cur.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email_unique ON users(email)"
+    )
+
+def _m004_policies(cur: sqlite3.Cursor) -> None:
+    # Policies table; criteria stored as JSON string
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS policies (
+            name TEXT PRIMARY KEY,
+            vlan INTEGER NOT NULL,
+            criteria TEXT
         )
-        # Policies table; criteria stored as JSON string
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS policies (
-                name TEXT PRIMARY KEY,
-                vlan INTEGER NOT NULL,
-                criteria TEXT
-            )
-            """
+        """
+    )
+    # Explicit policy priority (higher wins)
+    if 'priority' not in _columns(cur, 'policies'):
+        cur.execute("ALTER TABLE policies ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+
+def _m005_policy_criteria(cur: sqlite3.Cursor) -> None:
+    # Policy criteria, one row per (policy, kind), so matches are indexed point queries.
+    # value holds string criteria for matching; value_json keeps the original value.
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'policy_criteria'")
+    backfill_criteria = cur.fetchone() is None
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS policy_criteria (
+            policy_name TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            value TEXT,
+            value_json TEXT NOT NULL,
+            PRIMARY KEY (policy_name, kind)
+        )
+        """
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_policy_criteria_kind_value ON policy_criteria(kind, value)"
+    )
+    if backfill_criteria:
+        # Split existing JSON criteria into rows
+        cur.execute("SELECT name, criteria FROM policies")
+        rows = []
+        for r in cur.fetchall():
+            rows.extend((r["name"],) + c for c in criteria_rows(r["criteria"]))
+        cur.executemany(
+            "INSERT OR IGNORE INTO policy_criteria (policy_name, kind, value, value_json) VALUES (?, ?, ?, ?)",
+            rows,
+        )
+
+def _m006_reset_tokens(cur: sqlite3.Cursor) -> None:
+    # Password reset tokens table
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS reset_tokens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            token TEXT UNIQUE NOT NULL,
+            expires_at TEXT NOT NULL,
+            used INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+        """
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reset_tokens_user ON reset_tokens(user_id)"
+    )
+
+def _m007_southbound_rules(cur: sqlite3.Cursor) -> None:
+    # Southbound rule ledger: what each driver has installed on the data plane
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS southbound_rules (
+            driver TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            chain TEXT NOT NULL,
+            spec TEXT NOT NULL,
+            created_at TEXT,
+            PRIMARY KEY (driver, kind, chain, spec)
+        )
+        """
+    )
+
+def _m008_devices_listing(cur: sqlite3.Cursor) -> None:
+    # Filter/sort indexes for the paginated /devices listing; both end in
+    # the rowid, so keyset seeks on (column, mac_key) stay on the index
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_devices_vlan ON devices(vlan)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_devices_authorized ON devices(authorized)")
+    # Change counter behind the /devices ETag/Last-Modified; bumped by
+    # triggers so every writer (admissions, imports, the API) is covered
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now'))
+        )
+        """
+    )
+    cur.execute("INSERT OR IGNORE INTO table_versions (name) VALUES ('devices')")
+    bump = _VERSION_BUMP_SQL.replace("?", "'devices'") + ";"
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_devices_version_insert AFTER INSERT ON devices BEGIN {bump} END")
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_devices_version_delete AFTER DELETE ON devices BEGIN {bump} END")
+    # Re-admissions rewrite unchanged state; those must not invalidate clients
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_devices_version_update AFTER UPDATE ON devices
+        WHEN OLD.mac IS NOT NEW.mac OR OLD.username IS NOT NEW.username
+            OR OLD.authorized IS NOT NEW.authorized OR OLD.vlan IS NOT NEW.vlan
+        BEGIN {bump} END
+        """
+    )
+
+def _m009_intents(cur: sqlite3.Cursor) -> None:
+    # Previously created on demand by POST /api/intents
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS intents (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          src TEXT NOT NULL,
+          dst TEXT NOT NULL,
+          constraints TEXT,
+          tenant TEXT,
+          status TEXT,
+          created_at TEXT
+        )
+        """
+    )
+
+def _m010_device_events(cur: sqlite3.Cursor) -> None:
+    # Append-only device state history (see models.device_events). id is the
+    # rowid, so (mac_key, ts) index entries end in it and keyset pages on
+    # (ts, id) seek directly; the ts index serves compaction by day.
+    cur.execute(
+        """
+        CREATE TABLE device_events (
+            id INTEGER PRIMARY KEY,
+            mac_key INTEGER NOT NULL,
+            ts REAL NOT NULL,
+            event TEXT NOT NULL,
+            authorized INTEGER,
+            vlan INTEGER,
+            prev_vlan INTEGER,
+            source TEXT
+        )
+        """
+    )
+    cur.execute("CREATE INDEX idx_device_events_mac_ts ON device_events(mac_key, ts)")
+    cur.execute("CREATE INDEX idx_device_events_ts ON device_events(ts)")
+    # One row per MAC and UTC day once its events are compacted; per-event
+    # counts, the VLANs seen (comma separated) and the state at day end
+    cur.execute(
+        """
+        CREATE TABLE device_event_days (
+            mac_key INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            events INTEGER NOT NULL,
+            created INTEGER NOT NULL DEFAULT 0,
+            authorized INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            vlan_changed INTEGER NOT NULL DEFAULT 0,
+            deleted INTEGER NOT NULL DEFAULT 0,
+            first_ts REAL NOT NULL,
+            last_ts REAL NOT NULL,
+            vlans TEXT NOT NULL DEFAULT '',
+            last_event TEXT,
+            final_authorized INTEGER,
+            final_vlan INTEGER,
+            PRIMARY KEY (mac_key, day)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute("CREATE INDEX idx_device_event_days_day ON device_event_days(day)")
+
+def _m011_policy_match_mode(cur: sqlite3.Cursor) -> None:
+    # Composite criteria match on all of them; policies written before that
+    # matched on username or mac_prefix alone (see models.policy), so every
+    # policy already stored keeps that meaning until it is next upserted.
+    cur.execute("ALTER TABLE policies ADD COLUMN match_mode TEXT NOT NULL DEFAULT 'all'")
+    cur.execute("UPDATE policies SET match_mode = 'legacy'")
+
+def _m012_drop_policy_criteria_lookup(cur: sqlite3.Cursor) -> None:
+    # The (kind, value) index served per-lookup point queries; policies are now
+    # matched by the compiled engine in models.policy, which only reads
+    # policy_criteria whole or by policy_name (the primary key).
+    cur.execute("DROP INDEX IF EXISTS idx_policy_criteria_kind_value")
+
+def _m013_deferred_schema(cur: sqlite3.Cursor) -> None:
+    # Definitions of indexes and triggers dropped for a bulk import, saved
+    # with the drop so init_db can put them back after a crash
+    cur.execute(
+        """
+        CREATE TABLE deferred_schema (
+            name TEXT PRIMARY KEY,
+            tbl TEXT NOT NULL,
+            type TEXT NOT NULL,
+            sql TEXT NOT NULL
         )
-        # Password reset tokens table
+        """
+    )
+
+def _m014_drop_vlan_ledger_rows(cur: sqlite3.Cursor) -> None:
+    # VLAN assignments were once recorded in the southbound ledger although
+    # the driver installs nothing for them; one row per admitted MAC
+    cur.execute("DELETE FROM southbound_rules WHERE kind = 'vlan'")
+
+# (version, name, migration) in the order they are applied
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Cursor], None]]] = [
+    (1, 'devices', _m001_devices),
+    (2, 'vlan_profiles', _m002_vlan_profiles),
+    (3, 'users', _m003_users),
+    (4, 'policies', _m004_policies),
+    (5, 'policy_criteria', _m005_policy_criteria),
+    (6, 'reset_tokens', _m006_reset_tokens),
+    (7, 'southbound_rules', _m007_southbound_rules),
+    (8, 'devices_listing', _m008_devices_listing),
+    (9, 'intents', _m009_intents),
+    (10, 'device_events', _m010_device_events),
+    (11, 'policy_match_mode', _m011_policy_match_mode),
+    (12, 'drop_policy_criteria_lookup', _m012_drop_policy_criteria_lookup),
+    (13, 'deferred_schema', _m013_deferred_schema),
+    (14, 'drop_vlan_ledger_rows', _m014_drop_vlan_ledger_rows),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Databases already brought up to SCHEMA_VERSION by this process
+_migrated: set = set()
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    """Highest applied migration; 0 for a database that predates the registry."""
+    try:
+        row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+def migrate(conn: sqlite3.Connection) -> List[int]:
+    """Apply pending migrations in one transaction; returns the versions applied.
+
+    An up-to-date database costs a single read. BEGIN IMMEDIATE takes the
+    write lock before the version is re-read, so workers starting together
+    apply each migration exactly once; the others wait, then find nothing to do.
+    """
+    if schema_version(conn) >= SCHEMA_VERSION:
+        return []
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
         cur.execute(
             """
-            CREATE TABLE IF NOT EXISTS reset_tokens (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                token TEXT UNIQUE NOT NULL,
-                expires_at TEXT NOT NULL,
-                used INTEGER NOT NULL DEFAULT 0,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY(user_id) REFERENCES users(id)
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TEXT NOT NULL
             )
             """
         )
-        cur.execute(
-            "CREATE INDEX IF NOT EXISTS idx_reset_tokens_user ON reset_tokens(user_id)"
-        )
+        current = schema_version(conn)
+        applied = []
+        for version, name, migration in MIGRATIONS:
+            if version <= current:
+                continue
+            migration(cur)
+            cur.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, datetime('now'))",
+                (version, name),
+            )
+            applied.append(version)
         conn.commit()
-    finally:
-        conn.close()
+    except Exception:
+        conn.rollback()
+        raise
+    return applied
+
+def init_db() -> None:
+    """Bring the schema up to date; cheap once it is, so call it at every startup."""
+    path = _db_path()
+    if path in _migrated:
+        return
+    with db_connection() as conn:
+        applied = migrate(conn)
+        # Indexes and triggers left dropped by a bulk import that did not finish
+        restored: List[str] = []
+        if conn.execute("SELECT 1 FROM deferred_schema LIMIT 1").fetchone():
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                restored = restore_deferred_schema(conn)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    if applied:
+        print(f"[INFO] schema migrated to version {SCHEMA_VERSION} (applied {', '.join(map(str, applied))})")
+    if restored:
+        print(f"[INFO] restored {len(restored)} indexes/triggers left dropped by an interrupted import")
+    _migrated.add(path)
 
 def _seed_devices(cur: sqlite3.Cursor) -> None:
+    # Imported lazily: models.inventory depends on this module
+    from models.inventory import import_devices
+    from utils.streaming import iter_json_items
+
     data_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../data/devices.json'))
     if not os.path.exists(data_path):
         return
-    with open(data_path, 'r') as f:
-        items = json.load(f) or []
-    for dev in items:
-        mac = dev.get('mac')
-        username = dev.get('username') or dev.get('name')
-        authorized = 1 if dev.get('authorized', True) else 0
-        vlan = dev.get('vlan')
-        if not mac:
-            continue
-        cur.execute(
-            "INSERT OR IGNORE INTO devices (mac, username, authorized, vlan) VALUES (?, ?, ?, ?)",
-            (mac, username, authorized, vlan),
-        )
+    with open(data_path, 'rb') as f:
+        import_devices(iter_json_items(f), conn=cur.connection)
 
 def _seed_vlan_profiles(cur: sqlite3.Cursor) -> None:
+    from models.inventory import import_vlan_profiles
+    from utils.streaming import iter_json_object_items
+
     profiles_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../data/vlan_profiles.json'))
     if not os.path.exists(profiles_path):
         return
-    with open(profiles_path, 'r') as f:
-        profiles = json.load(f) or {}
-    for username, vlan in profiles.items():
-        cur.execute(
-            "INSERT OR IGNORE INTO vlan_profiles (username, vlan) VALUES (?, ?)",
-            (username, vlan),
-        )
+    with open(profiles_path, 'rb') as f:
+        import_vlan_profiles(iter_json_object_items(f), conn=cur.connection)
 
 def seed_db() -> None:
     """Seed initial data if tables are empty."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         # Seed devices if empty
         cur.execute("SELECT COUNT(1) FROM devices")
@@ -151,6 +623,4 @@ def seed_db() -> None:
                 "INSERT OR IGNORE INTO users (username, password_hash, created_at) VALUES (?, ?, datetime('now'))",
                 ("admin", "",),
             )
-        conn.commit()
-    finally:
-        conn.close()
\ No newline at end of file
+        conn.commit()
\ No newline at end of file
@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from models.database import db_connection
+from models.device_writer import device_writer
+from utils.mac import MacAddress
+
+
+class TTLCache:
+    """Bounded LRU cache with per-entry TTL.
+
+    ``None`` is a legal value and is used for negative entries (e.g. unknown
+    MACs); those expire after ``negative_ttl`` so newly registered devices
+    become visible quickly even without an explicit write-through.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: Optional[float] = None) -> None:
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self._data: 'OrderedDict[Any, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Any) -> Tuple[bool, Any]:
+        """Return ``(found, value)``; ``found`` is False on miss or expiry."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def put(self, key: Any, value: Any) -> None:
+        ttl = self.ttl if value is not None else self.negative_ttl
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Any) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hitRatio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+device_cache = TTLCache(
+    maxsize=int(os.getenv('DEVICE_CACHE_SIZE', '50000')),
+    ttl=float(os.getenv('DEVICE_CACHE_TTL', '300')),
+    negative_ttl=float(os.getenv('DEVICE_CACHE_NEGATIVE_TTL', '30')),
+)
+profile_cache = TTLCache(
+    maxsize=int(os.getenv('PROFILE_CACHE_SIZE', '10000')),
+    ttl=float(os.getenv('PROFILE_CACHE_TTL', '300')),
+    negative_ttl=float(os.getenv('DEVICE_CACHE_NEGATIVE_TTL', '30')),
+)
+
+
+def row_to_device(row) -> Dict:
+    return {
+        "mac": row["mac"],
+        "username": row["username"],
+        "authorized": bool(row["authorized"]),
+        "vlan": row["vlan"],
+    }
+
+
+def get_device(mac_hyphen_upper: str) -> Optional[Dict]:
+    """Cached device lookup keyed by hyphen-upper MAC; one mac_key point query on miss."""
+    # Queued writes first, so lookups see their own uncommitted state
+    found, device = device_writer.get(mac_hyphen_upper)
+    if not found:
+        found, device = device_cache.get(mac_hyphen_upper)
+    if found:
+        return dict(device) if device is not None else None
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT mac, username, authorized, vlan FROM devices WHERE mac_key = ?",
+            (int(MacAddress(mac_hyphen_upper)),),
+        )
+        row = cur.fetchone()
+        device = row_to_device(row) if row else None
+    device_cache.put(mac_hyphen_upper, device)
+    return dict(device) if device is not None else None
+
+
+def put_device(mac_hyphen_upper: str, device: Optional[Dict]) -> None:
+    """Write-through hook for callers that just changed the devices table."""
+    device_cache.put(mac_hyphen_upper, dict(device) if device is not None else None)
+
+
+def get_user_vlan(username: str) -> Optional[int]:
+    """Cached vlan_profiles lookup."""
+    found, vlan = profile_cache.get(username)
+    if found:
+        return vlan
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT vlan FROM vlan_profiles WHERE username = ?", (username,))
+        row = cur.fetchone()
+        vlan = row["vlan"] if row else None
+    profile_cache.put(username, vlan)
+    return vlan
+
+
+def cache_stats() -> Dict:
+    return {'devices': device_cache.stats(), 'vlanProfiles': profile_cache.stats(), 'deviceWrites': device_writer.stats()}
@@ -0,0 +1,294 @@
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from models.database import db_connection
+from utils.logging import log
+from utils.mac import MacAddress
+
+# A device_events row: (mac_key, ts, event, authorized, vlan, prev_vlan, source)
+EventRow = Tuple[int, float, str, int, Optional[int], Optional[int], str]
+
+EVENT_TYPES = ("created", "authorized", "blocked", "vlan_changed", "deleted")
+
+_INSERT_SQL = (
+    "INSERT INTO device_events (mac_key, ts, event, authorized, vlan, prev_vlan, source) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+_UPSERT_DAY_SQL = """
+    INSERT INTO device_event_days (
+        mac_key, day, events, created, authorized, blocked, vlan_changed, deleted,
+        first_ts, last_ts, vlans, last_event, final_authorized, final_vlan
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(mac_key, day) DO UPDATE SET
+        events = events + excluded.events,
+        created = created + excluded.created,
+        authorized = authorized + excluded.authorized,
+        blocked = blocked + excluded.blocked,
+        vlan_changed = vlan_changed + excluded.vlan_changed,
+        deleted = deleted + excluded.deleted,
+        first_ts = min(first_ts, excluded.first_ts),
+        vlans = CASE WHEN vlans = '' THEN excluded.vlans
+                     WHEN excluded.vlans = '' THEN vlans
+                     ELSE vlans || ',' || excluded.vlans END,
+        last_event = CASE WHEN excluded.last_ts >= last_ts THEN excluded.last_event ELSE last_event END,
+        final_authorized = CASE WHEN excluded.last_ts >= last_ts THEN excluded.final_authorized ELSE final_authorized END,
+        final_vlan = CASE WHEN excluded.last_ts >= last_ts THEN excluded.final_vlan ELSE final_vlan END,
+        last_ts = max(last_ts, excluded.last_ts)
+"""
+_DAY = 86400
+
+
+def state_change(
+    address: MacAddress, previous: Optional[Dict], state: Optional[Dict], source: str, ts: Optional[float] = None
+) -> Optional[EventRow]:
+    """The event for a device going from ``previous`` to ``state``; None if nothing changed.
+
+    A missing ``state`` means the device was deleted.
+    """
+    if state is None:
+        if previous is None:
+            return None
+        event = "deleted"
+        authorized, vlan = False, None
+    else:
+        authorized, vlan = bool(state.get("authorized")), state.get("vlan")
+        if previous is None:
+            event = "created"
+        elif bool(previous.get("authorized")) != authorized:
+            event = "authorized" if authorized else "blocked"
+        elif previous.get("vlan") != vlan:
+            event = "vlan_changed"
+        else:
+            return None
+    prev_vlan = previous.get("vlan") if previous is not None else None
+    return (int(address), time.time() if ts is None else ts, event, int(authorized), vlan, prev_vlan, source)
+
+
+def record_events(conn: sqlite3.Connection, events: Iterable[EventRow]) -> None:
+    """Append events in the caller's transaction, next to the state change they describe."""
+    conn.executemany(_INSERT_SQL, events)
+
+
+def _encode_cursor(ts: float, event_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([ts, event_id]).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(token: str) -> Tuple[float, int]:
+    try:
+        ts, event_id = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        return float(ts), int(event_id)
+    except Exception:
+        raise ValueError("invalid cursor")
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _day(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")
+
+
+def device_history(
+    conn: sqlite3.Connection,
+    address: MacAddress,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+) -> Dict:
+    """Events for one MAC, newest first, plus the daily summaries of compacted days.
+
+    Events are read from the (mac_key, ts) index and paged by keyset on
+    (ts, id), so any page of any device's history is a single index seek.
+    Summaries come with the first page only.
+    """
+    clauses = ["mac_key = ?"]
+    params: List = [int(address)]
+    if since is not None:
+        clauses.append("ts >= ?")
+        params.append(since)
+    if until is not None:
+        clauses.append("ts < ?")
+        params.append(until)
+    if cursor:
+        clauses.append("(ts, id) < (?, ?)")
+        params.extend(_decode_cursor(cursor))
+    rows = conn.execute(
+        "SELECT id, ts, event, authorized, vlan, prev_vlan, source FROM device_events "
+        f"WHERE {' AND '.join(clauses)} ORDER BY ts DESC, id DESC LIMIT ?",
+        params + [limit + 1],
+    ).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    history = {
+        "mac": address.hyphen_upper,
+        "events": [
+            {
+                "ts": r["ts"],
+                "time": _iso(r["ts"]),
+                "event": r["event"],
+                "authorized": bool(r["authorized"]),
+                "vlan": r["vlan"],
+                "previousVlan": r["prev_vlan"],
+                "source": r["source"],
+            }
+            for r in rows
+        ],
+        "nextCursor": _encode_cursor(rows[-1]["ts"], rows[-1]["id"]) if more else None,
+    }
+    if not cursor:
+        day_clauses = ["mac_key = ?"]
+        day_params: List = [int(address)]
+        if since is not None:
+            day_clauses.append("day >= ?")
+            day_params.append(_day(since))
+        if until is not None:
+            day_clauses.append("day <= ?")
+            day_params.append(_day(until))
+        days = conn.execute(
+            f"SELECT * FROM device_event_days WHERE {' AND '.join(day_clauses)} ORDER BY day DESC",
+            day_params,
+        ).fetchall()
+        history["days"] = [
+            {
+                "day": d["day"],
+                "events": d["events"],
+                "counts": {e: d[e] for e in EVENT_TYPES},
+                "vlans": sorted({int(v) for v in d["vlans"].split(",") if v}),
+                "firstTime": _iso(d["first_ts"]),
+                "lastTime": _iso(d["last_ts"]),
+                "lastEvent": d["last_event"],
+                "authorized": bool(d["final_authorized"]),
+                "vlan": d["final_vlan"],
+            }
+            for d in days
+        ]
+    return history
+
+
+def _summaries(rows: Iterable[sqlite3.Row], day: str) -> Iterable[tuple]:
+    # rows ordered by (mac_key, ts, id); one summary per MAC
+    for mac_key, events in groupby(rows, key=lambda r: r["mac_key"]):
+        counts = dict.fromkeys(EVENT_TYPES, 0)
+        vlans = set()
+        total = 0
+        first = last = None
+        for r in events:
+            total += 1
+            counts[r["event"]] = counts.get(r["event"], 0) + 1
+            if r["vlan"] is not None:
+                vlans.add(r["vlan"])
+            if first is None:
+                first = r
+            last = r
+        yield (
+            mac_key, day, total, counts["created"], counts["authorized"], counts["blocked"],
+            counts["vlan_changed"], counts["deleted"], first["ts"], last["ts"],
+            ",".join(str(v) for v in sorted(vlans)), last["event"], last["authorized"], last["vlan"],
+        )
+
+
+class EventCompactor:
+    """Retention for device history.
+
+    Events older than ``raw_days`` are rolled into one device_event_days
+    row per MAC and UTC day, then deleted; summaries older than
+    ``retention_days`` are dropped. Work goes one day per transaction so
+    admissions are never blocked behind a long compaction. With
+    ``interval_s`` > 0 a background thread runs it periodically.
+    """
+
+    def __init__(self, raw_days: int = 30, retention_days: int = 365, interval_s: float = 3600.0) -> None:
+        self.raw_days = raw_days
+        self.retention_days = retention_days
+        self.interval_s = interval_s
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.runs = 0
+        self.last_run: Optional[Dict] = None
+
+    def start(self) -> None:
+        if self.interval_s <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="device-events-compactor", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.compact()
+            except Exception as e:
+                log(f"device_events: compaction failed: {e}")
+            time.sleep(self.interval_s)
+
+    def compact(self, now: Optional[float] = None) -> Dict:
+        """Roll up and expire history; returns what was done."""
+        with self._lock:
+            started = time.perf_counter()
+            now = time.time() if now is None else now
+            # Whole UTC days only, so a day is summarized exactly once
+            today = datetime.fromtimestamp(now, timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+            raw_cutoff = (today - timedelta(days=self.raw_days)).timestamp()
+            expire_before = (today - timedelta(days=self.retention_days)).strftime("%Y-%m-%d")
+            compacted = summaries = days = 0
+            with db_connection() as conn:
+                row = conn.execute("SELECT MIN(ts) FROM device_events WHERE ts < ?", (raw_cutoff,)).fetchone()
+                day_start = None if row[0] is None else row[0] - row[0] % _DAY
+                while day_start is not None and day_start < raw_cutoff:
+                    day_end = day_start + _DAY
+                    cur = conn.execute(
+                        "SELECT id, mac_key, ts, event, authorized, vlan FROM device_events "
+                        "WHERE ts >= ? AND ts < ? ORDER BY mac_key, ts, id",
+                        (day_start, day_end),
+                    )
+                    rows = _summaries(cur, _day(day_start))
+                    if _day(day_start) >= expire_before:
+                        before = conn.total_changes
+                        conn.executemany(_UPSERT_DAY_SQL, rows)
+                        summaries += conn.total_changes - before
+                    cur = conn.execute("DELETE FROM device_events WHERE ts >= ? AND ts < ?", (day_start, day_end))
+                    compacted += cur.rowcount
+                    conn.commit()
+                    days += 1
+                    row = conn.execute("SELECT MIN(ts) FROM device_events WHERE ts >= ?", (day_end,)).fetchone()
+                    day_start = None if row[0] is None else row[0] - row[0] % _DAY
+                cur = conn.execute("DELETE FROM device_event_days WHERE day < ?", (expire_before,))
+                expired = cur.rowcount
+                conn.commit()
+            self.runs += 1
+            self.last_run = {
+                "days": days,
+                "compactedEvents": compacted,
+                "summaries": summaries,
+                "expiredSummaries": expired,
+                "rawCutoff": _iso(raw_cutoff),
+                "elapsedMs": round((time.perf_counter() - started) * 1000, 1),
+            }
+            if days or expired:
+                log(f"device_events: compacted {compacted} events over {days} days into {summaries} summaries, "
+                    f"expired {expired} summaries")
+            return self.last_run
+
+    def stats(self) -> Dict:
+        return {
+            "rawDays": self.raw_days,
+            "retentionDays": self.retention_days,
+            "intervalS": self.interval_s,
+            "runs": self.runs,
+            "lastRun": self.last_run,
+        }
+
+
+compactor = EventCompactor(
+    raw_days=int(os.getenv('DEVICE_EVENTS_RAW_DAYS', '30')),
+    retention_days=int(os.getenv('DEVICE_EVENTS_RETENTION_DAYS', '365')),
+    interval_s=float(os.getenv('DEVICE_EVENTS_COMPACT_INTERVAL_S', '3600')),
+)
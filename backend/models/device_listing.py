@@ -0,0 +1,169 @@
+import base64
+import hashlib
+import json
+import sqlite3
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+
+from utils.mac import prefix_range
+
+# sort name -> column; every column is indexed and the rowid (mac_key) breaks ties
+SORT_COLUMNS = {"mac": "mac_key", "username": "username", "vlan": "vlan"}
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+_TRUE = ("1", "true", "yes")
+_FALSE = ("0", "false", "no")
+
+
+def devices_version(conn: sqlite3.Connection) -> Tuple[int, int]:
+    """``(version, updated_at)`` of the devices table, maintained by triggers."""
+    row = conn.execute("SELECT version, updated_at FROM table_versions WHERE name = 'devices'").fetchone()
+    return (row[0], row[1]) if row else (0, 0)
+
+
+def _row(r: sqlite3.Row) -> Dict:
+    return {"mac": r["mac"], "username": r["username"], "authorized": bool(r["authorized"]), "vlan": r["vlan"]}
+
+
+class DeviceListQuery:
+    """Filtered, keyset-paginated read of the devices table.
+
+    Query arguments: ``authorized``, ``vlan``, ``usernamePrefix``,
+    ``macPrefix``, ``sort`` (mac|username|vlan), ``order`` (asc|desc),
+    ``limit`` and the opaque ``cursor`` returned as ``nextCursor``. Each
+    page resumes after the last ``(sort column, mac_key)`` it returned, so
+    deep pages cost the same as the first. NULL usernames/VLANs sort first
+    ascending and last descending, as SQLite orders them; they are read as
+    a separate segment so both segments can seek on their index.
+    """
+
+    def __init__(self, args: Mapping[str, str]) -> None:
+        self.sort = args.get("sort") or "mac"
+        if self.sort not in SORT_COLUMNS:
+            raise ValueError(f"sort must be one of {', '.join(SORT_COLUMNS)}")
+        self.order = (args.get("order") or "asc").lower()
+        if self.order not in ("asc", "desc"):
+            raise ValueError("order must be asc or desc")
+        self.paginated = "limit" in args or "cursor" in args
+        self.limit: Optional[int] = None
+        if self.paginated:
+            try:
+                self.limit = int(args.get("limit") or DEFAULT_LIMIT)
+            except ValueError:
+                raise ValueError("limit must be an integer")
+            if not 1 <= self.limit <= MAX_LIMIT:
+                raise ValueError(f"limit must be between 1 and {MAX_LIMIT}")
+        self.cursor = self._decode_cursor(args.get("cursor")) if args.get("cursor") else None
+
+        self._where: List[str] = []
+        self._params: List[Any] = []
+        authorized = (args.get("authorized") or "").lower()
+        if authorized:
+            if authorized not in _TRUE + _FALSE:
+                raise ValueError("authorized must be true or false")
+            self._where.append("authorized = ?")
+            self._params.append(1 if authorized in _TRUE else 0)
+        if args.get("vlan"):
+            try:
+                vlan = int(args["vlan"])
+            except ValueError:
+                raise ValueError("vlan must be an integer")
+            self._where.append("vlan = ?")
+            self._params.append(vlan)
+        prefix = args.get("usernamePrefix")
+        if prefix:
+            # Range rather than LIKE so the username index is used (BINARY collation)
+            self._where.append("username >= ? AND username < ?")
+            self._params.extend([prefix, prefix[:-1] + chr(min(ord(prefix[-1]) + 1, 0x10FFFF))])
+        if args.get("macPrefix"):
+            keys = prefix_range(args["macPrefix"])
+            self._where.append("mac_key BETWEEN ? AND ?")
+            self._params.extend([keys.start, keys.stop - 1])
+
+    def _decode_cursor(self, token: str) -> Tuple[Any, int]:
+        try:
+            raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+            sort, order, value, key = json.loads(raw)
+        except Exception:
+            raise ValueError("invalid cursor")
+        if sort != self.sort or order != self.order or not isinstance(key, int):
+            raise ValueError("cursor does not match sort/order")
+        if value is not None and not isinstance(value, (str, int)):
+            raise ValueError("invalid cursor")
+        return value, key
+
+    def _encode_cursor(self, r: sqlite3.Row) -> str:
+        value = r[SORT_COLUMNS[self.sort]] if self.sort != "mac" else None
+        raw = json.dumps([self.sort, self.order, value, r["mac_key"]], separators=(",", ":"))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    def _segments(self) -> Iterator[Tuple[List[str], List[Any], str]]:
+        """``(where, params, order by)`` for each index-ordered run of rows after the cursor."""
+        desc = self.order == "desc"
+        direction = "DESC" if desc else "ASC"
+        after = "<" if desc else ">"
+        if self.sort == "mac":
+            if self.cursor is None:
+                yield [], [], f"mac_key {direction}"
+            else:
+                yield [f"mac_key {after} ?"], [self.cursor[1]], f"mac_key {direction}"
+            return
+        column = SORT_COLUMNS[self.sort]
+        nulls = ([f"{column} IS NULL"], [], f"mac_key {direction}")
+        values = ([f"{column} IS NOT NULL"], [], f"{column} {direction}, mac_key {direction}")
+        segments = [values, nulls] if desc else [nulls, values]
+        if self.cursor is not None:
+            value, key = self.cursor
+            if value is None:
+                # Resume inside the NULL run
+                position = segments.index(nulls)
+                segments[position] = ([f"{column} IS NULL", f"mac_key {after} ?"], [key], nulls[2])
+            else:
+                position = segments.index(values)
+                segments[position] = ([f"({column}, mac_key) {after} (?, ?)"], [value, key], values[2])
+            segments = segments[position:]
+        yield from segments
+
+    def iter_rows(self, conn: sqlite3.Connection, limit: Optional[int] = None) -> Iterator[sqlite3.Row]:
+        remaining = limit
+        for where, params, order_by in self._segments():
+            clauses = self._where + where
+            sql = "SELECT mac_key, mac, username, authorized, vlan FROM devices"
+            if clauses:
+                sql += " WHERE " + " AND ".join(clauses)
+            sql += f" ORDER BY {order_by}"
+            if remaining is not None:
+                sql += f" LIMIT {remaining}"
+            cur = conn.execute(sql, self._params + params)
+            while True:
+                rows = cur.fetchmany(1000)
+                if not rows:
+                    break
+                for r in rows:
+                    yield r
+                if remaining is not None:
+                    remaining -= len(rows)
+            if remaining == 0:
+                return
+
+    def iter_devices(self, conn: sqlite3.Connection) -> Iterator[Dict]:
+        """Every matching device, in sort order (the unpaginated listing)."""
+        for r in self.iter_rows(conn):
+            yield _row(r)
+
+    def page(self, conn: sqlite3.Connection) -> Dict:
+        # One extra row tells whether there is a next page
+        rows = list(self.iter_rows(conn, self.limit + 1))
+        more = len(rows) > self.limit
+        rows = rows[:self.limit]
+        return {
+            "items": [_row(r) for r in rows],
+            "nextCursor": self._encode_cursor(rows[-1]) if more else None,
+            "limit": self.limit,
+        }
+
+
+def listing_etag(version: int, args: Mapping[str, str]) -> str:
+    """Entity tag for one listing: the table version plus the query that shaped it."""
+    query = "&".join(f"{k}={v}" for k, v in sorted(args.items()))
+    return f"devices-{version}-{hashlib.sha1(query.encode()).hexdigest()[:12]}"
@@ -0,0 +1,197 @@
+import atexit
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from models.database import db_connection
+from models.device_events import EventRow, record_events
+from utils.logging import log
+from utils.mac import MacAddress
+
+_INSERT_SQL = "INSERT OR REPLACE INTO devices (mac_key, mac, username, authorized, vlan) VALUES (?, ?, ?, ?, ?)"
+_UPDATE_SQL = "UPDATE devices SET authorized = ?, vlan = ? WHERE mac_key = ?"
+
+
+class _PendingWrite:
+    __slots__ = ("mac", "state", "insert")
+
+    def __init__(self, mac: MacAddress, state: Dict, insert: bool) -> None:
+        self.mac = mac
+        self.state = state
+        self.insert = insert
+
+
+class DeviceStateWriter:
+    """Write-behind buffer for device authorization/VLAN state.
+
+    Admissions enqueue the row they would have written; the latest write
+    per MAC wins and pending writes are committed together in a single
+    transaction every ``flush_ms`` milliseconds, or as soon as
+    ``max_pending`` MACs are waiting. ``get`` exposes writes that are
+    queued or being committed so lookups read their own writes; readers
+    that scan the table call ``flush`` first. ``flush_ms`` of 0 commits
+    every write immediately. State-change events (see models.device_events)
+    ride along and are committed in the same transaction as the rows they
+    describe; they are appended, never coalesced.
+    """
+
+    def __init__(self, flush_ms: int = 50, max_pending: int = 1000) -> None:
+        self.flush_ms = flush_ms
+        self.max_pending = max(1, max_pending)
+        self._pending: Dict[str, _PendingWrite] = {}
+        self._inflight: Dict[str, _PendingWrite] = {}
+        self._events: List[EventRow] = []
+        self._lock = threading.Lock()
+        # Serializes flushes so commits land in enqueue order
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.enqueued = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.written = 0
+        self.events_written = 0
+        self.failures = 0
+        self.last_flush_ms = 0.0
+
+    def _ensure_started(self) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='device-writer', daemon=True)
+                    self._thread.start()
+
+    def enqueue(self, writes: Iterable[Tuple[MacAddress, bool, Dict]], events: Iterable[EventRow] = ()) -> None:
+        """Queue ``(mac, insert, state)`` writes and the events they imply.
+
+        ``insert`` creates the row; otherwise only authorized/vlan of an
+        existing row are updated. An update coalesced onto a queued insert
+        stays an insert.
+        """
+        with self._lock:
+            for mac, insert, state in writes:
+                key = mac.hyphen_upper
+                previous = self._pending.get(key)
+                if previous is not None:
+                    self.coalesced += 1
+                    insert = insert or previous.insert
+                self._pending[key] = _PendingWrite(mac, dict(state), insert)
+                self.enqueued += 1
+            self._events.extend(events)
+            full = len(self._pending) + len(self._events) >= self.max_pending
+        if self.flush_ms <= 0:
+            self.flush()
+            return
+        self._ensure_started()
+        if full:
+            self._wakeup.set()
+
+    def get(self, mac_hyphen_upper: str) -> Tuple[bool, Optional[Dict]]:
+        """``(found, device)`` for a MAC with a queued or uncommitted write."""
+        with self._lock:
+            entry = self._pending.get(mac_hyphen_upper) or self._inflight.get(mac_hyphen_upper)
+        if entry is None:
+            return False, None
+        return True, dict(entry.state)
+
+    def discard(self, macs_hyphen_upper: Iterable[str]) -> int:
+        """Drop queued writes, e.g. for devices being deleted.
+
+        Returns how many dropped writes would have created a row.
+        """
+        dropped = 0
+        with self._flush_lock, self._lock:
+            for mac in macs_hyphen_upper:
+                entry = self._pending.pop(mac, None)
+                if entry is not None and entry.insert:
+                    dropped += 1
+        return dropped
+
+    def flush(self) -> int:
+        """Commit everything queued so far; returns the number of rows written."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending and not self._events:
+                    return 0
+                batch, self._pending = self._pending, {}
+                events, self._events = self._events, []
+                self._inflight = batch
+            started = time.perf_counter()
+            inserts: List[tuple] = []
+            updates: List[tuple] = []
+            for entry in batch.values():
+                state = entry.state
+                authorized = 1 if state.get("authorized") else 0
+                if entry.insert:
+                    inserts.append((int(entry.mac), entry.mac.hyphen_upper, state.get("username"),
+                                    authorized, state.get("vlan")))
+                else:
+                    updates.append((authorized, state.get("vlan"), int(entry.mac)))
+            try:
+                with db_connection() as conn:
+                    if inserts:
+                        conn.executemany(_INSERT_SQL, inserts)
+                    if updates:
+                        conn.executemany(_UPDATE_SQL, updates)
+                    if events:
+                        record_events(conn, events)
+                    conn.commit()
+            except Exception as e:
+                # Requeue unless a newer write for the same MAC arrived meanwhile
+                with self._lock:
+                    for key, entry in batch.items():
+                        self._pending.setdefault(key, entry)
+                    self._events[:0] = events
+                    self._inflight = {}
+                    self.failures += 1
+                log(f"device_writer: flush of {len(batch)} writes failed: {e}")
+                raise
+            with self._lock:
+                self._inflight = {}
+                self.flushes += 1
+                self.written += len(batch)
+                self.events_written += len(events)
+                self.last_flush_ms = round((time.perf_counter() - started) * 1000, 3)
+            return len(batch)
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_ms / 1000)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Logged by flush(); the writes stay queued for the next round
+                time.sleep(self.flush_ms / 1000)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'flushMs': self.flush_ms,
+                'maxPending': self.max_pending,
+                'enqueued': self.enqueued,
+                'coalesced': self.coalesced,
+                'flushes': self.flushes,
+                'written': self.written,
+                'pendingEvents': len(self._events),
+                'eventsWritten': self.events_written,
+                'failures': self.failures,
+                'lastFlushMs': self.last_flush_ms,
+            }
+
+
+device_writer = DeviceStateWriter(
+    flush_ms=int(os.getenv('DEVICE_WRITE_FLUSH_MS', '50')),
+    max_pending=int(os.getenv('DEVICE_WRITE_MAX_PENDING', '1000')),
+)
+
+
+def flush_device_writes() -> int:
+    """Commit queued device-state writes; call before reading the devices table directly."""
+    return device_writer.flush()
+
+
+# Best effort: do not lose the last window on a clean shutdown
+atexit.register(device_writer.flush)
@@ -0,0 +1,333 @@
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from models.database import bump_table_version, db_connection, restore_deferred_schema
+from models.device_cache import device_cache, profile_cache
+from models.device_writer import flush_device_writes
+from utils.mac import parse_macs
+from utils.streaming import StreamItem
+
+ON_CONFLICT = ("skip", "update")
+
+_DEVICE_SQL = {
+    "skip": "INSERT OR IGNORE INTO devices (mac_key, mac, username, authorized, vlan) VALUES (?, ?, ?, ?, ?)",
+    "update": (
+        "INSERT INTO devices (mac_key, mac, username, authorized, vlan) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(mac_key) DO UPDATE SET username = excluded.username, "
+        "authorized = excluded.authorized, vlan = excluded.vlan"
+    ),
+}
+_PROFILE_SQL = {
+    "skip": "INSERT OR IGNORE INTO vlan_profiles (username, vlan) VALUES (?, ?)",
+    "update": (
+        "INSERT INTO vlan_profiles (username, vlan) VALUES (?, ?) "
+        "ON CONFLICT(username) DO UPDATE SET vlan = excluded.vlan"
+    ),
+}
+_TRUE = {"1", "true", "yes", "y", "on"}
+_FALSE = {"0", "false", "no", "n", "off", ""}
+
+
+class ImportReport:
+    """Counters and the first ``max_rejects`` rejected rows of one import."""
+
+    def __init__(self, max_rejects: int = 1000) -> None:
+        self.max_rejects = max_rejects
+        self.received = 0
+        self.imported = 0
+        self.skipped = 0
+        self.rejected = 0
+        self.rejects: List[Dict] = []
+        self.started = time.perf_counter()
+
+    def reject(self, index: int, error: str) -> None:
+        self.rejected += 1
+        if len(self.rejects) < self.max_rejects:
+            self.rejects.append({"index": index, "error": error})
+
+    def to_dict(self) -> Dict:
+        return {
+            "received": self.received,
+            "imported": self.imported,
+            "skipped": self.skipped,
+            "rejected": self.rejected,
+            "rejects": sorted(self.rejects, key=lambda r: r["index"]),
+            "rejectsTruncated": self.rejected > len(self.rejects),
+            "elapsedMs": round((time.perf_counter() - self.started) * 1000, 1),
+        }
+
+
+def _vlan(value: Any, required: bool) -> Optional[int]:
+    if value is None or (isinstance(value, str) and not value.strip()):
+        if required:
+            raise ValueError("vlan is required")
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"invalid vlan: {value!r}")
+    try:
+        vlan = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid vlan: {value!r}")
+    if not 1 <= vlan <= 4094:
+        raise ValueError(f"vlan out of range: {vlan}")
+    return vlan
+
+
+def _flag(value: Any) -> int:
+    if value is None or isinstance(value, bool):
+        return 0 if value is False else 1
+    text = str(value).strip().lower()
+    if text in _TRUE:
+        return 1
+    if text in _FALSE:
+        return 0 if text else 1
+    raise ValueError(f"invalid authorized flag: {value!r}")
+
+
+def _text(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    if not isinstance(value, (str, int)):
+        raise ValueError(f"invalid username: {value!r}")
+    return str(value).strip() or None
+
+
+def _device_fields(item: Any) -> Tuple[Any, Optional[str], int, Optional[int]]:
+    if not isinstance(item, dict):
+        raise ValueError("device must be an object")
+    username = item.get("username")
+    if username is None:
+        username = item.get("name")
+    return item.get("mac"), _text(username), _flag(item.get("authorized")), _vlan(item.get("vlan"), False)
+
+
+def _profile_row(item: Any) -> Tuple[str, int]:
+    if isinstance(item, (list, tuple)) and len(item) == 2:
+        username, vlan = item
+    elif isinstance(item, dict):
+        username, vlan = item.get("username"), item.get("vlan")
+    else:
+        raise ValueError("profile must be an object or [username, vlan]")
+    username = _text(username)
+    if not username:
+        raise ValueError("username is required")
+    return username, _vlan(vlan, True)
+
+
+def _chunks(items: Iterable[StreamItem], size: int) -> Iterator[List[StreamItem]]:
+    chunk: List[StreamItem] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _write(conn: sqlite3.Connection, work: Callable[[], None]) -> None:
+    # Python's sqlite3 does not open a transaction for DDL; without this each statement autocommits
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        work()
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+@contextmanager
+def _deferred_schema(conn: sqlite3.Connection, table: str, defer: bool) -> Iterator[None]:
+    """Drop the table's secondary indexes and triggers for the duration.
+
+    Indexes are rebuilt once at the end instead of row by row; the
+    change-counter triggers are replaced by version bumps. The drop and the
+    rebuild are short transactions of their own, with the import's batches
+    committed in between. The dropped definitions are saved in
+    deferred_schema by the same transaction as the drop, so init_db puts
+    back whatever a crash leaves dropped. Inside a caller's open transaction
+    all of it runs in that transaction instead.
+    """
+    if not defer:
+        yield
+        return
+    objects = conn.execute(
+        "SELECT type, name, sql FROM sqlite_master "
+        "WHERE type IN ('index', 'trigger') AND tbl_name = ? AND sql IS NOT NULL",
+        (table,),
+    ).fetchall()
+
+    def drop() -> None:
+        for row in objects:
+            conn.execute(f'DROP {row["type"].upper()} "{row["name"]}"')
+
+    if conn.in_transaction:
+        # The caller's commit or rollback covers the drop, the rows and the rebuild together
+        drop()
+        yield
+        for row in objects:
+            conn.execute(row["sql"])
+        if any(row["type"] == "trigger" for row in objects):
+            bump_table_version(conn, table)
+        return
+
+    def save_and_drop() -> None:
+        conn.executemany(
+            "INSERT OR REPLACE INTO deferred_schema (name, tbl, type, sql) VALUES (?, ?, ?, ?)",
+            [(row["name"], table, row["type"], row["sql"]) for row in objects],
+        )
+        drop()
+
+    _write(conn, save_and_drop)
+    try:
+        yield
+    finally:
+        _write(conn, lambda: restore_deferred_schema(conn, table))
+
+
+def _import(
+    table: str,
+    items: Iterable[StreamItem],
+    build_rows: Callable[[List[Tuple[int, Any]], ImportReport], List[tuple]],
+    sql: str,
+    chunk_size: int,
+    commit_rows: int,
+    defer_indexes: Optional[bool],
+    max_rejects: int,
+    conn: Optional[sqlite3.Connection],
+) -> ImportReport:
+    report = ImportReport(max_rejects)
+
+    def run(conn: sqlite3.Connection) -> None:
+        defer = defer_indexes
+        if defer is None:
+            # Initial onboarding: building the index once at the end is far cheaper
+            defer = conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is None
+        # Inside a caller's open transaction the caller decides when to commit
+        batched = not conn.in_transaction
+        pending: List[tuple] = []
+
+        def write() -> None:
+            # rowcount leaves out rows written by triggers (the devices change counter)
+            changed = conn.executemany(sql, pending).rowcount
+            report.imported += changed
+            report.skipped += len(pending) - changed
+            pending.clear()
+            if batched:
+                if defer:
+                    # Stands in for the dropped triggers, so listings see each batch
+                    bump_table_version(conn, table)
+                conn.commit()
+
+        with _deferred_schema(conn, table, defer):
+            for chunk in _chunks(items, chunk_size):
+                report.received += len(chunk)
+                parsed: List[Tuple[int, Any]] = []
+                for index, item, error in chunk:
+                    if error is not None:
+                        report.reject(index, error)
+                    else:
+                        parsed.append((index, item))
+                pending.extend(build_rows(parsed, report))
+                # Rows are written only once a batch is buffered, so a write
+                # transaction never stays open while the input is being read
+                if len(pending) >= commit_rows:
+                    write()
+            if pending:
+                write()
+
+    if conn is not None:
+        run(conn)
+    else:
+        with db_connection() as pooled:
+            run(pooled)
+    return report
+
+
+def _device_rows(parsed: List[Tuple[int, Any]], report: ImportReport) -> List[tuple]:
+    fields = []
+    for index, item in parsed:
+        try:
+            fields.append((index, _device_fields(item)))
+        except ValueError as e:
+            report.reject(index, str(e))
+    rows = []
+    macs = parse_macs(f[1][0] for f in fields)
+    for (index, (raw, username, authorized, vlan)), mac in zip(fields, macs):
+        if mac is None:
+            report.reject(index, f"invalid MAC: {raw!r}")
+            continue
+        rows.append((int(mac), mac.hyphen_upper, username, authorized, vlan))
+    return rows
+
+
+def _profile_rows(parsed: List[Tuple[int, Any]], report: ImportReport) -> List[tuple]:
+    rows = []
+    for index, item in parsed:
+        try:
+            rows.append(_profile_row(item))
+        except ValueError as e:
+            report.reject(index, str(e))
+    return rows
+
+
+def import_devices(
+    items: Iterable[StreamItem],
+    on_conflict: str = "skip",
+    chunk_size: int = 5000,
+    commit_rows: int = 20000,
+    defer_indexes: Optional[bool] = None,
+    max_rejects: int = 1000,
+    conn: Optional[sqlite3.Connection] = None,
+) -> Dict:
+    """Bulk-load devices from ``(index, item, error)`` records (see utils.streaming).
+
+    Items are objects with ``mac`` and optional ``username`` (or ``name``),
+    ``authorized`` (default true) and ``vlan``. Records are validated and
+    their MACs parsed a chunk at a time and buffered; every ``commit_rows``
+    rows are written with executemany and committed, so memory stays
+    bounded by that batch and the write lock is never held while the input
+    is read. ``on_conflict`` ``skip`` keeps existing devices, ``update``
+    overwrites them. Secondary indexes (and the change-counter triggers)
+    are dropped and rebuilt at the end when ``defer_indexes`` is set, by
+    default when the table starts empty; other connections see the table
+    without them until the import finishes.
+    Pass ``conn`` to import inside a caller's connection; if it has a
+    transaction open, the import runs in it and the caller commits.
+    """
+    if on_conflict not in ON_CONFLICT:
+        raise ValueError(f"on_conflict must be one of {', '.join(ON_CONFLICT)}")
+    # Queued admission writes go first; imported rows then win or are skipped as asked
+    flush_device_writes()
+    try:
+        report = _import("devices", items, _device_rows, _DEVICE_SQL[on_conflict],
+                         chunk_size, commit_rows, defer_indexes, max_rejects, conn)
+    finally:
+        device_cache.clear()
+    return report.to_dict()
+
+
+def import_vlan_profiles(
+    items: Iterable[StreamItem],
+    on_conflict: str = "skip",
+    chunk_size: int = 5000,
+    commit_rows: int = 20000,
+    defer_indexes: Optional[bool] = None,
+    max_rejects: int = 1000,
+    conn: Optional[sqlite3.Connection] = None,
+) -> Dict:
+    """Bulk-load username -> VLAN profiles; like import_devices.
+
+    Items are ``{"username", "vlan"}`` objects or ``[username, vlan]``
+    pairs, as produced by the ``mapping`` format.
+    """
+    if on_conflict not in ON_CONFLICT:
+        raise ValueError(f"on_conflict must be one of {', '.join(ON_CONFLICT)}")
+    try:
+        report = _import("vlan_profiles", items, _profile_rows, _PROFILE_SQL[on_conflict],
+                         chunk_size, commit_rows, defer_indexes, max_rejects, conn)
+    finally:
+        profile_cache.clear()
+    return report.to_dict()
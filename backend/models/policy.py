@@ -1,87 +1,651 @@
-from typing import Optional, Dict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from datetime import datetime
+import ipaddress
 import json
-import sqlite3
-from models.database import get_db_connection
+import re
+import threading
+import time
+from models.database import criteria_rows, db_connection
+from models.device_writer import flush_device_writes
+from utils.mac import MacAddress, prefix_range
+from utils.logging import log
 
 
-def _row_to_policy(row: sqlite3.Row) -> Dict:
-     criteria = row["criteria"]
-     try:
-         criteria_obj = json.loads(criteria) if criteria else {}
-     except Exception:
-         criteria_obj = {}
-     return {"name": row["name"], "vlan": row["vlan"], "criteria": criteria_obj}
+# Criteria kinds a policy may combine; all present criteria must match (AND).
+# Exact-match kinds accept a string or a list of strings (any of them).
+EXACT_KINDS = ("username", "group", "tenant")
+CRITERIA_KINDS = EXACT_KINDS + ("oui", "mac_prefix", "mac_range", "ip_cidr", "time_window")
 
+_DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+_HEX_RE = re.compile(r"[^0-9a-fA-F]")
+_TIME_RE = re.compile(r"^(\d{1,2}):(\d{2})$")
 
-def upsert_policy(name: str, vlan: int, criteria: Optional[Dict] = None) -> Dict:
-     criteria = criteria or {}
-     conn = get_db_connection()
-     try:
 
-        
-         cur = conn.cursor()
-         cur.execute(
-             "INSERT INTO policies (name, vlan, criteria) VALUES (?, ?, ?)\n"
-             "ON CONFLICT(name) DO UPDATE SET vlan=excluded.vlan, criteria=excluded.criteria",
-             (name, vlan, json.dumps(criteria)),
+def _mac_int(mac: str) -> int:
+     address = MacAddress.parse(mac)
+     if address is None:
+         raise ValueError(f"invalid MAC address: {mac!r}")
+     return int(address)
+
+
+def _oui(value: str) -> str:
+     digits = _HEX_RE.sub("", str(value)).upper()
+     if len(digits) != 6:
+         raise ValueError(f"OUI must be 3 bytes: {value!r}")
+     return f"{digits[0:2]}-{digits[2:4]}-{digits[4:6]}"
+
+
+def _as_list(value) -> List:
+     return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def _minutes(value: str) -> int:
+     m = _TIME_RE.match(str(value).strip())
+     if not m or int(m.group(1)) > 24 or int(m.group(2)) > 59:
+         raise ValueError(f"time must be HH:MM: {value!r}")
+     return int(m.group(1)) * 60 + int(m.group(2))
+
+
+def normalize_criteria(criteria: Optional[Dict]) -> Dict:
+     """Validate criteria and return them in canonical form; raises ValueError."""
+     if criteria is None:
+         return {}
+     if not isinstance(criteria, dict):
+         raise ValueError("criteria must be an object")
+     out: Dict[str, Any] = {}
+     for kind, value in criteria.items():
+         if kind not in CRITERIA_KINDS:
+             raise ValueError(f"unknown criteria '{kind}'; expected one of {', '.join(CRITERIA_KINDS)}")
+         if kind in EXACT_KINDS:
+             values = _as_list(value)
+             if not values or not all(isinstance(v, str) and v for v in values):
+                 raise ValueError(f"{kind} must be a non-empty string or list of strings")
+             out[kind] = value
+         elif kind in ("oui", "mac_prefix"):
+             ouis = [_oui(v) for v in _as_list(value)]
+             out[kind] = ouis if isinstance(value, (list, tuple)) else ouis[0]
+         elif kind == "mac_range":
+             ranges = value if isinstance(value, list) and value and isinstance(value[0], (list, dict)) else [value]
+             norm = []
+             for r in ranges:
+                 lo, hi = (r.get("from"), r.get("to")) if isinstance(r, dict) else tuple(r)
+                 if _mac_int(lo) > _mac_int(hi):
+                     raise ValueError("mac_range 'from' must not exceed 'to'")
+                 norm.append({"from": lo, "to": hi})
+             out[kind] = norm if len(norm) > 1 else norm[0]
+         elif kind == "ip_cidr":
+             for v in _as_list(value):
+                 ipaddress.ip_network(str(v), strict=False)
+             out[kind] = value
+         elif kind == "time_window":
+             if not isinstance(value, dict) or "start" not in value or "end" not in value:
+                 raise ValueError("time_window needs 'start' and 'end' (HH:MM)")
+             _minutes(value["start"]), _minutes(value["end"])
+             days = value.get("days")
+             if days is not None and not all(str(d).lower()[:3] in _DAYS for d in days):
+                 raise ValueError(f"time_window days must be among {', '.join(_DAYS)}")
+             out[kind] = value
+     return out
+
+
+def _legacy_tier(name: str, criteria: Dict) -> int:
+     # Without explicit priorities, keep the old precedence: username, OUI, other, default
+     if "username" in criteria:
+         return 0
+     if "oui" in criteria or "mac_prefix" in criteria:
+         return 1
+     if name == "default" and not criteria:
+         return 3
+     return 2
+
+
+def _legacy_alternatives(policy: Dict) -> List[Dict]:
+     """Criteria sets a ``legacy`` policy matches on, each on its own.
+
+     Policies stored before composite criteria existed keep their old
+     meaning: a username match, else an exact ``XX-XX-XX`` mac_prefix
+     match, else the policy named ``default``; any one is enough, and
+     other criteria were never looked at.
+     """
+     crit = policy["criteria"]
+     alternatives = []
+     username = crit.get("username")
+     if isinstance(username, str) and username:
+         alternatives.append({"username": username})
+     prefix = crit.get("mac_prefix")
+     if isinstance(prefix, str) and re.fullmatch(r"[0-9A-F]{2}-[0-9A-F]{2}-[0-9A-F]{2}", prefix):
+         alternatives.append({"mac_prefix": prefix})
+     if policy["name"] == "default":
+         alternatives.append({})
+     return alternatives
+
+
+def matching_criteria(policy: Dict) -> List[Dict]:
+     """The criteria sets under which ``policy`` matches (any one suffices)."""
+     if policy.get("match") == "legacy":
+         return _legacy_alternatives(policy)
+     return [policy["criteria"]]
+
+
+def _bitmap(bits: Iterable[int]) -> int:
+     """Build an int bitmap in one pass (OR-ing into a growing int is quadratic)."""
+     bits = list(bits)
+     if not bits:
+         return 0
+     buf = bytearray((max(bits) >> 3) + 1)
+     for i in bits:
+         buf[i >> 3] |= 1 << (i & 7)
+     return int.from_bytes(buf, "little")
+
+
+class _ExactIndex:
+     """value -> bitmap of policies requiring it; policies without the criterion always pass."""
+
+     def __init__(self) -> None:
+         self.unconstrained: Any = []
+         self.by_value: Dict[Any, Any] = {}
+
+     def add(self, values: Iterable, position: int) -> None:
+         for v in values:
+             self.by_value.setdefault(v, []).append(position)
+
+     def freeze(self) -> None:
+         self.unconstrained = _bitmap(self.unconstrained)
+         self.by_value = {v: _bitmap(bits) for v, bits in self.by_value.items()}
+
+     def match(self, values: Iterable) -> int:
+         mask = self.unconstrained
+         for v in values:
+             mask |= self.by_value.get(v, 0)
+         return mask
+
+
+class _PrefixIndex:
+     """Bit-prefix -> bitmap, probed once per prefix length in use (MAC ranges, IP CIDRs)."""
+
+     def __init__(self) -> None:
+         self.unconstrained: Any = []
+         self.by_prefix: Dict[Tuple[int, int, int], Any] = {}
+         self.lengths: Dict[int, set] = {}
+
+     def add(self, space: int, plen: int, value: int, position: int) -> None:
+         self.by_prefix.setdefault((space, plen, value), []).append(position)
+         self.lengths.setdefault(space, set()).add(plen)
+
+     def freeze(self) -> None:
+         self.unconstrained = _bitmap(self.unconstrained)
+         self.by_prefix = {k: _bitmap(bits) for k, bits in self.by_prefix.items()}
+
+     def match(self, space: int, bits: int, value: Optional[int]) -> int:
+         mask = self.unconstrained
+         if value is None:
+             return mask
+         for plen in self.lengths.get(space, ()):
+             mask |= self.by_prefix.get((space, plen, value >> (bits - plen)), 0)
+         return mask
+
+
+def _range_prefixes(lo: int, hi: int, bits: int) -> Iterable[Tuple[int, int]]:
+     """Split [lo, hi] into at most 2*bits aligned (prefixlen, prefix) blocks."""
+     while lo <= hi:
+         size = (lo & -lo).bit_length() - 1 if lo else bits
+         while size > 0 and lo + (1 << size) - 1 > hi:
+             size -= 1
+         yield bits - size, lo >> size
+         lo += 1 << size
+
+
+class PolicyEngine:
+     """Policies compiled into per-criterion bitmap indexes.
+
+     Policies are ordered by priority (higher first), then by the legacy
+     tier (username, OUI, other, default) and creation order; policy ``i``
+     owns bit ``i``. Each criterion kind maps a device attribute to the
+     bitmap of policies it satisfies, so evaluation is a handful of hash
+     probes and integer ANDs whatever the number of policies, and the
+     winner is the lowest set bit. A policy with no criteria only matches
+     when it is named ``default``. A ``legacy`` policy is compiled as one
+     entry per criterion it used to match on, each in its own tier, so
+     it still matches on any of them with the old precedence.
+     """
+
+     def __init__(self, policies: List[Dict]) -> None:
+         self.errors: Dict[str, str] = {}
+         entries = []
+         for policy in policies:
+             if policy.get("match") != "legacy":
+                 entries.append(policy)
+                 continue
+             alternatives = _legacy_alternatives(policy)
+             if not alternatives:
+                 self.errors[policy["name"]] = "no usable username or mac_prefix criteria"
+             entries.extend(dict(policy, criteria=criteria) for criteria in alternatives)
+         self.count = len(policies)
+         self.policies = sorted(
+             entries, key=lambda p: (-p["priority"], _legacy_tier(p["name"], p["criteria"]), p["seq"])
          )
-         conn.commit()
-         return {"name": name, "vlan": vlan, "criteria": criteria}
+         self._all = 0
+         self._exact = {kind: _ExactIndex() for kind in EXACT_KINDS}
+         self._oui = _ExactIndex()
+         self._mac = _PrefixIndex()
+         self._ip = _PrefixIndex()
+         self._timed: List[Tuple[int, Dict]] = []
+         self._untimed: Any = []
+         self._active_minute: Optional[int] = None
+         self._active_mask = 0
+         usable = []
+         for i, policy in enumerate(self.policies):
+             try:
+                 self._add(policy, i)
+             except (ValueError, TypeError, KeyError) as e:
+                 # Unusable stored criteria: the policy never matches
+                 self.errors[policy["name"]] = str(e)
+                 log(f"policy: skipped name={policy['name']} error={e}")
+                 continue
+             usable.append(i)
+         self._all = _bitmap(usable)
+         for index in list(self._exact.values()) + [self._oui, self._mac, self._ip]:
+             index.freeze()
+         self._untimed = _bitmap(self._untimed)
+         self._timed = [(1 << i, window) for i, window in self._timed]
+
+     def _add(self, policy: Dict, position: int) -> None:
+         crit = normalize_criteria(policy["criteria"])
+         if not crit and policy["name"] != "default":
+             raise ValueError("no criteria")
+         for kind in EXACT_KINDS:
+             if kind in crit:
+                 self._exact[kind].add(_as_list(crit[kind]), position)
+             else:
+                 self._exact[kind].unconstrained.append(position)
+         ouis = _as_list(crit.get("oui", [])) + _as_list(crit.get("mac_prefix", []))
+         if ouis:
+             self._oui.add(ouis, position)
+         else:
+             self._oui.unconstrained.append(position)
+         if "mac_range" in crit:
+             for r in _as_list(crit["mac_range"]):
+                 for plen, value in _range_prefixes(_mac_int(r["from"]), _mac_int(r["to"]), 48):
+                     self._mac.add(0, plen, value, position)
+         else:
+             self._mac.unconstrained.append(position)
+         if "ip_cidr" in crit:
+             for cidr in _as_list(crit["ip_cidr"]):
+                 net = ipaddress.ip_network(str(cidr), strict=False)
+                 bits = net.max_prefixlen
+                 self._ip.add(net.version, net.prefixlen, int(net.network_address) >> (bits - net.prefixlen), position)
+         else:
+             self._ip.unconstrained.append(position)
+         if "time_window" in crit:
+             self._timed.append((position, crit["time_window"]))
+         else:
+             self._untimed.append(position)
+
+     @staticmethod
+     def _in_window(window: Dict, now: datetime) -> bool:
+         start, end = _minutes(window["start"]), _minutes(window["end"])
+         minute = now.hour * 60 + now.minute
+         day = now.weekday()
+         if start <= end:
+             inside, weekday = start <= minute < end, day
+         elif minute >= start:
+             inside, weekday = True, day
+         else:
+             # Overnight window: the early-morning part belongs to the previous day
+             inside, weekday = minute < end, (day - 1) % 7
+         days = window.get("days")
+         return inside and (not days or _DAYS[weekday] in [str(d).lower()[:3] for d in days])
+
+     def _time_mask(self, now: Optional[datetime]) -> int:
+         if not self._timed:
+             return self._untimed
+         if now is not None:
+             return self._untimed | sum(bit for bit, w in self._timed if self._in_window(w, now))
+         # Time-window membership only changes on minute boundaries; recompute once per minute
+         minute = int(time.time() // 60)
+         if minute != self._active_minute:
+             current = datetime.now()
+             self._active_mask = sum(bit for bit, w in self._timed if self._in_window(w, current))
+             self._active_minute = minute
+         return self._untimed | self._active_mask
+
+     def evaluate(self, username: Optional[str], mac_hyphen_upper: str, context: Optional[Dict] = None) -> Optional[Dict]:
+         """Highest-precedence policy matching the device, or None.
+
+         ``context`` may carry ``ip``, ``group`` (string or list), ``tenant``
+         and ``now`` (datetime, defaults to the current local time).
+         """
+         context = context or {}
+         mask = self._all & self._time_mask(context.get("now"))
+         attrs = {
+             "username": [username] if username else [],
+             "group": [g for g in _as_list(context.get("group") or []) if g],
+             "tenant": [context["tenant"]] if context.get("tenant") else [],
+         }
+         for kind in EXACT_KINDS:
+             mask &= self._exact[kind].match(attrs[kind])
+             if not mask:
+                 return None
+         mask &= self._oui.match([mac_hyphen_upper[:8]])
+         try:
+             mac_value = _mac_int(mac_hyphen_upper)
+         except ValueError:
+             mac_value = None
+         mask &= self._mac.match(0, 48, mac_value)
+         ip_version, ip_value = 4, None
+         if context.get("ip"):
+             try:
+                 ip = ipaddress.ip_address(str(context["ip"]).strip())
+                 ip_version, ip_value = ip.version, int(ip)
+             except ValueError:
+                 pass
+         mask &= self._ip.match(ip_version, 32 if ip_version == 4 else 128, ip_value)
+         if not mask:
+             return None
+         return self.policies[(mask & -mask).bit_length() - 1]
+
+     def equivalence_key(self, username: Optional[str], mac_hyphen_upper: str) -> Tuple:
+         """Key shared by devices that every policy treats alike (ignoring context).
+
+         Two devices with equal keys get the same evaluate() result for the
+         same context, so callers can memoize decisions on it.
+         """
+         mac_mask = 0
+         if self._mac.by_prefix:
+             try:
+                 mac_mask = self._mac.match(0, 48, _mac_int(mac_hyphen_upper))
+             except ValueError:
+                 pass
+         # Values no policy mentions all behave alike
+         if username not in self._exact["username"].by_value:
+             username = None
+         oui = mac_hyphen_upper[:8] if mac_hyphen_upper[:8] in self._oui.by_value else None
+         return username, oui, mac_mask
+
+     def stats(self) -> Dict:
+         return {
+             "policies": self.count,
+             "entries": len(self.policies),
+             "errors": self.errors,
+             "timed": len(self._timed),
+             "macRangePrefixes": len(self._mac.by_prefix),
+             "ipPrefixes": len(self._ip.by_prefix),
+         }
+
+
+def load_policies(cur) -> List[Dict]:
+     """All policies with their criteria, in creation order."""
+     cur.execute(
+         "SELECT p.rowid AS seq, p.name, p.vlan, p.priority, p.match_mode, c.kind, c.value_json FROM policies p "
+         "LEFT JOIN policy_criteria c ON c.policy_name = p.name ORDER BY p.rowid"
+     )
+     policies: Dict[str, Dict] = {}
+     for r in cur.fetchall():
+         policy = policies.setdefault(r["name"], {
+             "name": r["name"], "vlan": r["vlan"], "priority": r["priority"] or 0,
+             "match": r["match_mode"], "criteria": {}, "seq": r["seq"],
+         })
+         if r["kind"] is not None:
+             policy["criteria"][r["kind"]] = json.loads(r["value_json"])
+     return list(policies.values())
+
+
+_engine: Optional[PolicyEngine] = None
+_generation = 0
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> PolicyEngine:
+     """The compiled engine, rebuilt lazily after any policy change.
+
+     Evaluation costs a fixed number of probes, so lookups go straight to the
+     engine; there is no per-(username, OUI) result cache in front of it.
+     """
+     global _engine
+     with _engine_lock:
+         if _engine is not None:
+             return _engine
+         generation = _generation
+     with db_connection() as conn:
+         engine = PolicyEngine(load_policies(conn.cursor()))
+     with _engine_lock:
+         # Only publish if no mutation happened while we were compiling
+         if generation == _generation:
+             _engine = engine
+     return engine
+
+
+def invalidate_policy_engine() -> None:
+     global _engine, _generation
+     with _engine_lock:
+         _engine = None
+         _generation += 1
+
+
+def upsert_policy(name: str, vlan: int, criteria: Optional[Dict] = None, priority: int = 0) -> Dict:
+     """Create or replace a policy; raises ValueError for invalid criteria.
+
+     The result always matches on all of its criteria, including a
+     ``legacy`` policy being rewritten.
+     """
+     criteria = normalize_criteria(criteria or {})
+     try:
+         with db_connection() as conn:
+             cur = conn.cursor()
+             # criteria JSON is still written so older builds can read the table
+             cur.execute(
+                 "INSERT INTO policies (name, vlan, criteria, priority, match_mode) VALUES (?, ?, ?, ?, 'all')\n"
+                 "ON CONFLICT(name) DO UPDATE SET vlan=excluded.vlan, criteria=excluded.criteria, "
+                 "priority=excluded.priority, match_mode=excluded.match_mode",
+                 (name, vlan, json.dumps(criteria), priority),
+             )
+             cur.execute("DELETE FROM policy_criteria WHERE policy_name = ?", (name,))
+             cur.executemany(
+                 "INSERT INTO policy_criteria (policy_name, kind, value, value_json) VALUES (?, ?, ?, ?)",
+                 [(name,) + row for row in criteria_rows(criteria)],
+             )
+             conn.commit()
+             return {"name": name, "vlan": vlan, "priority": priority, "match": "all", "criteria": criteria}
      finally:
-         conn.close()
+         invalidate_policy_engine()
 
 
 def delete_policy(name: str) -> int:
-     conn = get_db_connection()
      try:
-         cur = conn.cursor()
-         cur.execute("DELETE FROM policies WHERE name = ?", (name,))
-         conn.commit()
-         return cur.rowcount
+         with db_connection() as conn:
+             cur = conn.cursor()
+             cur.execute("DELETE FROM policies WHERE name = ?", (name,))
+             deleted = cur.rowcount
+             cur.execute("DELETE FROM policy_criteria WHERE policy_name = ?", (name,))
+             conn.commit()
+             return deleted
      finally:
-         conn.close()
+         invalidate_policy_engine()
 
 
 def list_policies() -> list:
-     conn = get_db_connection()
-     try:
-         cur = conn.cursor()
-         cur.execute("SELECT name, vlan, criteria FROM policies")
-         rows = cur.fetchall()
-         return [_row_to_policy(r) for r in rows]
-     finally:
-         conn.close()
+     with db_connection() as conn:
+         return [
+             {"name": p["name"], "vlan": p["vlan"], "priority": p["priority"], "match": p["match"], "criteria": p["criteria"]}
+             for p in load_policies(conn.cursor())
+         ]
 
 
-def find_vlan_for_device(username: Optional[str], mac_hyphen_upper: str) -> Optional[int]:
-     conn = get_db_connection()
-     try:
+def find_policy_for_device(username: Optional[str], mac_hyphen_upper: str, context: Optional[Dict] = None) -> Optional[Dict]:
+     return get_engine().evaluate(username, mac_hyphen_upper, context)
+
+
+def find_vlan_for_device(username: Optional[str], mac_hyphen_upper: str, context: Optional[Dict] = None) -> Optional[int]:
+     policy = find_policy_for_device(username, mac_hyphen_upper, context)
+     return policy["vlan"] if policy else None
+
+
+def apply_policy_changes(policies: List[Dict], changes: List[Dict]) -> List[Dict]:
+     """Return ``policies`` with proposed changes applied in memory; raises ValueError.
+
+     Each change is ``{"op": "upsert", "name", "vlan", "criteria", "priority"}``
+     (op defaults to upsert) or ``{"op": "delete", "name"}``.
+     """
+     if not isinstance(changes, list):
+         raise ValueError("changes must be an array")
+     by_name = {p["name"]: dict(p) for p in policies}
+     next_seq = max((p["seq"] for p in policies), default=0) + 1
+     for i, change in enumerate(changes):
+         if not isinstance(change, dict) or not change.get("name"):
+             raise ValueError(f"changes[{i}]: name is required")
+         op = change.get("op", "upsert")
+         name = change["name"]
+         if op == "delete":
+             by_name.pop(name, None)
+             continue
+         if op != "upsert":
+             raise ValueError(f"changes[{i}]: op must be 'upsert' or 'delete'")
+         if change.get("vlan") is None:
+             raise ValueError(f"changes[{i}]: vlan is required")
+         try:
+             vlan = int(change["vlan"])
+             priority = int(change.get("priority") or 0)
+             criteria = normalize_criteria(change.get("criteria") or {})
+         except (TypeError, ValueError) as e:
+             raise ValueError(f"changes[{i}]: {e}")
+         existing = by_name.get(name)
+         seq = existing["seq"] if existing else next_seq
+         next_seq += 0 if existing else 1
+         by_name[name] = {"name": name, "vlan": vlan, "priority": priority, "match": "all", "criteria": criteria, "seq": seq}
+     return list(by_name.values())
+
+
+class PolicySimulation:
+     """What-if evaluation of policy changes over the device inventory.
+
+     Every device is decided twice, under the current and the proposed
+     policies, with the same fallbacks as ``SDNControlPlane._decide``
+     (policy VLAN, then the user's VLAN profile, then the stored VLAN), so
+     differences come from the policy change alone. Decisions are memoized
+     on ``PolicyEngine.equivalence_key``, since without request context a
+     device contributes nothing else; large inventories take a few seconds.
+     """
+
+     def __init__(self, changes: List[Dict], chunk_size: int = 5000) -> None:
+         with db_connection() as conn:
+             current = load_policies(conn.cursor())
+         self.current = get_engine()
+         self.proposed = PolicyEngine(apply_policy_changes(current, changes))
+         self.chunk_size = chunk_size
+         self.now = datetime.now()
+         self.summary: Dict[str, Any] = {
+             "devices": 0, "changed": 0, "vlanChanged": 0,
+             "authorized": 0, "deauthorized": 0, "transitions": {},
+             "proposedErrors": self.proposed.errors,
+         }
+
+     def _vlan(self, engine: PolicyEngine, memo: Dict, username: Optional[str], mac_hyphen_upper: str) -> Optional[int]:
+         key = engine.equivalence_key(username, mac_hyphen_upper)
+         if key not in memo:
+             policy = engine.evaluate(username, mac_hyphen_upper, {"now": self.now})
+             memo[key] = policy["vlan"] if policy else None
+         return memo[key]
+
+     def iter_diffs(self) -> Iterable[Dict]:
+         """Yield one entry per device whose decision changes; fills ``summary``."""
+         old_memo: Dict = {}
+         new_memo: Dict = {}
+         transitions: Dict[str, int] = {}
+         # Current VLANs come from the table; include queued admission writes
+         flush_device_writes()
+         with db_connection() as conn:
+             cur = conn.cursor()
+             cur.execute(
+                 "SELECT d.mac, d.username, d.vlan, vp.vlan AS profile_vlan FROM devices d "
+                 "LEFT JOIN vlan_profiles vp ON vp.username = d.username"
+             )
+             while True:
+                 rows = cur.fetchmany(self.chunk_size)
+                 if not rows:
+                     break
+                 for r in rows:
+                     self.summary["devices"] += 1
+                     mac = r["mac"]
+                     username = r["username"]
+                     fallback = r["profile_vlan"] if username and r["profile_vlan"] is not None else r["vlan"]
+                     old = self._vlan(self.current, old_memo, username, mac)
+                     new = self._vlan(self.proposed, new_memo, username, mac)
+                     old = fallback if old is None else old
+                     new = fallback if new is None else new
+                     if old == new:
+                         continue
+                     self.summary["changed"] += 1
+                     if old is None:
+                         self.summary["authorized"] += 1
+                     elif new is None:
+                         self.summary["deauthorized"] += 1
+                     else:
+                         self.summary["vlanChanged"] += 1
+                     label = f"{old}->{new}"
+                     transitions[label] = transitions.get(label, 0) + 1
+                     yield {
+                         "mac": mac,
+                         "username": username,
+                         "old": {"authorized": old is not None, "vlan": old},
+                         "new": {"authorized": new is not None, "vlan": new},
+                     }
+         self.summary["transitions"] = dict(sorted(transitions.items(), key=lambda kv: -kv[1])[:50])
+
+
+def get_policy(name: str) -> Optional[Dict]:
+     with db_connection() as conn:
          cur = conn.cursor()
-         # Username match
-         if username:
-             cur.execute("SELECT vlan, criteria FROM policies")
-             for r in cur.fetchall():
-                 try:
-                     crit = json.loads(r["criteria"]) if r["criteria"] else {}
-                 except Exception:
-                     crit = {}
-                 if crit.get("username") == username:
-                     return r["vlan"]
-         # MAC prefix match
-         prefix = mac_hyphen_upper[:8]
-         cur.execute("SELECT vlan, criteria FROM policies")
-         for r in cur.fetchall():
-             try:
-                 crit = json.loads(r["criteria"]) if r["criteria"] else {}
-             except Exception:
-                 crit = {}
-             if crit.get("mac_prefix") == prefix:
-                 return r["vlan"]
-         # Default policy
-         cur.execute("SELECT vlan FROM policies WHERE name = ?", ("default",))
+         cur.execute("SELECT rowid AS seq, name, vlan, priority, match_mode FROM policies WHERE name = ?", (name,))
          row = cur.fetchone()
-         return row["vlan"] if row else None
-     finally:
-         conn.close()
+         if not row:
+             return None
+         cur.execute("SELECT kind, value_json FROM policy_criteria WHERE policy_name = ?", (name,))
+         criteria = {r["kind"]: json.loads(r["value_json"]) for r in cur.fetchall()}
+         return {
+             "name": row["name"], "vlan": row["vlan"], "priority": row["priority"] or 0,
+             "match": row["match_mode"], "criteria": criteria,
+         }
+
 
+def affected_device_macs(cur, criteria_list: List[Dict]) -> Tuple[str, Optional[List[str]]]:
+     """Devices whose decision a change to policies with these criteria may alter.
 
+     Returns ``(scope, macs)``. Each policy only matches devices satisfying
+     all of its criteria, so one indexed criterion (username, then OUI, then
+     MAC range) bounds its devices: scope ``targeted``. Policies matching
+     only on request context (group, tenant, IP) cannot be re-evaluated
+     from stored device rows: scope ``context``, no devices. Anything else,
+     such as the default policy, may affect every device: scope ``fleet``
+     with ``macs`` None.
+     """
+     macs: Dict[str, None] = {}
+     context_only = True
+     for criteria in criteria_list:
+         if "username" in criteria:
+             usernames = [u for u in _as_list(criteria["username"]) if isinstance(u, str)]
+             for i in range(0, len(usernames), 400):
+                 chunk = usernames[i:i + 400]
+                 cur.execute(
+                     f"SELECT mac FROM devices WHERE username IN ({','.join('?' * len(chunk))})", chunk
+                 )
+                 macs.update((r["mac"], None) for r in cur.fetchall())
+         elif "oui" in criteria or "mac_prefix" in criteria:
+             for oui in _as_list(criteria.get("oui", [])) + _as_list(criteria.get("mac_prefix", [])):
+                 # Range scan on the mac_key primary key
+                 keys = prefix_range(oui)
+                 cur.execute("SELECT mac FROM devices WHERE mac_key >= ? AND mac_key < ?", (keys.start, keys.stop))
+                 macs.update((r["mac"], None) for r in cur.fetchall())
+         elif "mac_range" in criteria:
+             for r in _as_list(criteria["mac_range"]):
+                 cur.execute(
+                     "SELECT mac FROM devices WHERE mac_key BETWEEN ? AND ?", (_mac_int(r["from"]), _mac_int(r["to"]))
+                 )
+                 macs.update((row["mac"], None) for row in cur.fetchall())
+         elif not criteria or any(k not in ("group", "tenant", "ip_cidr") for k in criteria):
+             return "fleet", None
+         else:
+             continue
+         context_only = False
+     if context_only and criteria_list:
+         return "context", []
+     return "targeted", list(macs)
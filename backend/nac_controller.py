@@ -1,48 +1,21 @@
 import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '.')))
-import re
 import subprocess
 from typing import Dict, Optional
-from models.database import get_db_connection
+from models.device_cache import get_device as get_cached_device, get_user_vlan
 from utils.logging import log
+from utils.mac import MacAddress
 from sdn.southbound import driver as southbound_driver
 
 def normalize_mac_colon_lower(mac_address: str) -> str:
-    if mac_address is None:
-        raise ValueError("MAC address is required")
-    mac_clean = mac_address.strip().lower().replace("-", ":")
-    pattern = r"^[0-9a-f]{2}(:[0-9a-f]{2}){5}$"
-    if not re.match(pattern, mac_clean):
-        raise ValueError("Invalid MAC address format")
-    return mac_clean
+    return MacAddress(mac_address).colon_lower
 
 def normalize_mac_hyphen_upper(mac_address: str) -> str:
-    mac_clean = mac_address.strip().upper().replace(":", "-")
-    pattern = r"^[0-9A-F]{2}(-[0-9A-F]{2}){5}$"
-    if not re.match(pattern, mac_clean):
-        raise ValueError("Invalid MAC address format")
-    return mac_clean
+    return MacAddress(mac_address).hyphen_upper
 
 def get_device_by_mac(mac: str) -> Optional[Dict]:
-    mac_norm = normalize_mac_colon_lower(mac)
-    mac_key = mac_norm.upper().replace(":", "-")
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT mac, username, authorized, vlan FROM devices WHERE mac = ?", (mac_key,))
-        row = cur.fetchone()
-        if not row:
-            return None
-        doc = {
-            "mac": row["mac"],
-            "username": row["username"],
-            "authorized": bool(row["authorized"]),
-            "vlan": row["vlan"],
-        }
-        return doc
-    finally:
-        conn.close()
+    return get_cached_device(MacAddress(mac).hyphen_upper)
 
 def validate_device(mac: str) -> Optional[str]:
     mac_norm = normalize_mac_colon_lower(mac)
@@ -55,16 +28,9 @@ def validate_device(mac: str) -> Optional[str]:
     return username
 
 def get_vlan(username: str) -> Optional[int]:
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT vlan FROM vlan_profiles WHERE username = ?", (username,))
-        row = cur.fetchone()
-        vlan = row["vlan"] if row else None
-        log(f"get_vlan: user={username} vlan={vlan}")
-        return vlan
-    finally:
-        conn.close()
+    vlan = get_user_vlan(username)
+    log(f"get_vlan: user={username} vlan={vlan}")
+    return vlan
 
 def block_device(mac: str) -> bool:
     mac_norm = normalize_mac_colon_lower(mac)
@@ -80,7 +46,7 @@ def validate_and_assign(mac: str) -> Dict:
     if not authorized:
         block_device(mac_norm)
     response = {
-        "mac": mac_norm.upper().replace(":", "-"),
+        "mac": normalize_mac_hyphen_upper(mac_norm),
         "username": username,
         "authorized": authorized,
         "vlan": vlan,
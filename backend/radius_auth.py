@@ -1,13 +1,10 @@
-from models.database import get_db_connection
+from models.database import db_connection
 
 def authenticate_user(username: str, password: str) -> bool:
     if not username or not username.strip():
         return False
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         cur.execute("SELECT 1 FROM vlan_profiles WHERE username = ?", (username,))
         row = cur.fetchone()
-        return bool(row)  # Password ignored for simulation
-    finally:
-        conn.close()
\ No newline at end of file
+        return bool(row)  # Password ignored for simulation
\ No newline at end of file
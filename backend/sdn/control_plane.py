@@ -1,135 +1,319 @@
-from typing import Dict, Optional
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import os
 import sqlite3
-from models.database import get_db_connection
+from models.database import db_connection
+from models.device_cache import (
+    TTLCache, device_cache, profile_cache, get_device, get_user_vlan, put_device, row_to_device,
+)
+from models.device_events import state_change
+from models.device_writer import device_writer
 from utils.logging import log
-from sdn.factory import get_southbound_driver
-from nac_controller import normalize_mac_colon_lower
+from utils.mac import MacAddress, parse_macs
 from models.policy import find_vlan_for_device
-from sdn.southbound import nbi
+from sdn.southbound import nbi, driver as southbound_driver
+from sdn.pipeline import create_pipeline
+from sdn.reenforce import create_reenforcer
+
+# Keep IN (...) lists well below SQLite's host parameter limit
+_SQL_CHUNK = 400
+
+
+def _chunks(items: List, size: int = _SQL_CHUNK) -> Iterable[List]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
 
 
 class SDNControlPlane:
     """High-level NAC/SDN control logic: validate, derive policy, program data plane."""
 
     def _get_device_by_mac(self, mac_hyphen_upper: str) -> Optional[Dict]:
-        conn = get_db_connection()
-        try:
-            cur = conn.cursor()
-            cur.execute("SELECT mac, username, authorized, vlan FROM devices WHERE mac = ?", (mac_hyphen_upper,))
-            row = cur.fetchone()
-            if not row:
-                # Fallback: some inserts may have stored colon-upper format; try that too
-                mac_colon_upper = mac_hyphen_upper.replace("-", ":")
-                cur.execute("SELECT mac, username, authorized, vlan FROM devices WHERE mac = ?", (mac_colon_upper,))
-                row = cur.fetchone()
-                if not row:
-                    return None
-            return {
-                "mac": row["mac"],
-                "username": row["username"],
-                "authorized": bool(row["authorized"]),
-                "vlan": row["vlan"],
-            }
-        finally:
-            conn.close()
+        # Served from the device cache; one mac_key point query on miss
+        return get_device(mac_hyphen_upper)
 
     def _get_vlan_for_user(self, username: str) -> Optional[int]:
-        conn = get_db_connection()
-        try:
-            cur = conn.cursor()
-            cur.execute("SELECT vlan FROM vlan_profiles WHERE username = ?", (username,))
-            row = cur.fetchone()
-            return row["vlan"] if row else None
-        finally:
-            conn.close()
+        return get_user_vlan(username)
+
+    def _get_devices_by_macs(self, cur: sqlite3.Cursor, macs: List[MacAddress]) -> Dict[str, Dict]:
+        """Set-based variant of _get_device_by_mac keyed by hyphen-upper MAC.
+
+        Unknown MACs, including those answered by a negative cache entry,
+        are left out rather than mapped to None.
+        """
+        found: Dict[str, Dict] = {}
+        missing: List[MacAddress] = []
+        for mac in macs:
+            key = mac.hyphen_upper
+            # Queued writes first, so decisions see their own uncommitted state
+            hit, device = device_writer.get(key)
+            if not hit:
+                hit, device = device_cache.get(key)
+            if hit:
+                if device is not None:
+                    found[key] = dict(device)
+            else:
+                missing.append(mac)
+        for chunk in _chunks(missing):
+            cur.execute(
+                "SELECT mac, username, authorized, vlan FROM devices WHERE mac_key IN ({})".format(
+                    ",".join("?" for _ in chunk)
+                ),
+                [int(m) for m in chunk],
+            )
+            for row in cur.fetchall():
+                found[row["mac"]] = row_to_device(row)
+        for mac in missing:
+            device_cache.put(mac.hyphen_upper, found.get(mac.hyphen_upper))
+        return found
+
+    def _get_vlans_for_users(self, cur: sqlite3.Cursor, usernames: List[str]) -> Dict[str, Optional[int]]:
+        profiles: Dict[str, Optional[int]] = {}
+        missing: List[str] = []
+        for username in usernames:
+            hit, vlan = profile_cache.get(username)
+            if hit:
+                profiles[username] = vlan
+            else:
+                missing.append(username)
+        for chunk in _chunks(missing):
+            cur.execute(
+                "SELECT username, vlan FROM vlan_profiles WHERE username IN ({})".format(
+                    ",".join("?" for _ in chunk)
+                ),
+                chunk,
+            )
+            for row in cur.fetchall():
+                profiles[row["username"]] = row["vlan"]
+        for username in missing:
+            profile_cache.put(username, profiles.setdefault(username, None))
+        return profiles
 
     def __init__(self) -> None:
-        self.driver = get_southbound_driver()
+        self.driver = southbound_driver
+        # Last state pushed southbound per MAC: (authorized, vlan). Used to
+        # skip re-programming devices whose decision has not changed. Bounded
+        # like the device cache; an evicted or expired MAC is just pushed again.
+        self._programmed = TTLCache(
+            maxsize=int(os.getenv('PROGRAMMED_CACHE_SIZE', '100000')),
+            ttl=float(os.getenv('PROGRAMMED_CACHE_TTL', '3600')),
+        )
 
-    def validate_and_program(self, mac: str) -> Dict:
-        mac_colon_lower = normalize_mac_colon_lower(mac)
-        mac_hyphen_upper = mac_colon_lower.upper().replace(":", "-")
+    @staticmethod
+    def _row_in_sync(device: Optional[Dict], state: Optional[Dict]) -> bool:
+        return (
+            device is not None
+            and state is not None
+            and bool(device.get("authorized")) == state["authorized"]
+            and device.get("vlan") == state["vlan"]
+        )
 
-        device = self._get_device_by_mac(mac_hyphen_upper)
+    def _is_programmed(self, mac_colon_lower: str, result: Dict) -> bool:
+        hit, state = self._programmed.get(mac_colon_lower)
+        return hit and state == (result["authorized"], result["vlan"])
+
+    def _mark_programmed(self, entries: List[Tuple[str, Dict]]) -> None:
+        for mac_colon_lower, result in entries:
+            self._programmed.put(mac_colon_lower, (result["authorized"], result["vlan"]))
+
+    def forget_programmed(self, macs_colon_lower: Optional[Iterable[str]] = None) -> None:
+        """Drop remembered data-plane state, for some MACs or (None) all of them."""
+        if macs_colon_lower is None:
+            self._programmed.clear()
+            return
+        for mac_colon_lower in macs_colon_lower:
+            self._programmed.invalidate(mac_colon_lower)
+
+    def stats(self) -> Dict:
+        return {"programmed": self._programmed.stats()}
+
+    def _decide(
+        self,
+        mac_hyphen_upper: str,
+        device: Optional[Dict],
+        get_user_vlan: Callable[[str], Optional[int]],
+        context: Optional[Dict] = None,
+    ) -> Tuple[Dict, Optional[bool], Optional[Dict]]:
+        """Derive the target state for a MAC.
+
+        Returns the API result, the devices-table write it implies (True to
+        insert the row, False to update it, None when nothing is persisted)
+        and the device row as it will look afterwards, for the cache and the
+        device writer.
+        ``context`` carries request attributes (ip, group, tenant) for
+        policies that match on them.
+        """
         if not device:
             # Device not pre-registered: try policy-based authorization using MAC prefix or default policy.
-            vlan_policy = find_vlan_for_device(None, mac_hyphen_upper)
+            vlan_policy = find_vlan_for_device(None, mac_hyphen_upper, context)
             if vlan_policy is not None:
-                # Program network to allow on derived VLAN and persist a device record for future lookups
-                nbi.permit_mac_on_vlan(mac_colon_lower, vlan_policy)
-                try:
-                    conn = get_db_connection()
-                    cur = conn.cursor()
-                    cur.execute(
-                        "INSERT OR REPLACE INTO devices (mac, username, authorized, vlan) VALUES (?, ?, ?, ?)",
-                        (mac_hyphen_upper, None, 1, int(vlan_policy)),
-                    )
-                    conn.commit()
-                finally:
-                    conn.close()
-                log(f"control_plane: policy_allow mac={mac_colon_lower} vlan={vlan_policy} (no prior device)")
-                return {
-                    "mac": mac_hyphen_upper,
-                    "username": None,
-                    "authorized": True,
-                    "vlan": vlan_policy,
-                }
-            # No matching policy: quarantine
-            nbi.quarantine_mac(mac_colon_lower)
-            log(f"control_plane: not_found mac={mac_colon_lower} -> blocked")
-            return {
-                "mac": mac_hyphen_upper,
-                "username": None,
-                "authorized": False,
-                "vlan": None,
-            }
+                # Allow on the derived VLAN and persist a device record for future lookups
+                write = True
+                result = {"mac": mac_hyphen_upper, "username": None, "authorized": True, "vlan": vlan_policy}
+                return result, write, dict(result, vlan=int(vlan_policy))
+            # No matching policy: quarantine without creating a record
+            return {"mac": mac_hyphen_upper, "username": None, "authorized": False, "vlan": None}, None, None
 
         username = device.get('username')
         # Policy-derived VLAN takes precedence; fall back to user->vlan mapping
-        vlan = find_vlan_for_device(username, mac_hyphen_upper)
+        vlan = find_vlan_for_device(username, mac_hyphen_upper, context)
         if vlan is None and username:
-            vlan = self._get_vlan_for_user(username)
+            vlan = get_user_vlan(username)
         # Final fallback: respect device's configured VLAN if present
         if vlan is None and device.get('vlan') is not None:
             vlan = device.get('vlan')
         authorized = vlan is not None
+        write = False
+        state = dict(device, authorized=authorized, vlan=int(vlan) if authorized else None)
+        result = {"mac": mac_hyphen_upper, "username": username, "authorized": authorized, "vlan": vlan}
+        return result, write, state
 
-        if authorized:
-            # Program data plane and persist the resolved VLAN/authorization.
-            nbi.permit_mac_on_vlan(mac_colon_lower, vlan)
-            try:
-                conn = get_db_connection()
-                cur = conn.cursor()
-                cur.execute(
-                    "UPDATE devices SET authorized = ?, vlan = ? WHERE mac = ?",
-                    (1, int(vlan), mac_hyphen_upper),
-                )
-                conn.commit()
-            finally:
-                conn.close()
-            log(f"control_plane: allowed mac={mac_colon_lower} vlan={vlan}")
-        else:
-            # Quarantine and persist blocked state
-            nbi.quarantine_mac(mac_colon_lower)
-            try:
-                conn = get_db_connection()
-                cur = conn.cursor()
-                cur.execute(
-                    "UPDATE devices SET authorized = ?, vlan = NULL WHERE mac = ?",
-                    (0, mac_hyphen_upper),
-                )
-                conn.commit()
-            finally:
-                conn.close()
+    def _log_decision(self, mac_colon_lower: str, result: Dict, known: bool) -> None:
+        if result["authorized"]:
+            if known:
+                log(f"control_plane: allowed mac={mac_colon_lower} vlan={result['vlan']}")
+            else:
+                log(f"control_plane: policy_allow mac={mac_colon_lower} vlan={result['vlan']} (no prior device)")
+        elif known:
             log(f"control_plane: no_vlan mac={mac_colon_lower} -> blocked")
+        else:
+            log(f"control_plane: not_found mac={mac_colon_lower} -> blocked")
 
+    def plan(self, mac: str, force: bool = False, context: Optional[Dict] = None) -> Dict:
+        """Decide what a MAC should get without touching the DB or data plane.
+
+        The returned plan is consumed by persist() and program(); raises
+        ValueError for malformed MACs. Unless ``force`` is set, a device row
+        that already holds the decided state yields no write.
+        """
+        address = MacAddress(mac)
+        mac_colon_lower = address.colon_lower
+        mac_hyphen_upper = address.hyphen_upper
+        device = self._get_device_by_mac(mac_hyphen_upper)
+        result, write, state = self._decide(mac_hyphen_upper, device, self._get_vlan_for_user, context)
+        if not force and self._row_in_sync(device, state):
+            write = None
         return {
-            "mac": mac_hyphen_upper,
-            "username": username,
-            "authorized": authorized,
-            "vlan": vlan,
+            "address": address,
+            "mac_colon_lower": mac_colon_lower,
+            "result": result,
+            "write": write,
+            "state": state,
+            "known": device is not None,
+            "previous": device,
+            "force": force,
         }
 
+    def persist(self, plans: List[Dict]) -> None:
+        """Queue the device state of one or more plans, and its history events, on the write-behind writer."""
+        plans = [p for p in plans if p["write"] is not None]
+        if not plans:
+            return
+        events = [state_change(p["address"], p.get("previous"), p["state"], "admission") for p in plans]
+        device_writer.enqueue(
+            ((p["address"], p["write"], p["state"]) for p in plans),
+            [e for e in events if e is not None],
+        )
+        for p in plans:
+            put_device(p["result"]["mac"], p["state"])
+
+    def program(self, plan: Dict) -> bool:
+        """Push a plan to the data plane through the NBI.
+
+        Skipped when the MAC was last programmed with the same decision,
+        unless the plan was made with ``force``.
+        """
+        mac_colon_lower = plan["mac_colon_lower"]
+        result = plan["result"]
+        if not plan.get("force") and self._is_programmed(mac_colon_lower, result):
+            log(f"control_plane: in_sync mac={mac_colon_lower} authorized={result['authorized']} vlan={result['vlan']}")
+            return True
+        if result["authorized"]:
+            ok = nbi.permit_mac_on_vlan(mac_colon_lower, result["vlan"])
+        else:
+            ok = nbi.quarantine_mac(mac_colon_lower)
+        if ok:
+            self._mark_programmed([(mac_colon_lower, result)])
+        self._log_decision(mac_colon_lower, result, plan["known"])
+        return ok
+
+    def validate_and_program(self, mac: str, force: bool = False, context: Optional[Dict] = None) -> Dict:
+        """Validate a MAC and program the data plane.
+
+        Only changed state is sent southbound or written to the DB;
+        ``force`` re-applies both regardless.
+        """
+        plan = self.plan(mac, force=force, context=context)
+        # Program data plane, then persist the resolved VLAN/authorization.
+        self.program(plan)
+        self.persist([plan])
+        return plan["result"]
+
+    def validate_and_program_many(
+        self, macs: List[str], force: bool = False, context: Optional[Dict] = None
+    ) -> List[Dict]:
+        """Batch form of validate_and_program.
+
+        Devices and VLAN profiles are resolved with set-based queries, all
+        state changes are written in one transaction and the data plane is
+        programmed with one grouped call per action. Results are returned in
+        input order; invalid MACs yield ``{"mac": ..., "error": ...}``.
+        """
+        parsed = parse_macs(macs)
+        normalized = [m.colon_lower if m is not None else None for m in parsed]
+        addresses = {m.colon_lower: m for m in parsed if m is not None}
+        unique = list(addresses)
+        hyphen = {c: m.hyphen_upper for c, m in addresses.items()}
+
+        decided: Dict[str, Dict] = {}
+        writes: List[tuple] = []
+        events: List[tuple] = []
+        states: Dict[str, Dict] = {}
+        permits: List[Tuple[str, int]] = []
+        quarantines: List[str] = []
+        with db_connection() as conn:
+            cur = conn.cursor()
+            devices = self._get_devices_by_macs(cur, list(addresses.values()))
+            usernames = sorted({d["username"] for d in devices.values() if d.get("username")})
+            profiles = self._get_vlans_for_users(cur, usernames)
+            for mac_colon_lower in unique:
+                device = devices.get(hyphen[mac_colon_lower])
+                result, write, state = self._decide(hyphen[mac_colon_lower], device, profiles.get, context)
+                decided[mac_colon_lower] = result
+                if write is not None and (force or not self._row_in_sync(device, state)):
+                    writes.append((addresses[mac_colon_lower], write, state))
+                    states[hyphen[mac_colon_lower]] = state
+                    event = state_change(addresses[mac_colon_lower], device, state, "admission")
+                    if event is not None:
+                        events.append(event)
+                if not force and self._is_programmed(mac_colon_lower, result):
+                    continue
+                if result["authorized"]:
+                    permits.append((mac_colon_lower, result["vlan"]))
+                else:
+                    quarantines.append(mac_colon_lower)
+                self._log_decision(mac_colon_lower, result, device is not None)
+
+            if permits and nbi.permit_many(permits):
+                self._mark_programmed([(m, decided[m]) for m, _vlan in permits])
+            if quarantines and nbi.quarantine_many(quarantines):
+                self._mark_programmed([(m, decided[m]) for m in quarantines])
+        device_writer.enqueue(writes, events)
+        for mac_hyphen_upper, state in states.items():
+            put_device(mac_hyphen_upper, state)
+
+        results: List[Dict] = []
+        for raw, mac_colon_lower in zip(macs, normalized):
+            if mac_colon_lower is None:
+                results.append({"mac": raw, "error": "Invalid MAC address format"})
+            else:
+                results.append(dict(decided[mac_colon_lower]))
+        log(f"control_plane: batch size={len(macs)} unique={len(unique)} "
+            f"allowed={len(permits)} blocked={len(quarantines)} writes={len(states)}")
+        return results
+
 control = SDNControlPlane()
 
+# Asynchronous admission pipeline; worker threads start on first submit
+pipeline = create_pipeline(control)
 
+# Background re-enforcement of devices affected by policy changes
+reenforcer = create_reenforcer(control)
@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from utils.logging import log
+from sdn.interfaces import SouthboundDriver
+
+
+class _PendingOp:
+    __slots__ = ('op', 'vlan_id', 'futures', 'queued_at')
+
+    def __init__(self, op: str, vlan_id: Optional[int], future: Future) -> None:
+        self.op = op
+        self.vlan_id = vlan_id
+        self.futures: List[Future] = [future]
+        self.queued_at = time.monotonic()
+
+
+class SouthboundExecutor:
+    """Coalescing, retrying command executor between the NBI and a driver.
+
+    Operations are queued per MAC and only the latest one survives: a
+    quarantine followed by a permit for the same MAC before it ran collapses
+    into the permit. Callers whose op was superseded get False at once (it
+    was never applied); callers asking for the surviving op get its outcome.
+    Different MACs run concurrently on up to ``concurrency`` workers; each
+    worker takes up to ``batch_size`` ready MACs and sends them to the
+    driver as one grouped call per operation type. Failed or raising calls
+    are retried with exponential backoff.
+    """
+
+    def __init__(self, driver: SouthboundDriver, concurrency: int = 4, batch_size: int = 256,
+                 max_retries: int = 3, base_delay: float = 0.05, max_delay: float = 2.0) -> None:
+        self._driver = driver
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._pending: Dict[str, _PendingOp] = {}
+        self._ready: Deque[str] = deque()
+        self._running: Set[str] = set()
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._latencies: Deque[float] = deque(maxlen=1000)
+        self.submitted = 0
+        self.coalesced = 0
+        self.superseded = 0
+        self.completed = 0
+        self.retries = 0
+        self.failures = 0
+
+    def _ensure_started(self) -> None:
+        if self._threads:
+            return
+        for i in range(self.concurrency):
+            t = threading.Thread(target=self._worker, name=f"southbound-exec-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, mac_colon_lower: str, op: str, vlan_id: Optional[int] = None) -> Future:
+        """Queue ``op`` ('block', 'unblock' or 'allow') for a MAC."""
+        future: Future = Future()
+        with self._cond:
+            self._ensure_started()
+            self.submitted += 1
+            existing = self._pending.get(mac_colon_lower)
+            if existing is not None:
+                # Last intent wins; callers of a different intent never see theirs applied
+                self.coalesced += 1
+                if (existing.op, existing.vlan_id) != (op, vlan_id):
+                    superseded = existing.futures
+                    self.superseded += len(superseded)
+                    existing.op = op
+                    existing.vlan_id = vlan_id
+                    existing.futures = []
+                    for earlier in superseded:
+                        earlier.set_result(False)
+                existing.futures.append(future)
+            else:
+                self._pending[mac_colon_lower] = _PendingOp(op, vlan_id, future)
+                if mac_colon_lower not in self._running:
+                    self._ready.append(mac_colon_lower)
+                    self._cond.notify()
+        return future
+
+    def _take_batch(self) -> List[Tuple[str, _PendingOp]]:
+        with self._cond:
+            while not self._ready:
+                self._cond.wait()
+            batch = []
+            while self._ready and len(batch) < self.batch_size:
+                mac = self._ready.popleft()
+                op = self._pending.pop(mac, None)
+                if op is None:
+                    continue
+                self._running.add(mac)
+                batch.append((mac, op))
+            return batch
+
+    def _call(self, op: str, items: List[Tuple[str, _PendingOp]]) -> bool:
+        macs = [mac for mac, _ in items]
+        if op == 'allow':
+            return self._driver.allow_macs_on_vlans([(mac, p.vlan_id) for mac, p in items])
+        if op == 'block':
+            return self._driver.block_macs(macs)
+        results = [self._driver.unblock_mac(mac) for mac in macs]
+        return all(results)
+
+    def _run_with_retries(self, op: str, items: List[Tuple[str, _PendingOp]]) -> bool:
+        delay = self.base_delay
+        for attempt in range(self.max_retries + 1):
+            try:
+                if self._call(op, items):
+                    return True
+                error = 'driver returned failure'
+            except Exception as e:
+                error = str(e)
+            if attempt == self.max_retries:
+                log(f"southbound-exec: giving up op={op} count={len(items)} error={error}")
+                return False
+            self.retries += 1
+            log(f"southbound-exec: retry op={op} count={len(items)} attempt={attempt + 1} error={error}")
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_delay)
+        return False
+
+    def _worker(self) -> None:
+        while True:
+            batch = self._take_batch()
+            groups: Dict[str, List[Tuple[str, _PendingOp]]] = {}
+            for mac, pending in batch:
+                groups.setdefault(pending.op, []).append((mac, pending))
+            for op, items in groups.items():
+                ok = self._run_with_retries(op, items)
+                now = time.monotonic()
+                for _mac, pending in items:
+                    self._latencies.append(now - pending.queued_at)
+                    for future in pending.futures:
+                        future.set_result(ok)
+                with self._cond:
+                    self.completed += len(items)
+                    if not ok:
+                        self.failures += len(items)
+            with self._cond:
+                for mac, _pending in batch:
+                    self._running.discard(mac)
+                    # A newer op arrived while this MAC was in flight
+                    if mac in self._pending:
+                        self._ready.append(mac)
+                        self._cond.notify()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            latencies = sorted(self._latencies)
+            depth = len(self._pending)
+            running = len(self._running)
+
+        def pct(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 3)
+
+        return {
+            'queueDepth': depth,
+            'inFlight': running,
+            'submitted': self.submitted,
+            'coalesced': self.coalesced,
+            'superseded': self.superseded,
+            'completed': self.completed,
+            'retries': self.retries,
+            'failures': self.failures,
+            'latencyMs': {'p50': pct(0.5), 'p95': pct(0.95), 'max': pct(1.0)},
+        }
+
+
+def create_executor(driver: SouthboundDriver) -> Optional[SouthboundExecutor]:
+    """Build the executor from env; SDN_EXECUTOR=0 keeps the NBI calling the driver directly."""
+    if os.getenv('SDN_EXECUTOR', '1') == '0':
+        return None
+    return SouthboundExecutor(
+        driver,
+        concurrency=int(os.getenv('SDN_EXECUTOR_CONCURRENCY', '4')),
+        batch_size=int(os.getenv('SDN_EXECUTOR_BATCH', '256')),
+        max_retries=int(os.getenv('SDN_EXECUTOR_RETRIES', '3')),
+        base_delay=int(os.getenv('SDN_EXECUTOR_BACKOFF_MS', '50')) / 1000.0,
+    )
@@ -1,13 +1,20 @@
 import os
-from sdn.southbound import SDNSouthboundDriver
 from sdn.interfaces import SouthboundDriver
 
 
 def get_southbound_driver() -> SouthboundDriver:
     driver_name = os.getenv('SDN_DRIVER', 'iptables')
-    # For now only one concrete driver is present; extend here for others
+    # Drivers are imported lazily so sdn.southbound can build its singleton from here
+    if driver_name == 'iptables-restore':
+        from sdn.iptables_restore import IptablesRestoreDriver
+        return IptablesRestoreDriver()
+    if driver_name in ('sim', 'simulator'):
+        from sdn.simulator import FlowTableSimulator
+        return FlowTableSimulator()
+    if driver_name == 'nftables':
+        from sdn.nftables import NftSetDriver
+        return NftSetDriver()
+    from sdn.southbound import SDNSouthboundDriver
     if driver_name == 'iptables' or driver_name == 'mock':
         return SDNSouthboundDriver()
     return SDNSouthboundDriver()
-
-
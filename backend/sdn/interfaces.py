@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple
 
 
 class SouthboundDriver(ABC):
@@ -10,4 +11,27 @@ class SouthboundDriver(ABC):
     def allow_mac_on_vlan(self, mac_colon_lower: str, vlan_id: int) -> bool:
         raise NotImplementedError
 
+    def unblock_mac(self, mac_colon_lower: str) -> bool:
+        """Lift a block installed by block_mac; optional for drivers."""
+        raise NotImplementedError
+
+    def block_macs(self, macs_colon_lower: List[str]) -> bool:
+        """Block several MACs; drivers may override to program them in one go."""
+        results = [self.block_mac(mac) for mac in macs_colon_lower]
+        return all(results)
+
+    def allow_macs_on_vlans(self, entries: List[Tuple[str, int]]) -> bool:
+        """Allow several (mac, vlan) pairs; drivers may override to batch them."""
+        results = [self.allow_mac_on_vlan(mac, vlan_id) for mac, vlan_id in entries]
+        return all(results)
 
+    def update_acls(self, rules: list) -> Dict:
+        """Bring the installed ACL to ``rules``; drivers may override to apply only the delta."""
+        clear = getattr(self, 'clear_acls', lambda: True)
+        apply = getattr(self, 'apply_acls', lambda _rules: True)
+        ok = bool(clear() and apply(rules))
+        return {'ok': ok, 'added': len(rules), 'removed': None, 'moved': 0, 'unchanged': 0, 'operations': None}
+
+    def update_acl_range(self, start: int, rules: list, truncate: bool = False) -> Dict:
+        """Make ACL positions ``start..start+len(rules)`` equal ``rules``; optional for drivers."""
+        raise NotImplementedError
@@ -0,0 +1,120 @@
+import os
+import re
+import shutil
+import subprocess
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from utils.logging import log
+from sdn.southbound import SDNSouthboundDriver
+
+_LINE_RE = re.compile(r"line (\d+)")
+
+
+class IptablesRestoreDriver(SDNSouthboundDriver):
+    """iptables driver that applies rules in bulk through iptables-restore.
+
+    Rules produced by the base driver are applied as
+    ``iptables-restore --noflush`` transactions of up to ``batch_size``
+    rules instead of one process per rule. Each call returns once its rules
+    are committed, so the ledger only records what the kernel accepted. A
+    rule rejected by the kernel aborts the whole transaction; the failing
+    line is recorded in ``failures``, reported as not applied, and the rest
+    of the batch is retried.
+    """
+
+    def __init__(self, batch_size: Optional[int] = None) -> None:
+        super().__init__()
+        self.binary = os.getenv('SDN_IPTABLES_RESTORE', 'iptables-restore')
+        self.mock_mode = (
+            os.name == 'nt' or shutil.which(self.binary) is None or os.getenv('SDN_MOCK') == '1'
+        )
+        self.batch_size = max(1, batch_size or int(os.getenv('SDN_RESTORE_BATCH_SIZE', '1000')))
+        self.failures: deque = deque(maxlen=1000)
+        self.launches = 0
+        self._lock = threading.Lock()
+
+    def _run_commands(self, commands: List[List[str]]) -> List[bool]:
+        applied: List[bool] = []
+        for i in range(0, len(commands), self.batch_size):
+            applied.extend(self._restore(commands[i:i + self.batch_size]))
+        return applied
+
+    @staticmethod
+    def _to_restore_line(cmd: List[str]) -> Tuple[str, str]:
+        """Translate an iptables argv into (table, restore line)."""
+        args = list(cmd[1:])
+        table = 'filter'
+        if '-t' in args:
+            i = args.index('-t')
+            table = args[i + 1]
+            del args[i:i + 2]
+        return table, ' '.join(args)
+
+    def _build_payload(self, commands: List[List[str]]) -> Tuple[str, Dict[int, int]]:
+        """Return the restore text and a map of payload line number -> command index."""
+        by_table: Dict[str, List[int]] = {}
+        lines_for: Dict[int, str] = {}
+        for idx, cmd in enumerate(commands):
+            table, line = self._to_restore_line(cmd)
+            by_table.setdefault(table, []).append(idx)
+            lines_for[idx] = line
+        out: List[str] = []
+        line_map: Dict[int, int] = {}
+        for table, indices in by_table.items():
+            out.append(f"*{table}")
+            for idx in indices:
+                out.append(lines_for[idx])
+                line_map[len(out)] = idx
+            out.append("COMMIT")
+        return '\n'.join(out) + '\n', line_map
+
+    def _restore(self, commands: List[List[str]]) -> List[bool]:
+        """Apply one batch in a single transaction; returns whether each rule went in."""
+        with self._lock:
+            if self.mock_mode:
+                payload, _ = self._build_payload(commands)
+                log(f"southbound-mock: would run {self.binary} --noflush rules={len(commands)}")
+                for line in payload.splitlines():
+                    log(f"southbound-mock: restore {line}")
+                self._mock_record(commands)
+                return [True] * len(commands)
+            applied = [False] * len(commands)
+            # Position in the original batch of each rule still being tried
+            indices = list(range(len(commands)))
+            while commands:
+                payload, line_map = self._build_payload(commands)
+                self.launches += 1
+                proc = subprocess.run(
+                    [self.binary, '--noflush'], input=payload, capture_output=True, text=True
+                )
+                if proc.returncode == 0:
+                    log(f"southbound: {self.binary} applied rules={len(commands)}")
+                    for i in indices:
+                        applied[i] = True
+                    break
+                match = _LINE_RE.search(proc.stderr or '')
+                bad = line_map.get(int(match.group(1))) if match else None
+                if bad is None:
+                    # Could not pin the failure to a rule: report the whole batch
+                    for cmd in commands:
+                        self._record_failure(cmd, proc.stderr)
+                    break
+                self._record_failure(commands[bad], proc.stderr)
+                commands = commands[:bad] + commands[bad + 1:]
+                indices = indices[:bad] + indices[bad + 1:]
+            return applied
+
+    def _record_failure(self, cmd: List[str], stderr: str) -> None:
+        error = (stderr or '').strip()
+        self.failures.append({'cmd': ' '.join(cmd), 'error': error})
+        log(f"southbound: failed cmd={' '.join(cmd)} stderr={error}")
+
+    def stats(self) -> Dict:
+        return {
+            **super().stats(),
+            'launches': self.launches,
+            'failures': list(self.failures)[-50:],
+            'batchSize': self.batch_size,
+        }
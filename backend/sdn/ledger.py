@@ -0,0 +1,89 @@
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from models.database import db_connection
+from utils.logging import log
+
+# (kind, chain, spec): kind is 'rule' for real data-plane rules and 'acl' for
+# applied ACL entries (chain is the zero-padded order key). Only what a driver
+# actually installs is recorded, so the ledger is bounded by the data plane.
+Entry = Tuple[str, str, str]
+
+
+class RuleLedger:
+    """Persistent record of what a southbound driver has installed.
+
+    Backed by the ``southbound_rules`` table and mirrored in memory so
+    membership checks never hit the DB. If the table is missing (init_db
+    not run yet) the ledger keeps working in memory only.
+    """
+
+    def __init__(self, driver_name: str) -> None:
+        self.driver_name = driver_name
+        self._entries: Optional[Set[Entry]] = None
+        self._persistent = True
+        self._lock = threading.RLock()
+
+    def _load(self) -> Set[Entry]:
+        if self._entries is not None:
+            return self._entries
+        entries: Set[Entry] = set()
+        with db_connection() as conn:
+            try:
+                cur = conn.cursor()
+                cur.execute(
+                    "SELECT kind, chain, spec FROM southbound_rules WHERE driver = ?",
+                    (self.driver_name,),
+                )
+                entries = {(r["kind"], r["chain"], r["spec"]) for r in cur.fetchall()}
+            except sqlite3.OperationalError as e:
+                log(f"ledger: persistent store unavailable ({e}); tracking in memory only")
+                self._persistent = False
+        self._entries = entries
+        return entries
+
+    @property
+    def loaded(self) -> bool:
+        return self._entries is not None
+
+    def contains(self, entry: Entry) -> bool:
+        with self._lock:
+            return entry in self._load()
+
+    def entries(self, kind: Optional[str] = None) -> List[Entry]:
+        with self._lock:
+            return sorted(e for e in self._load() if kind is None or e[0] == kind)
+
+    def update(self, add: Iterable[Entry] = (), remove: Iterable[Entry] = ()) -> None:
+        """Record added and removed entries in one transaction."""
+        add = list(add)
+        remove = list(remove)
+        if not add and not remove:
+            return
+        with self._lock:
+            entries = self._load()
+            if self._persistent:
+                with db_connection() as conn:
+                    cur = conn.cursor()
+                    if remove:
+                        cur.executemany(
+                            "DELETE FROM southbound_rules WHERE driver = ? AND kind = ? AND chain = ? AND spec = ?",
+                            [(self.driver_name,) + e for e in remove],
+                        )
+                    if add:
+                        cur.executemany(
+                            "INSERT OR IGNORE INTO southbound_rules (driver, kind, chain, spec, created_at) "
+                            "VALUES (?, ?, ?, ?, datetime('now'))",
+                            [(self.driver_name,) + e for e in add],
+                        )
+                    conn.commit()
+            entries.difference_update(remove)
+            entries.update(add)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for kind, _chain, _spec in self._load():
+                counts[kind] = counts.get(kind, 0) + 1
+            return {'persistent': self._persistent, 'entries': counts}
@@ -0,0 +1,246 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from utils.logging import log
+from sdn.ledger import RuleLedger
+from sdn.southbound import SDNSouthboundDriver
+
+
+class NftSetDriver(SDNSouthboundDriver):
+    """Southbound driver keeping MAC state in nftables sets and maps.
+
+    Quarantined MACs live in a hashed ``ether_addr`` set matched by a single
+    drop rule per hook, and admitted MACs are steered through a verdict map
+    that jumps to a per-VLAN chain. Per-packet cost therefore stays constant
+    however many devices are blocked, and repeated blocks never grow a chain.
+    Every change is sent as one atomic ``nft -f -`` transaction.
+    """
+
+    def __init__(self, table: Optional[str] = None) -> None:
+        super().__init__()
+        self.ledger = RuleLedger('nftables')
+        self.binary = os.getenv('SDN_NFT', 'nft')
+        self.table = table or os.getenv('SDN_NFT_TABLE', 'nac')
+        self.mock_mode = (
+            os.name == 'nt' or shutil.which(self.binary) is None or os.getenv('SDN_MOCK') == '1'
+        )
+        # Mirror of what we have programmed, so deletes only target existing elements
+        self._blocked: Set[str] = set()
+        self._vlan_of: Dict[str, int] = {}
+        self._vlan_chains: Set[int] = set()
+        self._ready = False
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    # --- nft plumbing ---
+    def _base_ruleset(self) -> List[str]:
+        t = f"inet {self.table}"
+        return [
+            f"add table {t}",
+            f"add set {t} blocked {{ type ether_addr; }}",
+            f"add map {t} vlan_verdicts {{ type ether_addr : verdict; }}",
+            f"add chain {t} input {{ type filter hook input priority 0; policy accept; }}",
+            f"add chain {t} forward {{ type filter hook forward priority 0; policy accept; }}",
+            f"flush chain {t} input",
+            f"flush chain {t} forward",
+            f"add rule {t} input ether saddr @blocked drop",
+            f"add rule {t} forward ether saddr @blocked drop",
+            f"add rule {t} forward ether saddr vmap @vlan_verdicts",
+        ]
+
+    def _list(self, kind: str, name: str) -> List:
+        proc = subprocess.run(
+            [self.binary, '-j', 'list', kind, 'inet', self.table, name],
+            capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            return []
+        for obj in json.loads(proc.stdout).get('nftables', []):
+            if kind in obj:
+                return obj[kind].get('elem', [])
+        return []
+
+    def _read_live(self) -> Tuple[Set[str], Dict[str, int]]:
+        """Blocked set members and MAC -> VLAN map elements currently in the kernel."""
+        blocked = {e for e in self._list('set', 'blocked') if isinstance(e, str)}
+        vlan_of: Dict[str, int] = {}
+        for elem in self._list('map', 'vlan_verdicts'):
+            mac, verdict = elem
+            target = verdict.get('jump', {}).get('target', '')
+            if target.startswith('vlan_'):
+                vlan_of[mac] = int(target[5:])
+        return blocked, vlan_of
+
+    def _load_state(self) -> None:
+        """Pick up elements left by a previous process so deletes stay valid."""
+        if self.mock_mode:
+            return
+        try:
+            self._blocked, self._vlan_of = self._read_live()
+            self._vlan_chains.update(self._vlan_of.values())
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            log(f"southbound: nft state load failed error={e}")
+
+    def _apply(self, statements: List[str]) -> bool:
+        if not statements:
+            return True
+        if not self._ready:
+            statements = self._base_ruleset() + statements
+        script = '\n'.join(statements) + '\n'
+        if self.mock_mode:
+            for stmt in statements:
+                log(f"southbound-mock: would run nft {stmt}")
+            self._ready = True
+            return True
+        try:
+            subprocess.run([self.binary, '-f', '-'], input=script, capture_output=True, text=True, check=True)
+        except subprocess.CalledProcessError as error:
+            log(f"southbound: nft transaction failed statements={len(statements)} stderr={error.stderr}")
+            return False
+        self._ready = True
+        log(f"southbound: nft applied statements={len(statements)}")
+        return True
+
+    def _elements(self, macs: Iterable[str]) -> str:
+        return ', '.join(macs)
+
+    def _ensure_loaded(self) -> None:
+        if not self._ready and not self._loaded:
+            self._loaded = True
+            self._load_state()
+
+    # --- SouthboundDriver API ---
+    def block_mac(self, mac_colon_lower: str) -> bool:
+        return self.block_macs([mac_colon_lower])
+
+    def block_macs(self, macs_colon_lower: List[str]) -> bool:
+        t = f"inet {self.table}"
+        with self._lock:
+            self._ensure_loaded()
+            new = [m for m in dict.fromkeys(macs_colon_lower) if m not in self._blocked]
+            steered = [m for m in new if m in self._vlan_of]
+            statements = []
+            if steered:
+                statements.append(f"delete element {t} vlan_verdicts {{ {self._elements(steered)} }}")
+            if new:
+                statements.append(f"add element {t} blocked {{ {self._elements(new)} }}")
+            if not self._apply(statements):
+                return False
+            self._blocked.update(new)
+            for m in steered:
+                self._vlan_of.pop(m, None)
+            return True
+
+    def unblock_macs(self, macs_colon_lower: List[str]) -> bool:
+        t = f"inet {self.table}"
+        with self._lock:
+            self._ensure_loaded()
+            present = [m for m in dict.fromkeys(macs_colon_lower) if m in self._blocked]
+            if not present:
+                return True
+            if not self._apply([f"delete element {t} blocked {{ {self._elements(present)} }}"]):
+                return False
+            self._blocked.difference_update(present)
+            return True
+
+    def unblock_mac(self, mac_colon_lower: str) -> bool:
+        return self.unblock_macs([mac_colon_lower])
+
+    def allow_mac_on_vlan(self, mac_colon_lower: str, vlan_id: int) -> bool:
+        return self.allow_macs_on_vlans([(mac_colon_lower, vlan_id)])
+
+    def allow_macs_on_vlans(self, entries: List[Tuple[str, int]]) -> bool:
+        t = f"inet {self.table}"
+        with self._lock:
+            self._ensure_loaded()
+            wanted = {m: int(v) for m, v in entries}
+            changed = {m: v for m, v in wanted.items() if self._vlan_of.get(m) != v or m in self._blocked}
+            if not changed:
+                return True
+            statements = []
+            for vlan_id in sorted(set(changed.values()) - self._vlan_chains):
+                # Per-VLAN chain; the mark lets downstream tagging/routing pick the VLAN
+                statements.append(f"add chain {t} vlan_{vlan_id}")
+                statements.append(f"flush chain {t} vlan_{vlan_id}")
+                statements.append(f"add rule {t} vlan_{vlan_id} meta mark set {vlan_id} accept")
+            unblock = [m for m in changed if m in self._blocked]
+            if unblock:
+                statements.append(f"delete element {t} blocked {{ {self._elements(unblock)} }}")
+            restamp = [m for m in changed if m in self._vlan_of]
+            if restamp:
+                statements.append(f"delete element {t} vlan_verdicts {{ {self._elements(restamp)} }}")
+            pairs = ', '.join(f"{m} : jump vlan_{v}" for m, v in changed.items())
+            statements.append(f"add element {t} vlan_verdicts {{ {pairs} }}")
+            if not self._apply(statements):
+                return False
+            self._vlan_chains.update(changed.values())
+            self._blocked.difference_update(unblock)
+            self._vlan_of.update(changed)
+            return True
+
+    def reconcile(self) -> Dict:
+        """Make the live blocked set and VLAN map match what this driver programmed.
+
+        Overrides the iptables reconcile: MAC state lives in set and map
+        elements here, not in per-MAC rules, so those are what get diffed.
+        """
+        t = f"inet {self.table}"
+        with self._lock:
+            self._ensure_loaded()
+            if self.mock_mode:
+                return {"ok": True, "added": 0, "deleted": 0}
+            try:
+                live_blocked, live_vlan_of = self._read_live()
+            except (OSError, ValueError, TypeError, AttributeError) as e:
+                log(f"southbound: nft state read failed error={e}")
+                return {"ok": False, "added": 0, "deleted": 0}
+            stray = sorted(live_blocked - self._blocked)
+            missing = sorted(self._blocked - live_blocked)
+            unmapped = sorted(m for m, v in live_vlan_of.items() if self._vlan_of.get(m) != v)
+            remap = {m: v for m, v in sorted(self._vlan_of.items()) if live_vlan_of.get(m) != v}
+            statements = []
+            for vlan_id in sorted(set(remap.values())):
+                statements.append(f"add chain {t} vlan_{vlan_id}")
+                statements.append(f"flush chain {t} vlan_{vlan_id}")
+                statements.append(f"add rule {t} vlan_{vlan_id} meta mark set {vlan_id} accept")
+            if stray:
+                statements.append(f"delete element {t} blocked {{ {self._elements(stray)} }}")
+            if missing:
+                statements.append(f"add element {t} blocked {{ {self._elements(missing)} }}")
+            if unmapped:
+                statements.append(f"delete element {t} vlan_verdicts {{ {self._elements(unmapped)} }}")
+            if remap:
+                pairs = ', '.join(f"{m} : jump vlan_{v}" for m, v in remap.items())
+                statements.append(f"add element {t} vlan_verdicts {{ {pairs} }}")
+            ok = self._apply(statements)
+            added, deleted = len(missing) + len(remap), len(stray) + len(unmapped)
+            log(f"southbound: nft reconcile added={added} deleted={deleted} ok={ok}")
+            return {"ok": ok, "added": added, "deleted": deleted}
+
+    def sync_blocked(self, macs_colon_lower: Iterable[str]) -> bool:
+        """Replace the blocked set with exactly ``macs_colon_lower`` in one transaction."""
+        t = f"inet {self.table}"
+        with self._lock:
+            self._ensure_loaded()
+            wanted = set(macs_colon_lower)
+            statements = [f"flush set {t} blocked"]
+            if wanted:
+                statements.append(f"add element {t} blocked {{ {self._elements(sorted(wanted))} }}")
+            if not self._apply(statements):
+                return False
+            self._blocked = wanted
+            return True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._ensure_loaded()
+            return {
+                'table': self.table,
+                'blocked': len(self._blocked),
+                'steered': len(self._vlan_of),
+                'vlanChains': sorted(self._vlan_chains),
+            }
@@ -0,0 +1,217 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from utils.logging import log
+
+
+class AdmissionJob:
+    """Tracks one MAC through the decide -> persist -> program stages."""
+
+    def __init__(self, mac: str) -> None:
+        self.id = uuid.uuid4().hex
+        self.mac = mac
+        self.status = 'queued'
+        self.result: Optional[Dict] = None
+        self.programmed: Optional[bool] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.plan: Optional[Dict] = None
+        self.decided = threading.Event()
+        self.finished = threading.Event()
+        self._subscribers: List[Callable[['AdmissionJob'], None]] = []
+        self._lock = threading.Lock()
+
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.id,
+            'mac': self.mac,
+            'status': self.status,
+            'result': self.result,
+            'programmed': self.programmed,
+            'error': self.error,
+            'createdAt': self.created_at,
+            'updatedAt': self.updated_at,
+        }
+
+    def _set_status(self, status: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            self.status = status
+            self.updated_at = time.time()
+            if error:
+                self.error = error
+            done = status in ('done', 'failed')
+            subscribers = list(self._subscribers) if done else []
+        if done:
+            self.decided.set()
+            self.finished.set()
+            for callback in subscribers:
+                try:
+                    callback(self)
+                except Exception as e:
+                    log(f"pipeline: subscriber failed job={self.id} error={e}")
+
+    def subscribe(self, callback: Callable[['AdmissionJob'], None]) -> None:
+        """Invoke callback once the job reaches a terminal state."""
+        with self._lock:
+            if self.status not in ('done', 'failed'):
+                self._subscribers.append(callback)
+                return
+        callback(self)
+
+
+class _Stage:
+    """A bounded queue drained by a fixed pool of daemon worker threads."""
+
+    def __init__(self, name: str, handler: Callable[[List[AdmissionJob]], None],
+                 workers: int, queue_size: int, batch_size: int = 1) -> None:
+        self.name = name
+        self._handler = handler
+        self._workers = max(1, workers)
+        self._batch_size = max(1, batch_size)
+        self._queue: 'queue.Queue[AdmissionJob]' = queue.Queue(maxsize=queue_size)
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        for i in range(self._workers):
+            t = threading.Thread(target=self._run, name=f"pipeline-{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def put(self, job: AdmissionJob, timeout: Optional[float] = None) -> None:
+        self._queue.put(job, timeout=timeout)
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._handler(batch)
+            except Exception as e:
+                log(f"pipeline: stage={self.name} failed error={e}")
+                for job in batch:
+                    job._set_status('failed', f"{self.name}: {e}")
+
+
+class AdmissionPipeline:
+    """Asynchronous admission: decide, persist and program run on separate pools.
+
+    Callers block only until the decide stage has produced a result; writing
+    device state and programming the data plane (which may shell out to
+    iptables) happen afterwards and are tracked by job id.
+    """
+
+    def __init__(self, control, decide_workers: int = 2, persist_workers: int = 1,
+                 program_workers: int = 4, queue_size: int = 1000,
+                 persist_batch: int = 200, max_jobs: int = 10000) -> None:
+        self._control = control
+        self._decide = _Stage('decide', self._run_decide, decide_workers, queue_size)
+        self._persist = _Stage('persist', self._run_persist, persist_workers, queue_size, persist_batch)
+        self._program = _Stage('program', self._run_program, program_workers, queue_size)
+        self._jobs: 'OrderedDict[str, AdmissionJob]' = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        self._max_jobs = max_jobs
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self) -> None:
+        if self._started:
+            return
+        with self._start_lock:
+            if not self._started:
+                for stage in (self._decide, self._persist, self._program):
+                    stage.start()
+                self._started = True
+
+    # --- stage handlers ---
+    def _run_decide(self, jobs: List[AdmissionJob]) -> None:
+        for job in jobs:
+            try:
+                job.plan = self._control.plan(job.mac)
+            except ValueError as e:
+                job._set_status('failed', str(e))
+                continue
+            job.result = job.plan['result']
+            job.status = 'persisting'
+            job.decided.set()
+            self._persist.put(job)
+
+    def _run_persist(self, jobs: List[AdmissionJob]) -> None:
+        # Drained in batches so a burst of admissions shares one commit
+        self._control.persist([job.plan for job in jobs])
+        for job in jobs:
+            job.status = 'programming'
+            job.updated_at = time.time()
+            self._program.put(job)
+
+    def _run_program(self, jobs: List[AdmissionJob]) -> None:
+        for job in jobs:
+            job.programmed = bool(self._control.program(job.plan))
+            job._set_status('done' if job.programmed else 'failed',
+                            None if job.programmed else 'southbound programming failed')
+
+    # --- public API ---
+    def submit(self, mac: str, decide_timeout: float = 5.0) -> AdmissionJob:
+        """Queue a MAC for admission and wait for its decision.
+
+        Raises queue.Full when the decide stage is saturated.
+        """
+        self._ensure_started()
+        job = AdmissionJob(mac)
+        with self._jobs_lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self._max_jobs:
+                self._jobs.popitem(last=False)
+        self._decide.put(job, timeout=decide_timeout)
+        job.decided.wait(decide_timeout)
+        return job
+
+    def get_job(self, job_id: str) -> Optional[AdmissionJob]:
+        with self._jobs_lock:
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id: str, timeout: float) -> Optional[AdmissionJob]:
+        """Long-poll helper: block until the job finishes or timeout expires."""
+        job = self.get_job(job_id)
+        if job is not None and timeout > 0:
+            job.finished.wait(timeout)
+        return job
+
+    def stats(self) -> Dict:
+        return {
+            'queues': {
+                'decide': self._decide.depth(),
+                'persist': self._persist.depth(),
+                'program': self._program.depth(),
+            },
+            'jobs': len(self._jobs),
+        }
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def create_pipeline(control) -> AdmissionPipeline:
+    return AdmissionPipeline(
+        control,
+        decide_workers=_env_int('SDN_PIPELINE_DECIDE_WORKERS', 2),
+        persist_workers=_env_int('SDN_PIPELINE_PERSIST_WORKERS', 1),
+        program_workers=_env_int('SDN_PIPELINE_PROGRAM_WORKERS', 4),
+        queue_size=_env_int('SDN_PIPELINE_QUEUE_SIZE', 1000),
+    )
@@ -0,0 +1,180 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from models.database import db_connection
+from models.device_writer import flush_device_writes
+from models.policy import affected_device_macs
+from utils.logging import log
+
+
+class ReenforcementTask:
+    """Re-enforcement of the devices touched by one policy change."""
+
+    def __init__(self, policy: str, action: str, scope: str, macs: Optional[List[str]], total: int) -> None:
+        self.id = uuid.uuid4().hex
+        self.policy = policy
+        self.action = action
+        self.scope = scope
+        self.macs = macs
+        self.total = total
+        self.processed = 0
+        self.authorized = 0
+        self.blocked = 0
+        self.errors = 0
+        self.status = 'queued' if total else 'done'
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.id,
+            'policy': self.policy,
+            'action': self.action,
+            'scope': self.scope,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed,
+            'authorized': self.authorized,
+            'blocked': self.blocked,
+            'errors': self.errors,
+            'progress': round(self.processed / self.total, 4) if self.total else 1.0,
+            'error': self.error,
+            'createdAt': self.created_at,
+            'updatedAt': self.updated_at,
+        }
+
+
+class Reenforcer:
+    """Background, rate-limited re-enforcement after policy changes.
+
+    A policy mutation resolves the devices it can affect through the
+    username/OUI/MAC indexes (see ``affected_device_macs``) and queues
+    them here. One worker feeds them to
+    ``SDNControlPlane.validate_and_program_many`` in batches of
+    ``batch_size``, at most ``rate`` devices per second, so a fleet-wide
+    change cannot flood the data plane. Unchanged devices are skipped by
+    the control plane's own diffing.
+    """
+
+    def __init__(self, control, batch_size: int = 200, rate: float = 1000.0, max_tasks: int = 1000) -> None:
+        self._control = control
+        self.batch_size = max(1, batch_size)
+        self.rate = rate
+        self._queue: 'queue.Queue[ReenforcementTask]' = queue.Queue()
+        self._tasks: 'OrderedDict[str, ReenforcementTask]' = OrderedDict()
+        self._tasks_lock = threading.Lock()
+        self._max_tasks = max_tasks
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='policy-reenforce', daemon=True)
+                self._thread.start()
+
+    def submit(self, policy: str, action: str, criteria_list: List[Dict]) -> ReenforcementTask:
+        """Queue re-enforcement for a policy change; criteria of the old and new version."""
+        # Devices admitted moments ago may still be queued for insert
+        flush_device_writes()
+        with db_connection() as conn:
+            cur = conn.cursor()
+            scope, macs = affected_device_macs(cur, criteria_list)
+            if macs is None:
+                cur.execute("SELECT COUNT(1) FROM devices")
+                total = cur.fetchone()[0] or 0
+            else:
+                total = len(macs)
+        task = ReenforcementTask(policy, action, scope, macs, total)
+        with self._tasks_lock:
+            self._tasks[task.id] = task
+            while len(self._tasks) > self._max_tasks:
+                self._tasks.popitem(last=False)
+        log(f"reenforce: queued policy={policy} action={action} scope={scope} devices={total} task={task.id}")
+        if total:
+            self._ensure_started()
+            self._queue.put(task)
+        return task
+
+    def _fleet_batches(self) -> Iterable[List[str]]:
+        # Keyset pagination over the primary key keeps each read cheap
+        last = -1
+        while True:
+            with db_connection() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "SELECT mac_key, mac FROM devices WHERE mac_key > ? ORDER BY mac_key LIMIT ?",
+                    (last, self.batch_size),
+                )
+                rows = cur.fetchall()
+            if not rows:
+                return
+            last = rows[-1]['mac_key']
+            yield [r['mac'] for r in rows]
+
+    def _batches(self, task: ReenforcementTask) -> Iterable[List[str]]:
+        if task.macs is None:
+            return self._fleet_batches()
+        return (task.macs[i:i + self.batch_size] for i in range(0, len(task.macs), self.batch_size))
+
+    def _process(self, task: ReenforcementTask) -> None:
+        task.status = 'running'
+        started = time.monotonic()
+        for batch in self._batches(task):
+            for result in self._control.validate_and_program_many(batch):
+                if 'error' in result:
+                    task.errors += 1
+                elif result.get('authorized'):
+                    task.authorized += 1
+                else:
+                    task.blocked += 1
+            task.processed += len(batch)
+            task.updated_at = time.time()
+            if self.rate > 0:
+                # Pace to the configured devices/second
+                ahead = task.processed / self.rate - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        # The fleet may have grown or shrunk since the task was counted
+        task.total = max(task.total, task.processed)
+        # Finished tasks stay listed; drop their device list
+        task.macs = None
+
+    def _run(self) -> None:
+        while True:
+            task = self._queue.get()
+            try:
+                self._process(task)
+                task.status = 'done'
+            except Exception as e:
+                task.status = 'failed'
+                task.error = str(e)
+                log(f"reenforce: failed task={task.id} error={e}")
+            task.updated_at = time.time()
+            log(f"reenforce: {task.status} task={task.id} processed={task.processed}/{task.total}")
+
+    def get_task(self, task_id: str) -> Optional[ReenforcementTask]:
+        with self._tasks_lock:
+            return self._tasks.get(task_id)
+
+    def list_tasks(self, limit: int = 50) -> List[Dict]:
+        with self._tasks_lock:
+            tasks = list(self._tasks.values())[-limit:]
+        return [t.to_dict() for t in reversed(tasks)]
+
+    def stats(self) -> Dict:
+        return {'queued': self._queue.qsize(), 'tasks': len(self._tasks), 'batchSize': self.batch_size, 'rate': self.rate}
+
+
+def create_reenforcer(control) -> Reenforcer:
+    return Reenforcer(
+        control,
+        batch_size=int(os.getenv('SDN_REENFORCE_BATCH', '200')),
+        rate=float(os.getenv('SDN_REENFORCE_RATE', '1000')),
+    )
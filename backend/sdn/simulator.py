@@ -0,0 +1,217 @@
+import os
+import random
+import sys
+import threading
+import time
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
+
+from utils.acl import acl_edit_script
+from utils.acl_classifier import AclClassifier
+from utils.logging import log
+from utils.mac import MacAddress
+from sdn.interfaces import SouthboundDriver
+
+# Flow priorities, matching what /api/flows reports for the same decisions
+PRIORITY_ALLOW = 100
+PRIORITY_DROP = 90
+PRIORITY_ACL_BASE = 1000
+
+_ANY_VLAN = 0x1000          # wildcard VLAN in a flow key (real VLAN ids are 0..4095)
+_ACTION_DROP = 0x2000       # action code for drop; otherwise the action is the VLAN to assign
+
+
+def _mac_to_int(mac_colon_lower: str) -> int:
+    return int(mac_colon_lower.replace(':', ''), 16)
+
+
+def _key(mac_int: int, vlan: Optional[int]) -> int:
+    return (mac_int << 13) | (_ANY_VLAN if vlan is None else vlan)
+
+
+class FlowTableSimulator(SouthboundDriver):
+    """In-memory, OpenFlow-like data plane for load testing.
+
+    MAC flows are packed into plain ints (``key -> priority << 14 | action``)
+    so a million flows fit comfortably in memory, and ``lookup`` resolves a
+    packet with a couple of hash probes. ACL entries sit above MAC flows and
+    are evaluated first-match with the same classifier as
+    ``/sdn/acl/evaluate``, so CIDR sources and destinations match the
+    addresses they contain. ``latency_ms`` and ``failure_rate`` inject
+    per-call delay and random failures to exercise retries and backpressure.
+    """
+
+    def __init__(self, latency_ms: Optional[float] = None, failure_rate: Optional[float] = None) -> None:
+        self.mock_mode = True
+        self.latency_ms = float(os.getenv('SDN_SIM_LATENCY_MS', '0')) if latency_ms is None else latency_ms
+        self.failure_rate = float(os.getenv('SDN_SIM_FAILURE_RATE', '0')) if failure_rate is None else failure_rate
+        self._flows: Dict[int, int] = {}
+        self._acls: List[Dict] = []
+        # Compiled from _acls on first lookup after any ACL change
+        self._classifier: Optional[AclClassifier] = None
+        self._lock = threading.Lock()
+        # Drop flows in _flows, kept by the mutators so stats never scans the table
+        self._drops = 0
+        self.calls = 0
+        self.injected_failures = 0
+
+    def _simulate_call(self) -> bool:
+        """Apply injected latency; returns False when a failure is injected."""
+        with self._lock:
+            self.calls += 1
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000.0)
+        if self.failure_rate > 0 and random.random() < self.failure_rate:
+            with self._lock:
+                self.injected_failures += 1
+            return False
+        return True
+
+    # --- SouthboundDriver API ---
+    def block_mac(self, mac_colon_lower: str) -> bool:
+        return self.block_macs([mac_colon_lower])
+
+    def block_macs(self, macs_colon_lower: List[str]) -> bool:
+        if not self._simulate_call():
+            return False
+        drop = (PRIORITY_DROP << 14) | _ACTION_DROP
+        with self._lock:
+            for mac in macs_colon_lower:
+                key = _key(_mac_to_int(mac), None)
+                if self._flows.get(key, 0) & 0x3FFF != _ACTION_DROP:
+                    self._drops += 1
+                self._flows[key] = drop
+        return True
+
+    def unblock_mac(self, mac_colon_lower: str) -> bool:
+        if not self._simulate_call():
+            return False
+        key = _key(_mac_to_int(mac_colon_lower), None)
+        with self._lock:
+            if self._flows.get(key, 0) & 0x3FFF == _ACTION_DROP:
+                del self._flows[key]
+                self._drops -= 1
+        return True
+
+    def allow_mac_on_vlan(self, mac_colon_lower: str, vlan_id: int) -> bool:
+        return self.allow_macs_on_vlans([(mac_colon_lower, vlan_id)])
+
+    def allow_macs_on_vlans(self, entries: List[Tuple[str, int]]) -> bool:
+        if not self._simulate_call():
+            return False
+        with self._lock:
+            for mac, vlan_id in entries:
+                key = _key(_mac_to_int(mac), None)
+                if self._flows.get(key, 0) & 0x3FFF == _ACTION_DROP:
+                    self._drops -= 1
+                # Untagged traffic from the MAC is admitted and assigned to vlan_id
+                self._flows[key] = (PRIORITY_ALLOW << 14) | int(vlan_id)
+        return True
+
+    def clear_acls(self) -> bool:
+        if not self._simulate_call():
+            return False
+        with self._lock:
+            self._acls = []
+            self._classifier = None
+        return True
+
+    def apply_acls(self, rules: list) -> bool:
+        if not self._simulate_call():
+            return False
+        with self._lock:
+            self._acls.extend(rules)
+            self._classifier = None
+        return True
+
+    def update_acls(self, rules: list) -> Dict:
+        return self.update_acl_range(0, rules, truncate=True)
+
+    def update_acl_range(self, start: int, rules: list, truncate: bool = False) -> Dict:
+        """Apply the edit script for one range of the ACL table, swapped in under the lock."""
+        if not self._simulate_call():
+            return {'ok': False, 'added': 0, 'removed': 0, 'moved': 0, 'unchanged': 0, 'operations': 0}
+        with self._lock:
+            end = len(self._acls) if truncate else min(len(self._acls), start + len(rules))
+            window = self._acls[start:end]
+            script = acl_edit_script([a['raw'] for a in window], [r['raw'] for r in rules])
+            by_raw = {r['raw']: r for r in rules}
+            for op in script['ops']:
+                if op['op'] == 'delete':
+                    del window[op['position']]
+                elif op['op'] == 'replace':
+                    window[op['position']] = by_raw[op['rule']]
+                else:
+                    window.insert(op['position'], by_raw[op['rule']])
+            self._acls[start:end] = window
+            self._classifier = None
+        return {'ok': True, 'added': script['added'], 'removed': script['removed'], 'moved': script['moved'],
+                'unchanged': script['unchanged'], 'operations': len(script['ops'])}
+
+    # --- data-plane queries ---
+    def lookup(self, src_mac: str, vlan: Optional[int] = None, protocol: Optional[str] = None,
+               src: Optional[str] = None, dst: Optional[str] = None, port: Optional[int] = None) -> Dict:
+        """Resolve what the simulated switch does with one packet."""
+        if protocol is not None and self._acls:
+            with self._lock:
+                if self._classifier is None:
+                    self._classifier = AclClassifier(list(self._acls))
+                classifier = self._classifier
+            i = classifier.classify(protocol, src, dst, port)
+            if i >= 0:
+                acl = classifier.rules[i]
+                # Earlier entries sit at higher priority, as installed flows would
+                priority = PRIORITY_ACL_BASE + len(classifier.rules) - i
+                return {'action': acl['action'], 'priority': priority, 'match': 'acl', 'rule': acl['raw']}
+        mac_int = int(MacAddress(src_mac))
+        best = None
+        for key in ((_key(mac_int, vlan) if vlan is not None else None), _key(mac_int, None)):
+            if key is None:
+                continue
+            value = self._flows.get(key)
+            if value is not None and (best is None or value >> 14 > best >> 14):
+                best = value
+        if best is None:
+            return {'action': 'miss', 'priority': 0, 'match': 'table-miss'}
+        action = best & 0x3FFF
+        if action == _ACTION_DROP:
+            return {'action': 'drop', 'priority': best >> 14, 'match': 'dl_src'}
+        return {'action': 'allow', 'vlan': action, 'priority': best >> 14, 'match': 'dl_src'}
+
+    def flow_count(self) -> int:
+        return len(self._flows) + len(self._acls)
+
+    def memory_bytes(self) -> int:
+        """Approximate memory held by the flow table (dict plus sampled entries)."""
+        with self._lock:
+            n = len(self._flows)
+            total = sys.getsizeof(self._flows) + sys.getsizeof(self._acls)
+            sample = list(islice(self._flows.items(), 100))
+        if sample:
+            per_entry = sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in sample) / len(sample)
+            total += int(per_entry * n)
+        return total
+
+    def stats(self) -> Dict:
+        with self._lock:
+            flows, acls, drops = len(self._flows), len(self._acls), self._drops
+            calls, injected = self.calls, self.injected_failures
+        return {
+            'flows': flows + acls,
+            'dropFlows': drops,
+            'allowFlows': flows - drops,
+            'aclEntries': acls,
+            'memoryBytes': self.memory_bytes(),
+            'calls': calls,
+            'injectedFailures': injected,
+            'latencyMs': self.latency_ms,
+            'failureRate': self.failure_rate,
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._flows.clear()
+            self._drops = 0
+            self._acls = []
+            self._classifier = None
+        log("southbound-sim: flow table reset")
@@ -1,10 +1,19 @@
 import os
 import shutil
 import subprocess
-from typing import List
+import threading
+from collections import Counter
+from concurrent.futures import Future, TimeoutError as FuturesTimeout
+from typing import Dict, List, Optional, Tuple
 
 from utils.logging import log
 from sdn.interfaces import SouthboundDriver
+from sdn.executor import SouthboundExecutor, create_executor
+from sdn.ledger import Entry, RuleLedger
+from utils.acl import acl_edit_script
+
+# Spacing between ledger order keys of consecutive ACL rules
+_ACL_KEY_GAP = 1 << 20
 
 
 class SDNSouthboundDriver(SouthboundDriver):
@@ -15,68 +24,274 @@ class SDNSouthboundDriver(SouthboundDriver):
     (OpenFlow, NETCONF, gNMI, vendor SDKs) as needed.
     """
 
+    # Chains whose MAC drop rules this driver owns and reconciles
+    MANAGED_CHAINS = ("INPUT", "FORWARD")
+
     def __init__(self) -> None:
         # Enable mock mode automatically on Windows or when iptables not found
         self.mock_mode = (
             os.name == 'nt' or shutil.which('iptables') is None or os.getenv('SDN_MOCK') == '1'
         )
+        self.ledger = RuleLedger('iptables')
+        # Stand-in for the kernel rule table in mock mode, so reconcile has something to read
+        self._mock_live: Counter = Counter()
+        self._state_lock = threading.RLock()
+        self._acl_order: Optional[List[Tuple[int, str]]] = None
+
+    def _mock_record(self, commands: List[List[str]]) -> None:
+        for cmd in commands:
+            if len(cmd) > 3 and cmd[1] in ("-A", "-D"):
+                entry = ("rule", cmd[2], " ".join(cmd[3:]))
+                if cmd[1] == "-A":
+                    self._mock_live[entry] += 1
+                elif self._mock_live[entry] > 0:
+                    self._mock_live[entry] -= 1
 
-    def _run_commands(self, commands: List[List[str]]) -> bool:
+    def _run_commands(self, commands: List[List[str]]) -> List[bool]:
+        """Run iptables commands; returns whether each one was applied."""
         if self.mock_mode:
             for cmd in commands:
                 log(f"southbound-mock: would run cmd={' '.join(cmd)}")
-            return True
-        rule_applied = False
+            self._mock_record(commands)
+            return [True] * len(commands)
+        applied = []
         for cmd in commands:
             try:
                 subprocess.run(cmd, capture_output=True, text=True, check=True)
                 log(f"southbound: applied cmd={' '.join(cmd)}")
-                rule_applied = True
-            except subprocess.CalledProcessError as error:
-                log(f"southbound: failed cmd={' '.join(cmd)} stderr={error.stderr}")
-        return rule_applied
+                applied.append(True)
+            except (OSError, subprocess.CalledProcessError) as error:
+                log(f"southbound: failed cmd={' '.join(cmd)} error={getattr(error, 'stderr', None) or error}")
+                applied.append(False)
+        return applied
 
+    # --- rule ledger helpers ---
+    @staticmethod
+    def _block_rules(mac_colon_lower: str) -> List[Entry]:
+        spec = f"-m mac --mac-source {mac_colon_lower} -j DROP"
+        return [("rule", chain, spec) for chain in SDNSouthboundDriver.MANAGED_CHAINS]
+
+    @staticmethod
+    def _rule_command(action: str, entry: Entry) -> List[str]:
+        _kind, chain, spec = entry
+        return ["iptables", action, chain] + spec.split()
+
+    def _ensure_reconciled(self) -> None:
+        # First use after (re)start: converge live rules to the ledger instead of appending
+        if not self.ledger.loaded:
+            self.ledger.entries()
+            self.reconcile()
+
+    def _read_live_rules(self) -> Optional[Counter]:
+        """Count managed MAC drop rules currently installed, keyed like ledger entries."""
+        if self.mock_mode:
+            return Counter({e: n for e, n in self._mock_live.items() if n > 0})
+        try:
+            proc = subprocess.run(["iptables-save", "-t", "filter"], capture_output=True, text=True, check=True)
+        except (OSError, subprocess.CalledProcessError) as error:
+            log(f"southbound: iptables-save failed error={error}")
+            return None
+        live: Counter = Counter()
+        for line in proc.stdout.splitlines():
+            parts = line.split()
+            if len(parts) < 3 or parts[0] != "-A" or parts[1] not in self.MANAGED_CHAINS:
+                continue
+            if "--mac-source" not in parts or parts[-2:] != ["-j", "DROP"]:
+                continue
+            i = parts.index("--mac-source") + 1
+            parts[i] = parts[i].lower()
+            live[("rule", parts[1], " ".join(parts[2:]))] += 1
+        return live
+
+    def reconcile(self) -> Dict:
+        """Make the live MAC drop rules match the ledger with a minimal add/delete set."""
+        with self._state_lock:
+            live = self._read_live_rules()
+            if live is None:
+                return {"ok": False, "added": 0, "deleted": 0}
+            desired = set(self.ledger.entries("rule"))
+            to_add = [e for e in sorted(desired) if live[e] == 0]
+            to_delete: List[Entry] = []
+            for entry, count in live.items():
+                # Drop stray rules and duplicate copies left by earlier appends
+                to_delete.extend([entry] * (count - (1 if entry in desired else 0)))
+            commands = [self._rule_command("-D", e) for e in to_delete]
+            commands += [self._rule_command("-A", e) for e in to_add]
+            ok = all(self._run_commands(commands))
+            log(f"southbound: reconcile added={len(to_add)} deleted={len(to_delete)} ok={ok}")
+            return {"ok": ok, "added": len(to_add), "deleted": len(to_delete)}
+
+    # --- SouthboundDriver API ---
     def block_mac(self, mac_colon_lower: str) -> bool:
         """Block a MAC at the host firewall (simulated data plane)."""
-        commands = [
-            ["iptables", "-A", "INPUT", "-m", "mac", "--mac-source", mac_colon_lower, "-j", "DROP"],
-            ["iptables", "-A", "FORWARD", "-m", "mac", "--mac-source", mac_colon_lower, "-j", "DROP"],
-        ]
-        return self._run_commands(commands)
+        return self.block_macs([mac_colon_lower])
+
+    def block_macs(self, macs_colon_lower: List[str]) -> bool:
+        """Block several MACs; rules already in the ledger are not re-added."""
+        with self._state_lock:
+            self._ensure_reconciled()
+            wanted = [
+                e for mac in dict.fromkeys(macs_colon_lower)
+                for e in self._block_rules(mac) if not self.ledger.contains(e)
+            ]
+            if not wanted:
+                log(f"southbound: block count={len(macs_colon_lower)} already installed")
+                return True
+            applied = self._run_commands([self._rule_command("-A", e) for e in wanted])
+            # Only rules the kernel accepted are recorded; the rest are retried next time
+            self.ledger.update(add=[e for e, ok in zip(wanted, applied) if ok])
+            return all(applied)
+
+    def unblock_mac(self, mac_colon_lower: str) -> bool:
+        return self.unblock_macs([mac_colon_lower])
+
+    def unblock_macs(self, macs_colon_lower: List[str]) -> bool:
+        """Remove MAC drop rules previously installed by this driver."""
+        with self._state_lock:
+            self._ensure_reconciled()
+            present = [
+                e for mac in dict.fromkeys(macs_colon_lower)
+                for e in self._block_rules(mac) if self.ledger.contains(e)
+            ]
+            if not present:
+                return True
+            applied = self._run_commands([self._rule_command("-D", e) for e in present])
+            self.ledger.update(remove=[e for e, ok in zip(present, applied) if ok])
+            return all(applied)
 
     def allow_mac_on_vlan(self, mac_colon_lower: str, vlan_id: int) -> bool:
         """Placeholder for allowing a MAC on a specific VLAN.
 
         In a real SDN environment, this would push flow entries or port/VLAN
-        membership to the data plane via OpenFlow or device APIs.
+        membership to the data plane via OpenFlow or device APIs. Any block
+        rules for the MAC are lifted; the assignment itself installs nothing,
+        so nothing is recorded in the ledger for it.
         """
-        log(f"southbound: allow mac={mac_colon_lower} vlan={vlan_id} (noop)")
-        return True
+        return self.allow_macs_on_vlans([(mac_colon_lower, vlan_id)])
+
+    def allow_macs_on_vlans(self, entries: List[Tuple[str, int]]) -> bool:
+        ok = self.unblock_macs([mac for mac, _vlan in entries])
+        log(f"southbound: allow count={len(entries)} on VLANs (noop)")
+        return ok
 
     # --- ACL management (mock) ---
     def clear_acls(self) -> bool:
         """Clear existing ACL rules (mock)."""
         if self.mock_mode:
             log("southbound-mock: clear ACLs (noop)")
-            return True
-        # In a real system, remove from chains or replace tables; keep noop for now
-        log("southbound: clear ACLs (noop)")
+        else:
+            # In a real system, remove from chains or replace tables; keep noop for now
+            log("southbound: clear ACLs (noop)")
+        with self._state_lock:
+            self.ledger.update(remove=self.ledger.entries("acl"))
+            self._acl_order = None
         return True
 
     def apply_acls(self, rules: list) -> bool:
         """Apply ACL rules (mock). Accepts normalized rules from validator."""
-        if self.mock_mode:
-            for r in rules:
-                desc = f" {r.get('description')}" if r.get('description') else ''
-                log(f"southbound-mock: ACL {r['action']} {r['protocol']} {r['src']} {r['dst']} eq {r['port']}{desc}")
-            return True
-        # Real implementation would translate into device commands
-        for r in rules:
-            log(f"southbound: ACL {r['action']} {r['protocol']} {r['src']} {r['dst']} port {r['port']} (noop)")
+        wanted = {("acl", f"{(i + 1) * _ACL_KEY_GAP:015d}", r["raw"]) for i, r in enumerate(rules)}
+        # Read, diff and update under one lock so overlapping applies cannot interleave
+        with self._state_lock:
+            current = set(self.ledger.entries("acl"))
+            if wanted == current:
+                log(f"southbound: ACL set unchanged rules={len(rules)}")
+                return True
+            if self.mock_mode:
+                for r in rules:
+                    desc = f" {r.get('description')}" if r.get('description') else ''
+                    log(f"southbound-mock: ACL {r['action']} {r['protocol']} {r['src']} {r['dst']} eq {r['port']}{desc}")
+            else:
+                # Real implementation would translate into device commands
+                for r in rules:
+                    log(f"southbound: ACL {r['action']} {r['protocol']} {r['src']} {r['dst']} port {r['port']} (noop)")
+            self.ledger.update(add=wanted - current, remove=current - wanted)
+            self._acl_order = None
         return True
 
-# Provide a module-level singleton for convenience
-driver = SDNSouthboundDriver()
+    def _installed_acls(self) -> List[Tuple[int, str]]:
+        """Installed ACL as (order key, raw rule) pairs, in rule order (cached)."""
+        if self._acl_order is None:
+            self._acl_order = sorted((int(chain), spec) for _kind, chain, spec in self.ledger.entries("acl"))
+        return self._acl_order
+
+    def _apply_acl_op(self, op: Dict) -> None:
+        rule = f" {op['rule']}" if 'rule' in op else ''
+        if self.mock_mode:
+            log(f"southbound-mock: ACL {op['op']} position={op['position']}{rule}")
+        else:
+            # Real implementation would translate into device commands
+            log(f"southbound: ACL {op['op']} position={op['position']}{rule} (noop)")
+
+    def update_acls(self, rules: list) -> Dict:
+        """Apply only the edit script between the installed ACL and ``rules``."""
+        result = self.update_acl_range(0, rules, truncate=True)
+        log(f"southbound: ACL delta ops={result['operations']} added={result['added']} removed={result['removed']} "
+            f"moved={result['moved']} unchanged={result['unchanged']}")
+        return result
+
+    def update_acl_range(self, start: int, rules: list, truncate: bool = False) -> Dict:
+        """Make installed positions ``start..start+len(rules)`` equal ``rules``.
+
+        Rules after the range keep their positions, which lets large ACLs be
+        applied chunk by chunk; ``truncate`` also removes everything after
+        the range. Ledger entries carry sparse order keys, so an insert takes
+        a key between its neighbours instead of renumbering everything after
+        it; keys are only respread when a gap runs out.
+        """
+        with self._state_lock:
+            installed = self._installed_acls()
+            end = len(installed) if truncate else min(len(installed), start + len(rules))
+            start = min(start, len(installed))
+            window = installed[start:end]
+            script = acl_edit_script([raw for _key, raw in window], [r["raw"] for r in rules])
+            keys = [key for key, _raw in window]
+            raws = [raw for _key, raw in window]
+            lo_bound = installed[start - 1][0] if start > 0 else 0
+            hi_bound = installed[end][0] if end < len(installed) else None
+            respread = False
+            for op in script["ops"]:
+                self._apply_acl_op(dict(op, position=start + op["position"]))
+                pos = op["position"]
+                if op["op"] == "delete":
+                    del keys[pos], raws[pos]
+                elif op["op"] == "replace":
+                    raws[pos] = op["rule"]
+                else:
+                    lo = keys[pos - 1] if pos > 0 else lo_bound
+                    hi = keys[pos] if pos < len(keys) else (hi_bound if hi_bound is not None else lo + 2 * _ACL_KEY_GAP)
+                    if hi - lo < 2:
+                        respread = True
+                    keys.insert(pos, (lo + hi) // 2)
+                    raws.insert(pos, op["rule"])
+            before = {("acl", f"{key:015d}", raw) for key, raw in window}
+            if respread:
+                # Spread this range's keys evenly between its neighbours, or renumber everything
+                gap = (hi_bound - lo_bound) // (len(raws) + 1) if hi_bound is not None else _ACL_KEY_GAP
+                if gap >= 1:
+                    keys = [lo_bound + (i + 1) * gap for i in range(len(raws))]
+                else:
+                    before = {("acl", f"{key:015d}", raw) for key, raw in installed}
+                    raws = [raw for _key, raw in installed[:start]] + raws + [raw for _key, raw in installed[end:]]
+                    keys = [(i + 1) * _ACL_KEY_GAP for i in range(len(raws))]
+                    start, end = 0, len(installed)
+            installed[start:end] = list(zip(keys, raws))
+            after = {("acl", f"{key:015d}", raw) for key, raw in zip(keys, raws)}
+            self.ledger.update(add=after - before, remove=before - after)
+        return {
+            'ok': True,
+            'added': script['added'],
+            'removed': script['removed'],
+            'moved': script['moved'],
+            'unchanged': script['unchanged'],
+            'operations': len(script['ops']),
+        }
+
+    def stats(self) -> Dict:
+        return {"ledger": self.ledger.stats()}
+
+# Provide a module-level singleton for convenience; SDN_DRIVER selects the implementation
+from sdn.factory import get_southbound_driver  # noqa: E402  (factory imports this module lazily)
+driver = get_southbound_driver()
 
 
 
@@ -86,10 +301,21 @@ class SDNNorthboundInterface:
     Note: In a full architecture, the NBI typically lives in the control plane
     and is exposed over REST/RPC to external apps. Here we provide a minimal
     in-process NBI that delegates to the southbound driver for simplicity.
+    When an executor is configured, intents are routed through it so bursts
+    for the same MAC coalesce and transient driver failures are retried.
     """
 
-    def __init__(self, driver: SouthboundDriver) -> None:
+    def __init__(self, driver: SouthboundDriver, executor: Optional[SouthboundExecutor] = None) -> None:
         self._driver = driver
+        self._executor = executor
+        self._timeout = float(os.getenv('SDN_EXECUTOR_TIMEOUT', '30'))
+
+    def _wait(self, futures: List[Future]) -> bool:
+        try:
+            return all(f.result(timeout=self._timeout) for f in futures)
+        except FuturesTimeout:
+            log(f"nbi: southbound executor timed out count={len(futures)}")
+            return False
 
     def quarantine_mac(self, mac_colon_lower: str) -> bool:
         """High-level intent: quarantine a device by MAC.
@@ -97,13 +323,44 @@ class SDNNorthboundInterface:
         Current implementation maps directly to a MAC block at the data plane.
         """
         log(f"nbi: quarantine mac={mac_colon_lower}")
+        if self._executor is not None:
+            return self._wait([self._executor.submit(mac_colon_lower, 'block')])
         return self._driver.block_mac(mac_colon_lower)
 
     def permit_mac_on_vlan(self, mac_colon_lower: str, vlan_id: int) -> bool:
         """High-level intent: allow a device on a specific VLAN."""
         log(f"nbi: permit mac={mac_colon_lower} vlan={vlan_id}")
+        if self._executor is not None:
+            return self._wait([self._executor.submit(mac_colon_lower, 'allow', vlan_id)])
         return self._driver.allow_mac_on_vlan(mac_colon_lower, vlan_id)
 
+    def quarantine_many(self, macs_colon_lower: List[str]) -> bool:
+        """Grouped quarantine intent used by batch admission."""
+        log(f"nbi: quarantine count={len(macs_colon_lower)}")
+        if self._executor is not None:
+            return self._wait([self._executor.submit(mac, 'block') for mac in macs_colon_lower])
+        return self._driver.block_macs(macs_colon_lower)
+
+    def permit_many(self, entries: List[Tuple[str, int]]) -> bool:
+        """Grouped permit intent; entries are (mac_colon_lower, vlan_id) pairs."""
+        log(f"nbi: permit count={len(entries)}")
+        if self._executor is not None:
+            return self._wait([self._executor.submit(mac, 'allow', vlan_id) for mac, vlan_id in entries])
+        return self._driver.allow_macs_on_vlans(entries)
+
+    def update_acls(self, rules: list) -> Dict:
+        """Intent: make the installed ACL equal ``rules``, applying only the difference."""
+        log(f"nbi: update ACL rules={len(rules)}")
+        return self._driver.update_acls(rules)
+
+    def update_acl_range(self, start: int, rules: list, truncate: bool = False) -> Dict:
+        """Intent: replace one range of the installed ACL (see SouthboundDriver.update_acl_range)."""
+        log(f"nbi: update ACL range start={start} rules={len(rules)} truncate={truncate}")
+        return self._driver.update_acl_range(start, rules, truncate)
+
+    def executor_stats(self) -> Optional[Dict]:
+        return self._executor.stats() if self._executor is not None else None
+
 
 # Module-level NBI singleton for convenience
-nbi = SDNNorthboundInterface(driver)
+nbi = SDNNorthboundInterface(driver, create_executor(driver))
@@ -1,5 +1,7 @@
+import difflib
 import re
-from typing import List, Dict, Tuple
+from collections import Counter
+from typing import List, Dict, Optional, Tuple
 
 
 _RULE_RE = re.compile(
@@ -19,37 +21,79 @@ def _normalize_addr(addr: str) -> str:
     return addr
 
 
+def validate_acl(i: int, item) -> Tuple[Optional[Dict], Optional[str]]:
+    """Validate one ACL object; returns (normalized rule, None) or (None, issue)."""
+    if not isinstance(item, dict):
+        return None, f"ACL[{i}]: must be an object"
+    rule = (item.get("rule") or "").strip()
+    if not rule:
+        return None, f"ACL[{i}]: missing 'rule'"
+    m = _RULE_RE.match(rule)
+    if not m:
+        return None, f"ACL[{i}]: unsupported rule syntax: '{rule}'"
+    action, proto, src, dst, port = m.groups()
+    proto = proto.lower()
+    if port and proto not in ("tcp", "udp"):
+        return None, f"ACL[{i}]: 'eq <port>' only valid for tcp/udp"
+    return {
+        "action": action.lower(),
+        "protocol": proto,
+        "src": _normalize_addr(src),
+        "dst": _normalize_addr(dst),
+        "port": int(port) if port else None,
+        "raw": rule,
+        "description": item.get("description"),
+    }, None
+
+
 def validate_acls(acls: List[Dict]) -> Dict:
     issues: List[str] = []
     normalized: List[Dict] = []
     if not isinstance(acls, list):
         return {"ok": False, "issues": ["Payload should be an array of ACL objects"]}
     for i, item in enumerate(acls):
-        if not isinstance(item, dict):
-            issues.append(f"ACL[{i}]: must be an object")
-            continue
-        rule = (item.get("rule") or "").strip()
-        if not rule:
-            issues.append(f"ACL[{i}]: missing 'rule'")
-            continue
-        m = _RULE_RE.match(rule)
-        if not m:
-            issues.append(f"ACL[{i}]: unsupported rule syntax: '{rule}'")
-            continue
-        action, proto, src, dst, port = m.groups()
-        proto = proto.lower()
-        if port and proto not in ("tcp", "udp"):
-            issues.append(f"ACL[{i}]: 'eq <port>' only valid for tcp/udp")
-            continue
-        normalized.append({
-            "action": action.lower(),
-            "protocol": proto,
-            "src": _normalize_addr(src),
-            "dst": _normalize_addr(dst),
-            "port": int(port) if port else None,
-            "raw": rule,
-            "description": item.get("description"),
-        })
+        rule, issue = validate_acl(i, item)
+        if issue:
+            issues.append(issue)
+        else:
+            normalized.append(rule)
     return {"ok": len(issues) == 0, "issues": issues, "rules": normalized}
 
 
+def acl_edit_script(current: List[str], wanted: List[str]) -> Dict:
+    """Ordered edit script turning the ``current`` rule list into ``wanted``.
+
+    Rules are compared by their raw text. Ops are listed in application
+    order against a positional rule list (last change first, so earlier
+    positions stay valid): ``{"op": "delete", "position": p}``,
+    ``{"op": "insert", "position": p, "rule": raw}`` and
+    ``{"op": "replace", "position": p, "rule": raw}``. A rule deleted in
+    one place and inserted in another is counted as moved, not as added
+    and removed.
+    """
+    matcher = difflib.SequenceMatcher(None, current, wanted, autojunk=False)
+    ops: List[Dict] = []
+    unchanged = 0
+    deleted: Counter = Counter()
+    inserted: Counter = Counter()
+    for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+        if tag == "equal":
+            unchanged += i2 - i1
+            continue
+        paired = min(i2 - i1, j2 - j1)
+        for k in range(paired):
+            ops.append({"op": "replace", "position": i1 + k, "rule": wanted[j1 + k]})
+        for k in reversed(range(i1 + paired, i2)):
+            ops.append({"op": "delete", "position": k})
+        for k in range(j1 + paired, j2):
+            ops.append({"op": "insert", "position": i1 + (k - j1), "rule": wanted[k]})
+        deleted.update(current[i1:i2])
+        inserted.update(wanted[j1:j2])
+    moved = sum((deleted & inserted).values())
+    return {
+        "ops": ops,
+        "added": sum(inserted.values()) - moved,
+        "removed": sum(deleted.values()) - moved,
+        "moved": moved,
+        "unchanged": unchanged,
+    }
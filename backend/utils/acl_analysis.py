@@ -0,0 +1,318 @@
+import bisect
+import ipaddress
+from typing import Dict, List, Optional, Set, Tuple
+
+_BITS = {4: 32, 6: 128}
+
+# An address dimension: None for 'any', else (version, prefixlen, prefix value)
+Prefix = Optional[Tuple[int, int, int]]
+
+
+def _parse_prefix(addr: str):
+    if addr == "any":
+        return None
+    try:
+        net = ipaddress.ip_network(addr, strict=False)
+    except ValueError:
+        return False
+    return net.version, net.prefixlen, int(net.network_address) >> (_BITS[net.version] - net.prefixlen)
+
+
+def _format_prefix(prefix: Prefix) -> str:
+    if prefix is None:
+        return "any"
+    version, plen, value = prefix
+    bits = _BITS[version]
+    addr = ipaddress.ip_address(value << (bits - plen)) if version == 4 else ipaddress.IPv6Address(value << (bits - plen))
+    return str(addr) if plen == bits else f"{addr}/{plen}"
+
+
+def _interval(prefix: Prefix) -> Tuple[int, int, int]:
+    """(version, lo, hi) address range of a prefix; 'any' spans everything."""
+    if prefix is None:
+        return 0, 0, 1 << 128
+    version, plen, value = prefix
+    span = _BITS[version] - plen
+    return version, value << span, ((value + 1) << span) - 1
+
+
+class _Rule:
+    __slots__ = ("index", "action", "protocol", "port", "src", "dst", "raw", "description")
+
+    def __init__(self, index: int, rule: Dict, src: Prefix, dst: Prefix) -> None:
+        self.index = index
+        self.action = rule["action"]
+        self.protocol = rule["protocol"]
+        self.port = rule["port"]
+        self.src = src
+        self.dst = dst
+        self.raw = rule["raw"]
+        self.description = rule.get("description")
+
+    def key(self) -> Tuple:
+        return self.src, self.dst, self.protocol, self.port
+
+    def covers(self, other: "_Rule") -> bool:
+        return (_contains(self.src, other.src) and _contains(self.dst, other.dst)
+                and self.protocol in ("ip", other.protocol) and self.port in (None, other.port))
+
+    def overlaps(self, other: "_Rule") -> bool:
+        return ((_contains(self.src, other.src) or _contains(other.src, self.src))
+                and (_contains(self.dst, other.dst) or _contains(other.dst, self.dst))
+                and (self.protocol == other.protocol or "ip" in (self.protocol, other.protocol))
+                and (self.port == other.port or None in (self.port, other.port)))
+
+    def text(self) -> str:
+        port = f" eq {self.port}" if self.port is not None else ""
+        return f"{self.action} {self.protocol} {_format_prefix(self.src)} {_format_prefix(self.dst)}{port}"
+
+
+def _contains(outer: Prefix, inner: Prefix) -> bool:
+    if outer is None:
+        return True
+    if inner is None or outer[0] != inner[0] or outer[1] > inner[1]:
+        return False
+    return inner[2] >> (inner[1] - outer[1]) == outer[2]
+
+
+class _PrefixIndex:
+    """Prefix lengths in use per IP version, for enumerating a prefix's ancestors."""
+
+    def __init__(self, prefixes) -> None:
+        self._lengths: Dict[int, List[int]] = {4: [], 6: []}
+        for p in prefixes:
+            if p is not None and p[1] not in self._lengths[p[0]]:
+                self._lengths[p[0]].append(p[1])
+        for lengths in self._lengths.values():
+            lengths.sort()
+
+    def ancestors(self, prefix: Prefix) -> List[Prefix]:
+        """The prefix itself, every used shorter prefix containing it, and 'any'."""
+        out: List[Prefix] = [None]
+        if prefix is None:
+            return out
+        version, plen, value = prefix
+        for length in self._lengths[version]:
+            if length > plen:
+                break
+            out.append((version, length, value >> (plen - length)))
+        return out
+
+
+def _compile(rules: List[Dict]) -> Tuple[List[_Rule], List[int]]:
+    compiled, skipped = [], []
+    for i, rule in enumerate(rules):
+        src, dst = _parse_prefix(rule["src"]), _parse_prefix(rule["dst"])
+        if src is False or dst is False:
+            skipped.append(i)
+            continue
+        compiled.append(_Rule(i, rule, src, dst))
+    return compiled, skipped
+
+
+def _find_dead(compiled: List[_Rule]) -> Dict[int, _Rule]:
+    """Map rule index -> earliest earlier rule that covers it entirely.
+
+    Rules are swept in order while a hash of exact match keys records the
+    first rule seen for each key. A rule's covering candidates are exactly
+    the keys built from its ancestors in every dimension (used prefix
+    lengths only, protocol or 'ip', port or any), so each rule costs a
+    bounded number of probes instead of a scan of all earlier rules.
+    """
+    src_index = _PrefixIndex(r.src for r in compiled)
+    dst_index = _PrefixIndex(r.dst for r in compiled)
+    first_by_key: Dict[Tuple, _Rule] = {}
+    dead: Dict[int, _Rule] = {}
+    for rule in compiled:
+        protocols = ("ip",) if rule.protocol == "ip" else (rule.protocol, "ip")
+        ports = (None,) if rule.port is None else (rule.port, None)
+        best: Optional[_Rule] = None
+        for src in src_index.ancestors(rule.src):
+            for dst in dst_index.ancestors(rule.dst):
+                for proto in protocols:
+                    for port in ports:
+                        hit = first_by_key.get((src, dst, proto, port))
+                        if hit is not None and (best is None or hit.index < best.index):
+                            best = hit
+        if best is not None:
+            dead[rule.index] = best
+        first_by_key.setdefault(rule.key(), rule)
+    return dead
+
+
+class _AddressBuckets:
+    """Rules grouped by one address dimension (src or dst).
+
+    ``related`` returns the groups whose prefix is nested with the rule's,
+    either way round: containing prefixes via the ancestor hash and
+    contained prefixes via a bisect over sorted address ranges, since
+    prefixes are either nested or disjoint.
+    """
+
+    def __init__(self, rules: List[_Rule], field: str) -> None:
+        self.field = field
+        self.by_prefix: Dict[Prefix, List[_Rule]] = {}
+        for rule in rules:
+            self.by_prefix.setdefault(getattr(rule, field), []).append(rule)
+        self._index = _PrefixIndex(self.by_prefix)
+        self._ranges = sorted(
+            (_interval(p) + (p,) for p in self.by_prefix if p is not None), key=lambda r: (r[0], r[1], -r[2])
+        )
+        self._starts = [(r[0], r[1]) for r in self._ranges]
+
+    def related(self, rule: _Rule) -> Optional[List[List[_Rule]]]:
+        """Groups of rules nested with the rule's prefix; None when that is every rule ('any')."""
+        prefix = getattr(rule, self.field)
+        if prefix is None:
+            return None
+        related: Set[Prefix] = set(self._index.ancestors(prefix))
+        version, lo, hi = _interval(prefix)
+        i = bisect.bisect_left(self._starts, (version, lo))
+        while i < len(self._ranges) and self._ranges[i][0] == version and self._ranges[i][1] <= hi:
+            related.add(self._ranges[i][3])
+            i += 1
+        return [self.by_prefix[p] for p in related if p in self.by_prefix]
+
+
+class _ServiceBuckets:
+    """Rules grouped by (protocol, port)."""
+
+    def __init__(self, rules: List[_Rule]) -> None:
+        self.by_service: Dict[Tuple[str, Optional[int]], List[_Rule]] = {}
+        self._ports: Dict[str, List[Optional[int]]] = {}
+        for rule in rules:
+            key = (rule.protocol, rule.port)
+            if key not in self.by_service:
+                self._ports.setdefault(rule.protocol, []).append(rule.port)
+            self.by_service.setdefault(key, []).append(rule)
+
+    def related(self, rule: _Rule) -> Optional[List[List[_Rule]]]:
+        """Groups of rules whose protocol and port can match the same packets; None for every rule."""
+        if rule.protocol == "ip" and rule.port is None:
+            return None
+        protocols = list(self._ports) if rule.protocol == "ip" else [rule.protocol, "ip"]
+        groups = []
+        for proto in protocols:
+            ports = self._ports.get(proto, ()) if rule.port is None else (rule.port, None)
+            groups.extend(self.by_service[(proto, port)] for port in ports if (proto, port) in self.by_service)
+        return groups
+
+
+def _find_conflicts(live: List[_Rule], limit: int) -> List[Dict]:
+    """Partially overlapping earlier rules with the opposite action, in (rule, with) order.
+
+    Overlapping rules must be related in every dimension (nested src,
+    nested dst, compatible protocol and port), so each rule draws its
+    candidates from whichever dimension's index yields the fewest and
+    checks only those; a "src any" rule is looked up by its dst or
+    service instead of scanning every rule.
+    """
+    dimensions = [_AddressBuckets(live, "src"), _AddressBuckets(live, "dst"), _ServiceBuckets(live)]
+    conflicts: List[Dict] = []
+    for rule in live:
+        candidates: Optional[List[List[_Rule]]] = None
+        size = len(live)
+        for dimension in dimensions:
+            groups = dimension.related(rule)
+            count = size if groups is None else sum(len(g) for g in groups)
+            if count < size:
+                candidates, size = groups, count
+        found = []
+        for group in candidates if candidates is not None else [live]:
+            for other in group:
+                if other.index >= rule.index or other.action == rule.action:
+                    continue
+                if other.overlaps(rule) and not rule.covers(other):
+                    found.append(other.index)
+        # live is in rule order, so sorting each rule's hits keeps the whole list sorted
+        conflicts.extend({"rule": rule.index, "with": index} for index in sorted(found))
+        if len(conflicts) >= limit:
+            return conflicts[:limit]
+    return conflicts
+
+
+def _sibling_parent(a: Prefix, b: Prefix) -> Prefix:
+    """The parent prefix when a and b are its two halves, else False."""
+    if a is None or b is None or a[0] != b[0] or a[1] != b[1] or a[1] == 0:
+        return False
+    if a[2] >> 1 != b[2] >> 1 or a[2] == b[2]:
+        return False
+    return a[0], a[1] - 1, a[2] >> 1
+
+
+def _merge(a: _Rule, b: _Rule) -> Optional[_Rule]:
+    if (a.action, a.protocol, a.port) != (b.action, b.protocol, b.port):
+        return None
+    merged = None
+    if a.dst == b.dst:
+        parent = _sibling_parent(a.src, b.src)
+        if parent is not False:
+            merged = _Rule(a.index, {"action": a.action, "protocol": a.protocol, "port": a.port,
+                                     "raw": None}, parent, a.dst)
+    elif a.src == b.src:
+        parent = _sibling_parent(a.dst, b.dst)
+        if parent is not False:
+            merged = _Rule(a.index, {"action": a.action, "protocol": a.protocol, "port": a.port,
+                                     "raw": None}, a.src, parent)
+    if merged is not None:
+        merged.description = a.description or b.description
+    return merged
+
+
+def _optimize(rules: List[Dict], compiled: List[_Rule], dead: Dict[int, _Rule]) -> List[Dict]:
+    """Drop dead rules and merge neighbouring rules on sibling prefixes.
+
+    Only rules that end up next to each other are merged, so no rule in
+    between can observe the change; a merged rule can merge again with the
+    next one (two /25s become a /24, which may pair with the following /24).
+    """
+    by_index = {r.index: r for r in compiled}
+    stack: List = []
+    for i, rule in enumerate(rules):
+        if i in dead:
+            continue
+        current = by_index.get(i, rule)
+        stack.append(current)
+        while len(stack) >= 2 and isinstance(stack[-1], _Rule) and isinstance(stack[-2], _Rule):
+            merged = _merge(stack[-2], stack[-1])
+            if merged is None:
+                break
+            stack[-2:] = [merged]
+    out = []
+    for item in stack:
+        if isinstance(item, _Rule):
+            out.append({"rule": item.raw or item.text(), "description": item.description})
+        else:
+            # Addresses the analysis cannot reason about are passed through untouched
+            out.append({"rule": item["raw"], "description": item.get("description")})
+    return out
+
+
+def analyze_acls(rules: List[Dict], optimize: bool = False, max_conflicts: int = 1000) -> Dict:
+    """Report shadowed, redundant and conflicting rules in a normalized ACL.
+
+    A rule is shadowed when an earlier rule with the opposite action covers
+    it entirely, and redundant when the covering rule has the same action;
+    either way it can never match. Conflicts are live rules partially
+    overlapped by an earlier rule with the opposite action. Indexes refer
+    to positions in ``rules``.
+    """
+    compiled, skipped = _compile(rules)
+    dead = _find_dead(compiled)
+    shadowed, redundant = [], []
+    for index in sorted(dead):
+        by = dead[index]
+        entry = {"rule": index, "by": by.index}
+        (redundant if by.action == rules[index]["action"] else shadowed).append(entry)
+    live = [r for r in compiled if r.index not in dead]
+    result = {
+        "shadowed": shadowed,
+        "redundant": redundant,
+        "conflicts": _find_conflicts(live, max_conflicts),
+        "skipped": skipped,
+        "total": len(rules),
+        "live": len(live) + len(skipped),
+    }
+    if optimize:
+        result["optimized"] = _optimize(rules, compiled, dead)
+    return result
@@ -0,0 +1,203 @@
+import ipaddress
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pure-Python evaluation is used instead
+    np = None
+
+from utils.acl import validate_acls
+
+_PROTOCOLS = ("ip", "tcp", "udp", "icmp")
+_BITS = {4: 32, 6: 128}
+
+
+def _parse_addr(addr) -> Optional[Tuple[int, int]]:
+    """Flow address -> (version, int), or None when it is not an IP."""
+    try:
+        ip = ipaddress.ip_address(str(addr).strip())
+    except ValueError:
+        return None
+    return ip.version, int(ip)
+
+
+class _PrefixTable:
+    """One address dimension: a prefix-length-indexed CIDR trie of rule bitsets.
+
+    Each populated prefix length holds a hash of network -> bitset of rules
+    using that prefix, so matching an address is one probe per prefix length
+    actually present in the ruleset rather than a walk over every rule.
+    """
+
+    def __init__(self) -> None:
+        self.any_mask = 0
+        self._tables: Dict[int, Dict[int, Dict[int, int]]] = {4: {}, 6: {}}
+
+    def add(self, addr: str, bit: int) -> bool:
+        if addr == "any":
+            self.any_mask |= bit
+            return True
+        try:
+            net = ipaddress.ip_network(addr, strict=False)
+        except ValueError:
+            return False
+        shift = _BITS[net.version] - net.prefixlen
+        by_net = self._tables[net.version].setdefault(net.prefixlen, {})
+        key = int(net.network_address) >> shift
+        by_net[key] = by_net.get(key, 0) | bit
+        return True
+
+    def match(self, parsed: Optional[Tuple[int, int]]) -> int:
+        mask = self.any_mask
+        if parsed is None:
+            return mask
+        version, value = parsed
+        bits = _BITS[version]
+        for plen, by_net in self._tables[version].items():
+            mask |= by_net.get(value >> (bits - plen), 0)
+        return mask
+
+
+class AclClassifier:
+    """First-match packet classifier compiled from normalized ACL rules.
+
+    Rule ``i`` owns bit ``i``. Every dimension (src, dst, protocol, port)
+    maps a packet field to the bitset of rules it satisfies; the verdict is
+    the lowest bit set in the intersection, i.e. the first matching rule.
+    Packets matching no rule are denied implicitly.
+    """
+
+    def __init__(self, rules: List[Dict]) -> None:
+        self.rules = rules
+        self.unsupported: List[int] = []
+        self._src = _PrefixTable()
+        self._dst = _PrefixTable()
+        self._proto: Dict[str, int] = {p: 0 for p in _PROTOCOLS}
+        self._any_port = 0
+        self._ports: Dict[int, int] = {}
+        for i, rule in enumerate(rules):
+            bit = 1 << i
+            if not (self._src.add(rule["src"], bit) and self._dst.add(rule["dst"], bit)):
+                # Not an address or CIDR: the rule can never match a packet
+                self.unsupported.append(i)
+                continue
+            if rule["protocol"] == "ip":
+                for p in _PROTOCOLS:
+                    self._proto[p] |= bit
+            else:
+                self._proto[rule["protocol"]] |= bit
+            if rule["port"] is None:
+                self._any_port |= bit
+            else:
+                self._ports[rule["port"]] = self._ports.get(rule["port"], 0) | bit
+
+    def _service_mask(self, protocol: Optional[str], port: Optional[int]) -> int:
+        # Unknown protocols fall back to the rules written for 'ip'
+        proto_mask = self._proto.get(protocol, self._proto["ip"])
+        port_mask = self._any_port | (self._ports.get(port, 0) if port is not None else 0)
+        return proto_mask & port_mask
+
+    def _verdict(self, mask: int) -> int:
+        return (mask & -mask).bit_length() - 1 if mask else -1
+
+    def classify(self, protocol: str, src: str, dst: str, port: Optional[int] = None) -> int:
+        """Index of the first matching rule, or -1 for the implicit deny."""
+        mask = (self._service_mask(protocol, port)
+                & self._src.match(_parse_addr(src))
+                & self._dst.match(_parse_addr(dst)))
+        return self._verdict(mask)
+
+    def classify_many(self, flows: Sequence[Tuple[str, str, str, Optional[int]]]) -> List[int]:
+        """Classify a batch of (protocol, src, dst, port) tuples."""
+        if np is None or not flows:
+            return self._classify_many_py(flows)
+        return self._classify_many_np(flows)
+
+    def _classify_many_py(self, flows) -> List[int]:
+        src_masks: Dict[str, int] = {}
+        dst_masks: Dict[str, int] = {}
+        seen: Dict[Tuple, int] = {}
+        out = []
+        for flow in flows:
+            verdict = seen.get(flow)
+            if verdict is None:
+                protocol, src, dst, port = flow
+                s = src_masks.get(src)
+                if s is None:
+                    s = src_masks[src] = self._src.match(_parse_addr(src))
+                d = dst_masks.get(dst)
+                if d is None:
+                    d = dst_masks[dst] = self._dst.match(_parse_addr(dst))
+                verdict = seen[flow] = self._verdict(self._service_mask(protocol, port) & s & d)
+            out.append(verdict)
+        return out
+
+    def _classes(self, values, match) -> Tuple:
+        """Collapse unique field values into equivalence classes of identical rule bitsets."""
+        uniq, inverse = np.unique(values, return_inverse=True)
+        class_of: Dict[int, int] = {}
+        masks: List[int] = []
+        ids = np.empty(len(uniq), dtype=np.int64)
+        for i, value in enumerate(uniq.tolist()):
+            mask = match(value)
+            cid = class_of.get(mask)
+            if cid is None:
+                cid = class_of[mask] = len(masks)
+                masks.append(mask)
+            ids[i] = cid
+        return ids[inverse.reshape(-1)], masks
+
+    def _classify_many_np(self, flows) -> List[int]:
+        protos, srcs, dsts, ports = zip(*flows)
+        src_cls, src_masks = self._classes(np.array(srcs, dtype=str), lambda v: self._src.match(_parse_addr(v)))
+        dst_cls, dst_masks = self._classes(np.array(dsts, dtype=str), lambda v: self._dst.match(_parse_addr(v)))
+        proto_codes = np.array([_PROTOCOLS.index(p) if p in _PROTOCOLS else len(_PROTOCOLS) for p in protos],
+                               dtype=np.int64)
+        port_codes = np.array([-1 if p is None else p for p in ports], dtype=np.int64)
+
+        def service(code: int) -> int:
+            proto_idx, port = divmod(int(code), 1 << 17)
+            protocol = _PROTOCOLS[proto_idx] if proto_idx < len(_PROTOCOLS) else None
+            return self._service_mask(protocol, port - 1 if port else None)
+
+        svc_cls, svc_masks = self._classes(proto_codes * (1 << 17) + port_codes + 1, service)
+        # One bitset intersection per distinct (src class, dst class, service class)
+        combined = (src_cls * len(dst_masks) + dst_cls) * len(svc_masks) + svc_cls
+        uniq, inverse = np.unique(combined, return_inverse=True)
+        verdicts = np.empty(len(uniq), dtype=np.int64)
+        n_dst, n_svc = len(dst_masks), len(svc_masks)
+        for i, key in enumerate(uniq.tolist()):
+            rest, svc = divmod(key, n_svc)
+            src, dst = divmod(rest, n_dst)
+            verdicts[i] = self._verdict(src_masks[src] & dst_masks[dst] & svc_masks[svc])
+        return verdicts[inverse.reshape(-1)].tolist()
+
+
+def compile_acls(acls: List[Dict]) -> Dict:
+    """Validate raw ACL objects and compile them; mirrors validate_acls' result shape."""
+    result = validate_acls(acls)
+    if not result.get("ok"):
+        return result
+    classifier = AclClassifier(result["rules"])
+    issues = [f"ACL[{i}]: src/dst must be 'any', an IP address or a CIDR; rule never matches"
+              for i in classifier.unsupported]
+    return {"ok": True, "issues": issues, "rules": result["rules"], "classifier": classifier}
+
+
+def normalize_flow(flow) -> Tuple[str, str, str, Optional[int]]:
+    """Accept [proto, src, dst, port] or {"protocol", "src", "dst", "port"}."""
+    if isinstance(flow, dict):
+        proto = flow.get("protocol", flow.get("proto"))
+        src, dst, port = flow.get("src"), flow.get("dst"), flow.get("port")
+    elif isinstance(flow, (list, tuple)) and len(flow) in (3, 4):
+        proto, src, dst = flow[:3]
+        port = flow[3] if len(flow) == 4 else None
+    else:
+        raise ValueError("flow must be [proto, src, dst, port] or an object")
+    if not proto or src is None or dst is None:
+        raise ValueError("flow requires protocol, src and dst")
+    if port is not None:
+        port = int(port)
+        if not 0 <= port <= 65535:
+            raise ValueError("port must be 0-65535")
+    return str(proto).strip().lower(), str(src).strip(), str(dst).strip(), port
@@ -0,0 +1,77 @@
+import re
+from typing import Iterable, List, Optional
+
+_SEPARATORS = str.maketrans("", "", ":-. ")
+_HEX12 = re.compile(r"[0-9A-Fa-f]{12}")
+_MAX = (1 << 48) - 1
+
+
+class MacAddress(int):
+    """A 48-bit MAC address stored as an int.
+
+    Parsing accepts colon, hyphen, Cisco dotted and bare hex spellings in
+    either case. ``str()`` is the hyphen-upper form stored in the devices
+    table; ``colon_lower`` is the form used towards the data plane. The
+    integer value is the ``devices.mac_key`` primary key.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, value) -> "MacAddress":
+        if isinstance(value, int):
+            if not 0 <= value <= _MAX:
+                raise ValueError("Invalid MAC address format")
+            return super().__new__(cls, value)
+        if not isinstance(value, str):
+            raise ValueError("MAC address is required")
+        digits = value.translate(_SEPARATORS)
+        if not _HEX12.fullmatch(digits):
+            raise ValueError("Invalid MAC address format")
+        return super().__new__(cls, int(digits, 16))
+
+    @classmethod
+    def parse(cls, value) -> Optional["MacAddress"]:
+        """Like the constructor, but None instead of ValueError."""
+        try:
+            return cls(value)
+        except ValueError:
+            return None
+
+    @property
+    def hyphen_upper(self) -> str:
+        return self.to_bytes(6, "big").hex("-").upper()
+
+    @property
+    def colon_lower(self) -> str:
+        return self.to_bytes(6, "big").hex(":")
+
+    @property
+    def oui(self) -> int:
+        return self >> 24
+
+    def __str__(self) -> str:
+        return self.hyphen_upper
+
+    def __repr__(self) -> str:
+        return f"MacAddress('{self.hyphen_upper}')"
+
+
+def parse_macs(values: Iterable) -> List[Optional[MacAddress]]:
+    """Bulk parse; invalid entries come back as None in their position."""
+    parse = MacAddress.parse
+    return [parse(v) for v in values]
+
+
+def format_mac(key: int) -> str:
+    """Hyphen-upper text for a stored ``mac_key``."""
+    return key.to_bytes(6, "big").hex("-").upper()
+
+
+def prefix_range(prefix) -> range:
+    """``mac_key`` range covered by a MAC prefix such as an OUI ("AA:BB:CC")."""
+    digits = str(prefix).translate(_SEPARATORS)
+    if not digits or len(digits) > 12 or not re.fullmatch(r"[0-9A-Fa-f]+", digits):
+        raise ValueError(f"invalid MAC prefix: {prefix!r}")
+    shift = 4 * (12 - len(digits))
+    start = int(digits, 16) << shift
+    return range(start, start + (1 << shift))
@@ -0,0 +1,222 @@
+import codecs
+import csv
+import json
+from typing import Any, BinaryIO, Iterator, Optional, Tuple
+
+_CHUNK = 64 * 1024
+# Longest array item we wait for; past this an undecodable item is malformed, not truncated
+_MAX_ITEM = 1024 * 1024
+_WHITESPACE = " \t\r\n"
+
+# (index, item, error): item is None when error is set
+StreamItem = Tuple[int, Any, Optional[str]]
+
+
+def _read_text(stream: BinaryIO, chunk_size: int) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            tail = decoder.decode(b"", final=True)
+            if tail:
+                yield tail
+            return
+        yield decoder.decode(chunk)
+
+
+def iter_json_items(stream: BinaryIO, chunk_size: int = _CHUNK) -> Iterator[StreamItem]:
+    """Yield items of a JSON array or NDJSON body as they arrive.
+
+    The format is sniffed from the first non-blank character: ``[`` starts
+    a JSON array, anything else is read as one JSON value per line. Only
+    the current item is buffered, so memory stays flat however long the
+    body is. A malformed NDJSON line is reported and skipped; a malformed
+    array ends the stream with an error, since the rest cannot be framed.
+    That error comes once the item fails to decode with ``_MAX_ITEM``
+    characters buffered, without reading the rest of the body.
+    """
+    chunks = _read_text(stream, chunk_size)
+    buf = ""
+    for text in chunks:
+        buf += text
+        if buf.lstrip(_WHITESPACE):
+            break
+    buf = buf.lstrip(_WHITESPACE)
+    if buf.startswith("["):
+        yield from _iter_array(buf[1:], chunks)
+    elif buf:
+        yield from _iter_lines(buf, chunks)
+
+
+def _iter_lines(buf: str, chunks: Iterator[str]) -> Iterator[StreamItem]:
+    index = 0
+    eof = False
+    while True:
+        *lines, buf = buf.split("\n")
+        if eof:
+            lines.append(buf)
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield index, json.loads(line), None
+            except ValueError as e:
+                yield index, None, f"invalid JSON: {e}"
+            index += 1
+        if eof:
+            return
+        text = next(chunks, None)
+        if text is None:
+            eof = True
+        else:
+            buf += text
+
+
+def iter_json_object_items(stream: BinaryIO, chunk_size: int = _CHUNK) -> Iterator[StreamItem]:
+    """Yield the members of a top-level JSON object as ``[key, value]`` pairs.
+
+    For mapping-shaped files such as ``{"alice": 10, "bob": 20}``; framing
+    and error handling follow the JSON array case of iter_json_items.
+    """
+    chunks = _read_text(stream, chunk_size)
+    buf = ""
+    for text in chunks:
+        buf += text
+        if buf.lstrip(_WHITESPACE):
+            break
+    buf = buf.lstrip(_WHITESPACE)
+    if buf.startswith("{"):
+        yield from _iter_array(buf[1:], chunks, close="}", pairs=True)
+    elif buf:
+        yield 0, None, "invalid JSON: expected an object"
+
+
+def _iter_text_lines(chunks: Iterator[str]) -> Iterator[str]:
+    buf = ""
+    for text in chunks:
+        buf += text
+        *lines, buf = buf.split("\n")
+        for line in lines:
+            yield line + "\n"
+    if buf:
+        yield buf
+
+
+def iter_csv_items(stream: BinaryIO, chunk_size: int = _CHUNK) -> Iterator[StreamItem]:
+    """Yield the rows of a CSV body with a header line as dicts.
+
+    Header names are stripped and lower-cased. Quoted fields may span
+    lines; a row with more cells than the header is reported and skipped.
+    A CSV syntax error ends the stream, like a malformed JSON array.
+    """
+    reader = csv.reader(_iter_text_lines(_read_text(stream, chunk_size)))
+    try:
+        header = [h.strip().lower() for h in next(reader, [])]
+    except csv.Error as e:
+        yield 0, None, f"invalid CSV: {e}"
+        return
+    if header and header[0].startswith("\ufeff"):
+        header[0] = header[0][1:]
+    index = 0
+    while True:
+        try:
+            row = next(reader, None)
+        except csv.Error as e:
+            yield index, None, f"invalid CSV: {e}"
+            return
+        if row is None:
+            return
+        if not any(cell.strip() for cell in row):
+            continue
+        if len(row) > len(header):
+            yield index, None, f"invalid CSV: {len(row)} cells for {len(header)} columns"
+        else:
+            yield index, dict(zip(header, row)), None
+        index += 1
+
+
+def _decode_member(decoder: json.JSONDecoder, buf: str, pos: int, pairs: bool) -> Tuple[Any, int]:
+    """One array item, or one ``"key": value`` member as [key, value]."""
+    if not pairs:
+        return decoder.raw_decode(buf, pos)
+    key, pos = decoder.raw_decode(buf, pos)
+    if not isinstance(key, str):
+        raise ValueError("object keys must be strings")
+    while pos < len(buf) and buf[pos] in _WHITESPACE:
+        pos += 1
+    if pos >= len(buf):
+        raise ValueError("truncated member")
+    if buf[pos] != ":":
+        raise ValueError("expected ':' after object key")
+    pos += 1
+    while pos < len(buf) and buf[pos] in _WHITESPACE:
+        pos += 1
+    value, end = decoder.raw_decode(buf, pos)
+    return [key, value], end
+
+
+def _iter_array(
+    buf: str, chunks: Iterator[str], close: str = "]", pairs: bool = False, max_item: int = _MAX_ITEM
+) -> Iterator[StreamItem]:
+    decoder = json.JSONDecoder()
+    index = 0
+    pos = 0
+    eof = False
+    expect_item = True
+    while True:
+        while pos < len(buf) and buf[pos] in _WHITESPACE:
+            pos += 1
+        if pos < len(buf):
+            ch = buf[pos]
+            if ch == close:
+                return
+            if ch == "," and not expect_item:
+                pos += 1
+                expect_item = True
+                continue
+            try:
+                item, end = _decode_member(decoder, buf, pos, pairs)
+            except ValueError as e:
+                if eof:
+                    yield index, None, f"invalid JSON: {e}"
+                    return
+                if len(buf) - pos > max_item:
+                    # More data cannot fix it; stop instead of buffering the rest of the body
+                    yield index, None, f"invalid JSON: {e} (item not complete after {max_item} characters)"
+                    return
+                item, end = None, None
+            # A value ending exactly at the buffer edge (e.g. a number) may continue
+            if end is not None and (end < len(buf) or eof):
+                if not expect_item:
+                    yield index, None, "invalid JSON: missing ',' between items"
+                    return
+                yield index, item, None
+                index += 1
+                pos = end
+                expect_item = False
+                continue
+        elif eof:
+            yield index, None, f"invalid JSON: unterminated {'object' if pairs else 'array'}"
+            return
+        text = next(chunks, None)
+        if text is None:
+            eof = True
+        else:
+            buf = buf[pos:] + text
+            pos = 0
+
+
+RECORD_FORMATS = ("json", "ndjson", "csv", "mapping")
+
+
+def iter_records(stream: BinaryIO, fmt: str = "json", chunk_size: int = _CHUNK) -> Iterator[StreamItem]:
+    """Items of an import body: ``json`` (array or NDJSON, sniffed), ``ndjson``,
+    ``csv`` (header line required) or ``mapping`` (one object, as [key, value])."""
+    if fmt in ("json", "ndjson"):
+        return iter_json_items(stream, chunk_size)
+    if fmt == "csv":
+        return iter_csv_items(stream, chunk_size)
+    if fmt == "mapping":
+        return iter_json_object_items(stream, chunk_size)
+    raise ValueError(f"format must be one of {', '.join(RECORD_FORMATS)}")
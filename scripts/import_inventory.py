@@ -0,0 +1,63 @@
+"""Bulk-import a device or VLAN profile inventory file into the NAC database.
+
+Streams JSON arrays, NDJSON or CSV (header line required) through the same
+importer as POST /devices/bulk, so multi-million row files load with bounded
+memory. The database is the one the backend uses (NAC_DB_PATH).
+
+    python scripts/import_inventory.py devices.ndjson
+    python scripts/import_inventory.py profiles.json --kind profiles --format mapping
+    python scripts/import_inventory.py devices.csv --on-conflict update --rejects rejects.ndjson
+"""
+import argparse
+import json
+import os
+import sys
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+_EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.json': 'json'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('--kind', choices=('devices', 'profiles'), default='devices')
+    parser.add_argument('--format', choices=('json', 'ndjson', 'csv', 'mapping'),
+                        help='default: from the file extension')
+    parser.add_argument('--on-conflict', choices=('skip', 'update'), default='skip')
+    parser.add_argument('--chunk', type=int, default=5000, help='rows parsed and validated at a time')
+    parser.add_argument('--max-rejects', type=int, default=1000)
+    parser.add_argument('--rejects', help='write rejected rows here as NDJSON')
+    args = parser.parse_args()
+    sys.path.insert(0, BACKEND)
+
+    from models.database import init_db
+    from models.inventory import import_devices, import_vlan_profiles
+    from utils.streaming import iter_records
+
+    fmt = args.format or _EXTENSIONS.get(os.path.splitext(args.path)[1].lower(), 'json')
+    importer = import_devices if args.kind == 'devices' else import_vlan_profiles
+    init_db()
+    with open(args.path, 'rb') as f:
+        report = importer(
+            iter_records(f, fmt),
+            on_conflict=args.on_conflict,
+            chunk_size=args.chunk,
+            max_rejects=args.max_rejects,
+        )
+    rejects = report.pop('rejects')
+    if args.rejects:
+        with open(args.rejects, 'w') as out:
+            for reject in rejects:
+                out.write(json.dumps(reject) + '\n')
+    print(f"received={report['received']} imported={report['imported']} skipped={report['skipped']} "
+          f"rejected={report['rejected']} elapsed={report['elapsedMs'] / 1000:.1f}s")
+    if report['rejectsTruncated']:
+        print(f"only the first {len(rejects)} rejects were kept")
+    if not args.rejects:
+        for reject in rejects[:10]:
+            print(f"  [{reject['index']}] {reject['error']}")
+
+
+if __name__ == '__main__':
+    main()
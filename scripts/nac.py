@@ -6,7 +6,7 @@ from datetime import datetime
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from backend.nac_controller import block_device, normalize_mac_hyphen_upper
-from backend.models.database import get_db_connection
+from backend.models.database import db_connection
 
 LOG_FILE = os.path.join(os.path.dirname(__file__), '..', 'logs', 'nac.log')
 
@@ -17,9 +17,8 @@ def log(message):
     print(message)
 
 def get_allowed_macs():
-    conn = get_db_connection()
-    macs = conn.execute('SELECT mac FROM devices WHERE authorized = 1').fetchall()
-    conn.close()
+    with db_connection() as conn:
+        macs = conn.execute('SELECT mac FROM devices WHERE authorized = 1').fetchall()
     return [normalize_mac_hyphen_upper(row['mac']) for row in macs]
 
 def get_mac_ip_mapping():
@@ -32,7 +31,7 @@ def get_mac_ip_mapping():
             log("No devices found in ARP table")
         else:
             log(f"Found {len(entries)} devices in ARP table")
-        return [(mac.upper().replace(":", "-"), ip) for ip, mac in entries]
+        return [(normalize_mac_hyphen_upper(mac), ip) for ip, mac in entries]
     except subprocess.CalledProcessError as e:
         log(f"Error running arp -a: {e}")
         return []